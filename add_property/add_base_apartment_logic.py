@@ -13,8 +13,9 @@ script_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.abspath(os.path.join(script_dir, '..'))
 sys.path.insert(0, project_root)
 
-from src.database.models import Apartment, UserRole #
+from src.database.models import Apartment, PointOfInterest, UserRole #
 from src.database.migrations import init_db #
+from src.database.catalog import bump_catalog_version
 
 # Загрузка переменных окружения
 load_dotenv(os.path.join(project_root, '.env')) # Указываем путь к .env
@@ -62,6 +63,10 @@ def create_city_folders_and_templates():
                         f.write(f"address=Базовая квартира в {city.capitalize()} (адрес)\n")
                         f.write("area_sqm=50.0\n")
                         f.write("num_bedrooms=1\n")
+                        f.write("# Координаты квартиры (необязательно), например latitude=7.8206\n")
+                        f.write("latitude=\n")
+                        f.write("longitude=\n")
+                        f.write("# Места рядом, по одному в строке: poi=Название, широта, долгота\n")
                 print(f"    \033[93m⚠ Создан шаблон: {filename}\033[0m")
         
         # Проверяем наличие локального видеофайла (для напоминания)
@@ -70,6 +75,43 @@ def create_city_folders_and_templates():
             print(f"    \033[93m⚠ ВНИМАНИЕ: Локальный видеофайл {REQUIRED_VIDEO_FILE_LOCAL} отсутствует в {city_path}. Его нужно добавить вручную.\033[0m")
     print("\033[94m--- Проверка папок и шаблонов завершена ---\033[0m")
 
+def parse_metadata(metadata_path: str):
+    """Читает metadata.txt: поля key=value и места рядом с квартирой (строки poi=...)
+
+    Пустые строки и строки, начинающиеся с #, пропускаются.
+    Возвращает словарь полей и список мест (название, широта, долгота).
+    """
+    metadata = {}
+    points = []
+    with open(metadata_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            key, value = line.split('=', 1)
+            key, value = key.strip(), value.strip()
+            if key == 'poi':
+                # Название может содержать запятые, координаты - последние два значения
+                name, lat, lon = (part.strip() for part in value.rsplit(',', 2))
+                points.append((name, parse_coordinate(lat, 90), parse_coordinate(lon, 180)))
+            else:
+                metadata[key] = value
+    return metadata, points
+
+def parse_coordinate(value: str, limit: float) -> float:
+    """Широта или долгота в градусах; ValueError, если значение вне допустимого диапазона"""
+    coordinate = float(value)
+    if not -limit <= coordinate <= limit:
+        raise ValueError(f"Координата {value} вне диапазона ±{limit}")
+    return coordinate
+
+def replace_points_of_interest(db_session: Session, city: str, points):
+    """Заменяет места рядом с квартирами города списком из metadata.txt"""
+    db_session.query(PointOfInterest).filter(PointOfInterest.city == city).delete()
+    db_session.add_all([
+        PointOfInterest(city=city, name=name, latitude=lat, longitude=lon) for name, lat, lon in points
+    ])
+
 async def upload_video_to_telegram(video_path: str) -> str | None:
     """Загружает видеофайл в Telegram и возвращает file_id."""
     print(f"  \033[96m📤 Загрузка видеофайла '{os.path.basename(video_path)}' в Telegram...\033[0m")
@@ -130,12 +172,17 @@ async def process_city_apartment(city: str) -> bool:
         with open(nearby_attractions_path, 'r', encoding='utf-8') as f:
             nearby_attractions = f.read().strip()
         
-        # Читаем метаданные
-        metadata = {}
-        with open(metadata_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                key, value = line.strip().split('=', 1)
-                metadata[key] = value
+        # Читаем метаданные и места рядом
+        try:
+            metadata, points = parse_metadata(metadata_path)
+            latitude = parse_coordinate(metadata['latitude'], 90) if metadata.get('latitude') else None
+            longitude = parse_coordinate(metadata['longitude'], 180) if metadata.get('longitude') else None
+        except ValueError as e:
+            print(f"\033[91m  ❌ ОШИБКА: Некорректная строка в 'metadata.txt' для '{city.capitalize()}': {e}\033[0m")
+            return False
+        if (latitude is None) != (longitude is None):
+            print(f"\033[91m  ❌ ОШИБКА: В 'metadata.txt' для '{city.capitalize()}' указана только одна координата.\033[0m")
+            return False
         
         # Извлекаем данные из метаданных, проверяем их
         address = metadata.get('address')
@@ -165,10 +212,11 @@ async def process_city_apartment(city: str) -> bool:
         ).first()
 
         if existing_apartment:
-            # Если квартира уже есть, используем её video_url (предполагаем, что это file_id)
+            # Если квартира уже есть, используем её file_id. Бот стирает file_id, который
+            # Telegram перестал принимать, и тогда видео загружается заново
             print(f"  \033[92m✔ Базовая квартира для города '{city.capitalize()}' уже существует в базе данных (ID: {existing_apartment.id}).\033[0m")
-            if existing_apartment.video_url and existing_apartment.video_url.startswith('BAAD'): # Простая проверка, что это похоже на Telegram file_id
-                apartment_video_id = existing_apartment.video_url
+            if existing_apartment.video_file_id or (existing_apartment.video_url and existing_apartment.video_url.startswith('BAAD')): # Простая проверка, что это похоже на Telegram file_id
+                apartment_video_id = existing_apartment.video_file_id or existing_apartment.video_url
                 print(f"  \033[96m♻️ Используется существующий file_id: {apartment_video_id}\033[0m")
             else:
                 print(f"  \033[93m⚠️ Существующая квартира не имеет file_id Telegram или он невалиден. Попытка перезагрузить видео.\033[0m")
@@ -187,9 +235,17 @@ async def process_city_apartment(city: str) -> bool:
             existing_apartment.status = "available"
             existing_apartment.area_sqm = area_sqm
             existing_apartment.num_bedrooms = num_bedrooms
+            existing_apartment.latitude = latitude
+            existing_apartment.longitude = longitude
             existing_apartment.video_url = apartment_video_id # Обновляем file_id
+            if existing_apartment.video_file_id != apartment_video_id:
+                # Бот отправляет видео по этому file_id; превью сохранит при первой отправке
+                existing_apartment.video_file_id = apartment_video_id
+                existing_apartment.video_thumbnail_file_id = None
 
             db_session.add(existing_apartment) # Добавляем для обновления
+            replace_points_of_interest(db_session, city, points)
+            bump_catalog_version(db_session) # Запущенные бот и веб-приложение сбросят кеш каталога
             db_session.commit()
             db_session.refresh(existing_apartment)
             print(f"  \033[92m✅ Базовая квартира для '{city.capitalize()}' успешно обновлена в базе данных. ID: {existing_apartment.id}\033[0m")
@@ -207,16 +263,21 @@ async def process_city_apartment(city: str) -> bool:
                 address=address,
                 description=description,
                 video_url=apartment_video_id, # Сохраняем file_id
+                video_file_id=apartment_video_id,
                 features=features,
                 nearby_attractions=nearby_attractions,
                 status="available",
                 area_sqm=area_sqm,
                 num_bedrooms=num_bedrooms,
+                latitude=latitude,
+                longitude=longitude,
                 apartment_type="Base", #
                 owner_id=None # Базовая квартира не имеет owner_id
             )
 
             db_session.add(new_apartment)
+            replace_points_of_interest(db_session, city, points)
+            bump_catalog_version(db_session) # Запущенные бот и веб-приложение сбросят кеш каталога
             db_session.commit()
             db_session.refresh(new_apartment)
             print(f"  \033[92m✅ Базовая квартира для '{city.capitalize()}' успешно добавлена в базу данных. ID: {new_apartment.id}\033[0m")
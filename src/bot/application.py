@@ -0,0 +1,43 @@
+import logging
+from typing import Optional
+from telegram import Update
+from telegram.ext import Application, ApplicationBuilder, CallbackQueryHandler, ContextTypes, MessageHandler, filters
+from bot.handlers import setup_handlers
+from bot.update_processor import ChatOrderedUpdateProcessor
+from config import BOT_TOKEN, BOT_MAX_CONCURRENT_UPDATES, BOT_MAX_PENDING_UPDATES
+from utils.metrics import register_metrics
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+async def log_all_updates(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    logger.info(f"ПОЛУЧЕН АПДЕЙТ: {update}")
+
+def build_application(builder: Optional[ApplicationBuilder] = None) -> Application:
+    """Создает приложение PTB со всеми обработчиками бота
+
+    Общая точка сборки для режима polling (src/main.py) и режима webhook
+    (веб-приложение).
+
+    Args:
+        builder: Заранее настроенный ApplicationBuilder, например без Updater для webhook
+    """
+    if not BOT_TOKEN:
+        raise ValueError("BOT_TOKEN не найден в .env файле")
+
+    builder = builder or Application.builder()
+    # Обновления разных чатов обрабатываются параллельно, одного чата - по порядку
+    update_processor = ChatOrderedUpdateProcessor(BOT_MAX_CONCURRENT_UPDATES, BOT_MAX_PENDING_UPDATES)
+    application = builder.token(BOT_TOKEN).concurrent_updates(update_processor).build()
+    register_metrics('bot_updates', lambda: {
+        **update_processor.stats(),
+        'update_queue': application.update_queue.qsize(),
+    })
+
+    # Настраиваем обработчики
+    setup_handlers(application)
+
+    # Логируем все сообщения и callback-и
+    application.add_handler(MessageHandler(filters.ALL, log_all_updates), group=999)
+    application.add_handler(CallbackQueryHandler(log_all_updates), group=999)
+    return application
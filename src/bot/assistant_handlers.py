@@ -0,0 +1,38 @@
+import logging
+from telegram import Update
+from telegram.ext import ContextTypes
+from bot.streaming_reply import StreamingReply
+from services.gemini_service import ERROR_REPLY, GeminiUnavailable, get_gemini_service
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Состояние разговора: текстовые сообщения считаются вопросами помощнику
+WAITING_QUESTION = 'waiting_question'
+
+def clear_question_state(context: ContextTypes.DEFAULT_TYPE):
+    """Выходит из режима вопросов помощнику, не трогая другие состояния разговора"""
+    if context.user_data.get('state') == WAITING_QUESTION:
+        del context.user_data['state']
+
+async def answer_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Ответ Gemini на вопрос пользователя; текст появляется в чате по мере генерации
+
+    Состояние WAITING_QUESTION действует на один вопрос: после ответа
+    следующие текстовые сообщения снова обрабатываются как обычно.
+    """
+    user_id = update.effective_user.id
+    reply = StreamingReply(update.message)
+    try:
+        async for chunk in get_gemini_service().stream_response(user_id, update.message.text):
+            await reply.append(chunk)
+    except GeminiUnavailable as e:
+        logger.error(f"Не удалось получить ответ Gemini для пользователя {user_id}: {str(e)}")
+        # Если часть ответа уже показана, сообщение об ошибке дописывается к ней
+        await reply.finish(f"\n\n{ERROR_REPLY}" if reply.text else ERROR_REPLY)
+    else:
+        await reply.finish(None if reply.text else ERROR_REPLY)
+        logger.info(f"Пользователю {user_id} отправлен ответ помощника ({len(reply.text)} символов, {reply.edits} правок)")
+    finally:
+        clear_question_state(context)
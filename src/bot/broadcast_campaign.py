@@ -0,0 +1,104 @@
+"""
+Управление рассылками
+
+    python src/bot/broadcast_campaign.py create --segment active_subscribers "Текст рассылки"
+    python src/bot/broadcast_campaign.py create --segment referrals --param 42 "Текст"
+    python src/bot/broadcast_campaign.py list
+    python src/bot/broadcast_campaign.py cancel 3
+
+Рассылку выполняет процесс бота (BroadcastRunner), команда только создает ее.
+"""
+import os
+import sys
+import argparse
+import asyncio
+import logging
+from dotenv import load_dotenv
+
+# Добавляем src в PYTHONPATH, чтобы скрипт можно было запускать напрямую
+src_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if src_path not in sys.path:
+    sys.path.insert(0, src_path)
+
+load_dotenv()
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    level=logging.INFO,
+    handlers=[
+        logging.FileHandler("bot.log", encoding="utf-8"),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+async def create(args: argparse.Namespace):
+    from database.migrations import get_async_session
+    from services.broadcast import create_campaign
+    async with get_async_session() as session:
+        campaign = await create_campaign(session, args.text, args.segment, args.param)
+    logger.info(f"Рассылка {campaign.id} создана, ее выполнит процесс бота")
+
+async def list_campaigns(args: argparse.Namespace):
+    from sqlalchemy import select
+    from database.migrations import get_async_session
+    from database.models import BroadcastCampaign
+    async with get_async_session() as session:
+        result = await session.execute(select(BroadcastCampaign).order_by(BroadcastCampaign.id.desc()).limit(args.limit))
+        for campaign in result.scalars():
+            segment = campaign.segment if campaign.segment_param is None else f"{campaign.segment}:{campaign.segment_param}"
+            logger.info(
+                f"#{campaign.id} {campaign.status} [{segment}] отправлено {campaign.sent_count}, "
+                f"ошибок {campaign.failed_count}, до users.id {campaign.last_user_id}"
+            )
+
+async def cancel(args: argparse.Namespace):
+    from sqlalchemy import update
+    from database.migrations import async_session_scope
+    from database.models import BroadcastCampaign
+    from services.broadcast import CANCELLED, PENDING, RUNNING
+    async with async_session_scope() as session:
+        result = await session.execute(
+            update(BroadcastCampaign)
+            .where(BroadcastCampaign.id == args.campaign_id, BroadcastCampaign.status.in_([PENDING, RUNNING]))
+            .values(status=CANCELLED)
+        )
+    if result.rowcount:
+        logger.info(f"Рассылка {args.campaign_id} отменена")
+    else:
+        logger.info(f"Рассылка {args.campaign_id} не найдена или уже завершена")
+
+COMMANDS = {
+    'create': create,
+    'list': list_campaigns,
+    'cancel': cancel,
+}
+
+def parse_args(argv=None) -> argparse.Namespace:
+    from services.broadcast import SEGMENTS
+    parser = argparse.ArgumentParser(description="Управление рассылками бота")
+    commands = parser.add_subparsers(dest='command', required=True)
+    create_parser = commands.add_parser('create', help="создать рассылку")
+    create_parser.add_argument('text', help="текст сообщения")
+    create_parser.add_argument('--segment', choices=SEGMENTS, default='all', help="получатели (по умолчанию all)")
+    create_parser.add_argument('--param', type=int, help="параметр сегмента: минимум ночей или id пригласившего")
+    list_parser = commands.add_parser('list', help="последние рассылки")
+    list_parser.add_argument('--limit', type=int, default=20)
+    cancel_parser = commands.add_parser('cancel', help="остановить рассылку")
+    cancel_parser.add_argument('campaign_id', type=int)
+    return parser.parse_args(argv)
+
+async def manage_campaigns(args: argparse.Namespace) -> bool:
+    from database.migrations import create_schema_async, dispose_async_engine
+    try:
+        await create_schema_async()
+        await COMMANDS[args.command](args)
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении команды {args.command}: {e}")
+        return False
+    finally:
+        await dispose_async_engine()
+
+if __name__ == '__main__':
+    sys.exit(0 if asyncio.run(manage_campaigns(parse_args())) else 1)
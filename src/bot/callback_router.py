@@ -0,0 +1,156 @@
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Версия формата callback_data; кнопки с другой версией считаются устаревшими
+CALLBACK_VERSION = "1"
+CALLBACK_SEPARATOR = ":"
+# Ограничение Telegram на длину callback_data в байтах
+CALLBACK_DATA_MAX_BYTES = 64
+
+# Коды действий инлайн-кнопок
+CB_PLAN_DATE = "pd"
+CB_PLAN_LATER = "pl"
+CB_MONTH = "m"
+CB_CITY = "c"
+CB_NO_AVAILABILITY = "na"
+CB_SUBSCRIBE_NOW = "sn"
+CB_ASK_QUESTION = "aq"
+CB_START_OVER = "so"
+CB_BACK_TO_MAIN_MENU = "bm"
+CB_BACK_TO_MONTH_SELECTION = "bs"
+CB_SUBSCRIBE = "s"
+CB_CHECK_PAYMENT = "cp"
+CB_CANCEL_SUBSCRIPTION = "cs"
+
+# callback_data кнопок, отправленных до введения версии, и соответствующие им действия
+LEGACY_CALLBACKS = {
+    "plan_date_choice": CB_PLAN_DATE,
+    "plan_later": CB_PLAN_LATER,
+    "subscribe_now": CB_SUBSCRIBE_NOW,
+    "ask_question": CB_ASK_QUESTION,
+    "start_over": CB_START_OVER,
+    "back_to_main_menu": CB_BACK_TO_MAIN_MENU,
+    "back_to_month_selection": CB_BACK_TO_MONTH_SELECTION,
+    "subscribe": CB_SUBSCRIBE,
+    "check_payment": CB_CHECK_PAYMENT,
+    "cancel_subscription": CB_CANCEL_SUBSCRIPTION,
+}
+
+STALE_BUTTON_TEXT = "Эта кнопка устарела. Отправьте /start, чтобы начать сначала."
+
+CallbackHandler = Callable[..., Awaitable[Any]]
+
+
+class InvalidCallbackData(ValueError):
+    """callback_data не соответствует ни одному действию или его параметрам"""
+
+
+class CallbackRoute:
+    """Действие инлайн-кнопки: обработчик и преобразователи его параметров в порядке следования"""
+
+    def __init__(self, code: str, handler: CallbackHandler, params: Dict[str, Callable[[str], Any]], answer: bool):
+        self.code = code
+        self.handler = handler
+        self.names = tuple(params)
+        self.converters = tuple(params.values())
+        # Отвечать ли на callback до вызова обработчика (иначе обработчик отвечает сам)
+        self.answer = answer
+
+
+class CallbackRouter:
+    """
+    Маршрутизация нажатий инлайн-кнопок по коду действия.
+
+    callback_data имеет вид "<версия>:<код>[:<параметр>...]". Разбор выполняется
+    один раз, обработчик находится по словарю кодов. Последний параметр забирает
+    остаток строки, поэтому разделитель и подчеркивания в значениях (например,
+    в названиях городов) не ломают разбор. Параметры проверяются преобразователями,
+    объявленными при регистрации действия: ошибка преобразования - устаревшая
+    или подделанная кнопка, обработчик не вызывается.
+    """
+
+    def __init__(self, version: str = CALLBACK_VERSION, legacy: Optional[Dict[str, str]] = None):
+        self.version = version
+        self.legacy = legacy or {}
+        self.routes: Dict[str, CallbackRoute] = {}
+
+    def add(self, code: str, handler: CallbackHandler, answer: bool = True, **params: Callable[[str], Any]):
+        """Регистрирует обработчик действия; params - имена и преобразователи параметров"""
+        if CALLBACK_SEPARATOR in code:
+            raise ValueError(f"Код действия не может содержать '{CALLBACK_SEPARATOR}': {code}")
+        if code in self.routes:
+            raise ValueError(f"Действие {code} уже зарегистрировано")
+        self.routes[code] = CallbackRoute(code, handler, params, answer)
+        return handler
+
+    def route(self, code: str, answer: bool = True, **params: Callable[[str], Any]):
+        """Декоратор для add"""
+        def decorator(handler: CallbackHandler) -> CallbackHandler:
+            return self.add(code, handler, answer=answer, **params)
+        return decorator
+
+    def encode(self, code: str, *args: Any) -> str:
+        """Собирает callback_data для кнопки"""
+        values = [str(arg) for arg in args]
+        if any(CALLBACK_SEPARATOR in value for value in values[:-1]):
+            raise ValueError(f"Только последний параметр может содержать '{CALLBACK_SEPARATOR}': {values}")
+        data = CALLBACK_SEPARATOR.join([self.version, code, *values])
+        if len(data.encode('utf-8')) > CALLBACK_DATA_MAX_BYTES:
+            raise ValueError(f"callback_data длиннее {CALLBACK_DATA_MAX_BYTES} байт: {data}")
+        return data
+
+    def parse(self, data: Optional[str]) -> Tuple[CallbackRoute, Dict[str, Any]]:
+        """Возвращает действие и его проверенные параметры"""
+        if not data:
+            raise InvalidCallbackData("Пустой callback_data")
+        version, _, payload = data.partition(CALLBACK_SEPARATOR)
+        if version != self.version or not payload:
+            code = self.legacy.get(data)
+            if code is None:
+                raise InvalidCallbackData(f"Неизвестный формат callback_data: {data}")
+            return self.routes[code], {}
+        code, _, rest = payload.partition(CALLBACK_SEPARATOR)
+        route = self.routes.get(code)
+        if route is None:
+            raise InvalidCallbackData(f"Неизвестное действие: {data}")
+        if not route.names:
+            if rest:
+                raise InvalidCallbackData(f"Лишние параметры: {data}")
+            return route, {}
+        values = rest.split(CALLBACK_SEPARATOR, len(route.names) - 1)
+        if len(values) != len(route.names):
+            raise InvalidCallbackData(f"Ожидается параметров: {len(route.names)}: {data}")
+        try:
+            params = {name: convert(value) for name, convert, value in zip(route.names, route.converters, values)}
+        except (TypeError, ValueError) as e:
+            raise InvalidCallbackData(f"Недопустимый параметр в {data}: {e}") from e
+        return route, params
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Единственный обработчик CallbackQuery бота"""
+        query = update.callback_query
+        try:
+            route, params = self.parse(query.data)
+        except InvalidCallbackData as e:
+            logger.warning(f"Нажатие пользователя {query.from_user.id} не распознано: {e}")
+            await query.answer(STALE_BUTTON_TEXT, show_alert=True)
+            return
+        logger.info(f"Получен callback_data: {query.data} от пользователя {query.from_user.id}")
+        if route.answer:
+            await query.answer()
+        await route.handler(update, context, **params)
+
+
+# Общий маршрутизатор бота: действия регистрируются в bot.handlers
+callback_router = CallbackRouter(legacy=LEGACY_CALLBACKS)
+
+
+def callback_data(code: str, *args: Any) -> str:
+    """callback_data для кнопки действия общего маршрутизатора"""
+    return callback_router.encode(code, *args)
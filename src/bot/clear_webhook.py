@@ -1,8 +1,23 @@
+"""
+Управление вебхуком Telegram
+
+    python src/bot/clear_webhook.py                 # удалить вебхук (для режима polling)
+    python src/bot/clear_webhook.py delete --drop-pending-updates
+    python src/bot/clear_webhook.py set [--url URL] # установить вебхук (для режима webhook)
+    python src/bot/clear_webhook.py info            # текущие настройки вебхука
+"""
 import os
-from dotenv import load_dotenv
-from telegram import Bot
+import sys
+import argparse
 import asyncio
 import logging
+from dotenv import load_dotenv
+from telegram import Bot
+
+# Добавляем src в PYTHONPATH, чтобы скрипт можно было запускать напрямую
+src_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if src_path not in sys.path:
+    sys.path.insert(0, src_path)
 
 load_dotenv()
 BOT_TOKEN = os.getenv('BOT_TOKEN')
@@ -17,20 +32,48 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-async def clear_webhook():
+async def delete_webhook(bot: Bot, args: argparse.Namespace):
+    await bot.delete_webhook(drop_pending_updates=args.drop_pending_updates)
+    logger.info("Вебхук успешно удален (если он был установлен).")
+
+async def set_webhook(bot: Bot, args: argparse.Namespace):
+    from bot.webhook import set_webhook as register_webhook
+    await register_webhook(bot, url=args.url, drop_pending_updates=args.drop_pending_updates)
+
+async def webhook_info(bot: Bot, args: argparse.Namespace):
+    info = await bot.get_webhook_info()
+    logger.info(f"URL: {info.url or '(не установлен)'}")
+    logger.info(f"Ожидающих обновлений: {info.pending_update_count}")
+    if info.last_error_message:
+        logger.info(f"Последняя ошибка: {info.last_error_message} ({info.last_error_date})")
+
+COMMANDS = {
+    'delete': delete_webhook,
+    'set': set_webhook,
+    'info': webhook_info,
+}
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Управление вебхуком Telegram бота")
+    parser.add_argument('command', nargs='?', choices=COMMANDS, default='delete',
+                        help="delete (по умолчанию), set или info")
+    parser.add_argument('--url', help="адрес вебхука для set; по умолчанию WEBHOOK_URL + WEBHOOK_PATH")
+    parser.add_argument('--drop-pending-updates', action='store_true',
+                        help="отбросить обновления, накопленные в Telegram")
+    return parser.parse_args(argv)
+
+async def manage_webhook(args: argparse.Namespace) -> bool:
     if not BOT_TOKEN:
-        print("BOT_TOKEN не найден в .env")
         logger.error("BOT_TOKEN не найден в .env")
-        return
+        return False
 
-    bot = Bot(token=BOT_TOKEN)
     try:
-        await bot.delete_webhook()
-        print("Вебхук успешно удален (если он был установлен).")
-        logger.info("Вебхук успешно удален (если он был установлен).")
+        async with Bot(token=BOT_TOKEN) as bot:
+            await COMMANDS[args.command](bot, args)
+        return True
     except Exception as e:
-        print(f"Ошибка при удалении вебхука: {e}")
-        logger.error(f"Ошибка при удалении вебхука: {e}")
+        logger.error(f"Ошибка при выполнении команды {args.command}: {e}")
+        return False
 
 if __name__ == '__main__':
-    asyncio.run(clear_webhook())
\ No newline at end of file
+    sys.exit(0 if asyncio.run(manage_webhook(parse_args())) else 1)
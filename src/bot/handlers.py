@@ -1,18 +1,25 @@
 import asyncio
 import logging
-from datetime import datetime, timedelta
-from typing import Dict, Any
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, Optional
 
-from sqlalchemy.orm import Session
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Bot
 from telegram.ext import ContextTypes, CallbackQueryHandler, CommandHandler, MessageHandler, filters, Application
 
 from database.models import User, Subscription, Payment, PaymentStatus, Apartment
-from database.migrations import init_db
-from utils.helpers import get_nearest_available_date, format_apartment_info
-from ton.ton_client import TONClient
+from config import MIN_NIGHTS_FOR_VACATION, THAILAND_CITIES
+from services.availability import get_availability_engine, upcoming_months
+from services.catalog_cache import get_catalog_cache
+from services.nearby import format_nearby_points, get_nearby_search
 import os
 from dotenv import load_dotenv
+from .callback_router import (
+    CB_ASK_QUESTION, CB_BACK_TO_MAIN_MENU, CB_BACK_TO_MONTH_SELECTION, CB_CANCEL_SUBSCRIPTION, CB_CHECK_PAYMENT,
+    CB_CITY, CB_MONTH, CB_NO_AVAILABILITY, CB_PLAN_DATE, CB_PLAN_LATER, CB_START_OVER, CB_SUBSCRIBE,
+    CB_SUBSCRIBE_NOW, callback_data, callback_router
+)
+from .assistant_handlers import WAITING_QUESTION, answer_question, clear_question_state
+from .video_tours import get_video_tours
 from .subscription_handlers import (
     subscribe,
     handle_name_input,
@@ -35,9 +42,6 @@ MONTH_NAMES_RU = {
     9: "Сентябрь", 10: "Октябрь", 11: "Ноябрь", 12: "Декабрь"
 }
 
-# Список городов Таиланда из ТЗ
-THAILAND_CITIES = ["Пхукет", "Бангкок", "Паттайя", "Самуи", "Пхи-Пхи", "Краби"]
-
 async def type_message(update_or_query: Update | Any, text: str, reply_markup=None, is_edit: bool = False):
     """Универсально отправляет или редактирует сообщение, поддерживает message и callback_query."""
     # Определяем chat_id, message_id и bot_instance
@@ -76,9 +80,24 @@ async def type_message(update_or_query: Update | Any, text: str, reply_markup=No
     elif bot_instance and chat_id:
         await bot_instance.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
 
+async def get_nearest_available_date(city: Optional[str] = None) -> Optional[date]:
+    """Ближайшая дата заезда на минимальный отпуск по календарям занятости квартир"""
+    engine = await get_availability_engine().ensure_loaded()
+    return engine.earliest_start(city, nights=MIN_NIGHTS_FOR_VACATION)
+
+def build_plan_question(available_date: Optional[date]) -> str:
+    """Вопрос о планировании отпуска с ближайшей свободной датой"""
+    if available_date is None:
+        return f"Когда вы планируете свой отпуск?\n\nСвободных дат для {MIN_NIGHTS_FOR_VACATION} ночей сейчас нет"
+    return (
+        f"Когда вы планируете свой отпуск?\n\n"
+        f"Ближайшая доступная дата для {MIN_NIGHTS_FOR_VACATION} ночей: {available_date.strftime('%d.%m.%Y')}"
+    )
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
     logger.info(f"Получена команда /start от пользователя {update.effective_user.id}")
+    clear_question_state(context)
     welcome_message = """
 Добро пожаловать в OtpuskPass_bot!
 
@@ -98,17 +117,12 @@ OtpuskPass_bot — ваш пропуск в мир беззаботного от
     # Отправляем приветственное сообщение
     await type_message(update, welcome_message)
 
-    # Получаем ближайшую доступную дату
-    current_date = datetime.now()
-    available_date_for_7_nights = get_nearest_available_date(current_date, min_nights=7)
-    formatted_available_date = available_date_for_7_nights.strftime("%d.%m.%Y")
-
-    # Отправляем вопрос о планировании отпуска
-    question_text = f"Когда вы планируете свой отпуск?\n\nБлижайшая доступная дата для 7 ночей: {formatted_available_date}"
+    # Отправляем вопрос о планировании отпуска с ближайшей доступной датой
+    question_text = build_plan_question(await get_nearest_available_date())
     keyboard = [
         [
-            InlineKeyboardButton("ДАТА", callback_data="plan_date_choice"),
-            InlineKeyboardButton("ОПРЕДЕЛЮСЬ ПОЗЖЕ", callback_data="plan_later")
+            InlineKeyboardButton("ДАТА", callback_data=callback_data(CB_PLAN_DATE)),
+            InlineKeyboardButton("ОПРЕДЕЛЮСЬ ПОЗЖЕ", callback_data=callback_data(CB_PLAN_LATER))
         ]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -116,167 +130,188 @@ OtpuskPass_bot — ваш пропуск в мир беззаботного от
 
 async def send_month_selection(query: Any):
     """Отправляет сообщение с кнопками выбора месяца."""
-    current_date = datetime.now()
-    nearest_available_date = get_nearest_available_date(current_date, min_nights=7)
-    nearest_month_name_ru = MONTH_NAMES_RU[nearest_available_date.month]
-    nearest_month_year = nearest_available_date.year
-
-    month_question_text = (
-        f"На какой месяц планируете в отпуск в Таиланде? "
-        f"Ближайший доступный месяц - {nearest_month_name_ru} {nearest_month_year} года."
-    )
+    nearest_available_date = await get_nearest_available_date()
+    month_question_text = "На какой месяц планируете в отпуск в Таиланде? "
+    if nearest_available_date:
+        nearest_month_name_ru = MONTH_NAMES_RU[nearest_available_date.month]
+        month_question_text += f"Ближайший доступный месяц - {nearest_month_name_ru} {nearest_available_date.year} года."
+    else:
+        month_question_text += "Сейчас свободных квартир нет, но вы можете выбрать месяц заранее."
+
+    # Ближайшие 12 месяцев со свободными ночами; месяцы без окна на минимальный отпуск помечены
+    engine = await get_availability_engine().ensure_loaded()
+    free_nights = engine.free_nights_by_month()
+    with_capacity = set(engine.months_with_capacity(nights=MIN_NIGHTS_FOR_VACATION))
+    buttons = []
+    for year, month in upcoming_months(date.today()):
+        month_name = MONTH_NAMES_RU[month]
+        if (year, month) in with_capacity:
+            buttons.append(InlineKeyboardButton(
+                f"{month_name} ({free_nights[(year, month)]})", callback_data=callback_data(CB_MONTH, year, month)
+            ))
+        else:
+            buttons.append(InlineKeyboardButton(f"{month_name} ✕", callback_data=callback_data(CB_NO_AVAILABILITY)))
 
-    months_list = list(MONTH_NAMES_RU.values())
-    
-    keyboard = []
-    for i in range(0, len(months_list), 3):
-        row = []
-        for j in range(3):
-            if (i + j) < len(months_list):
-                month_name = months_list[i+j]
-                month_number = list(MONTH_NAMES_RU.keys())[list(MONTH_NAMES_RU.values()).index(month_name)]
-                row.append(InlineKeyboardButton(month_name, callback_data=f"select_month_{month_number}"))
-        if row:
-            keyboard.append(row)
-    
-    keyboard.append([InlineKeyboardButton("Вернуться назад", callback_data="back_to_main_menu")])
+    keyboard = [buttons[i:i + 3] for i in range(0, len(buttons), 3)]
+
+    keyboard.append([InlineKeyboardButton("Вернуться назад", callback_data=callback_data(CB_BACK_TO_MAIN_MENU))])
 
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text(text=month_question_text, reply_markup=reply_markup)
     logger.info("Отправлены кнопки выбора месяца.")
 
-async def send_city_selection(query: Any, selected_month_name: str):
-    """Отправляет сообщение с кнопками выбора города."""
+async def send_city_selection(query: Any, selected_month_name: str, selected_month: Optional[tuple] = None):
+    """Отправляет сообщение с кнопками выбора города.
+
+    Если передан месяц (год, месяц), у городов указывается число свободных ночей,
+    а города без окна на минимальный отпуск в этом месяце помечаются.
+    """
     city_question_text = (
         f"Отлично, {selected_month_name} - прекрасный месяц для поездки в Таиланд. "
         f"В каком городе вы хотели бы отдохнуть? На стоимость подписки это не влияет, поэтому выбирайте по душе!"
     )
 
-    keyboard = []
-    for i in range(0, len(THAILAND_CITIES), 2):
-        row = []
-        for j in range(2):
-            if (i + j) < len(THAILAND_CITIES):
-                city = THAILAND_CITIES[i+j]
-                row.append(InlineKeyboardButton(city, callback_data=f"select_city_{city}"))
-        if row:
-            keyboard.append(row)
-    
-    keyboard.append([InlineKeyboardButton("Вернуться назад", callback_data="back_to_month_selection")])
+    buttons = []
+    if selected_month:
+        engine = await get_availability_engine().ensure_loaded()
+        free_nights = engine.free_nights_by_city(*selected_month)
+    for city in THAILAND_CITIES:
+        if not selected_month:
+            buttons.append(InlineKeyboardButton(city, callback_data=callback_data(CB_CITY, city)))
+        elif selected_month in engine.months_with_capacity(city, nights=MIN_NIGHTS_FOR_VACATION):
+            buttons.append(InlineKeyboardButton(f"{city} ({free_nights.get(city, 0)})", callback_data=callback_data(CB_CITY, city)))
+        else:
+            buttons.append(InlineKeyboardButton(f"{city} ✕", callback_data=callback_data(CB_NO_AVAILABILITY)))
+
+    keyboard = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+
+    keyboard.append([InlineKeyboardButton("Вернуться назад", callback_data=callback_data(CB_BACK_TO_MONTH_SELECTION))])
 
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text(text=city_question_text, reply_markup=reply_markup)
     logger.info(f"Отправлены кнопки выбора города после выбора месяца {selected_month_name}.")
 
 async def offer_apartment(query: Any, city_name: str):
-    """Получает информацию о базовой квартире из БД и предлагает ее пользователю."""
-    db_session = init_db()
-    try:
-        apartment = db_session.query(Apartment).filter(
-            Apartment.city == city_name,
-            Apartment.apartment_type == "Base"
-        ).first()
-
-        if not apartment:
-            error_message = f"Извините, для города {city_name} базовая квартира пока не найдена. Пожалуйста, попробуйте другой город или обратитесь в поддержку."
-            await type_message(query, error_message, is_edit=True)
-            logger.warning(f"Базовая квартира для города {city_name} не найдена в БД.")
-            await send_city_selection(query, "выбранный месяц")
-            return
-
-        apartment_info = format_apartment_info({
-            'city': apartment.city,
-            'address': apartment.address,
-            'area_sqm': apartment.area_sqm,
-            'num_bedrooms': apartment.num_bedrooms,
-            'description': apartment.description,
-            'features': apartment.features,
-            'nearby_attractions': apartment.nearby_attractions
-        })
-
-        if apartment.video_url:
-            await query.message.reply_video(video=apartment.video_url, caption="Видео-тур по квартире:")
-            logger.info(f"Отправлен видео-тур для квартиры в {city_name}.")
-
-        offer_message = f"На эти даты есть прекрасная квартира бизнес-класса в {apartment.city}.\n\n" + apartment_info
-        await type_message(query, offer_message, is_edit=False)
-
-        action_message = "У вас остались вопросы?"
-        keyboard = [
-            [InlineKeyboardButton("Оформить подписку", callback_data="subscribe_now")],
-            [InlineKeyboardButton("Задать вопрос", callback_data="ask_question")],
-            [InlineKeyboardButton("Вернуться в начало", callback_data="start_over")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await type_message(query, action_message, reply_markup=reply_markup, is_edit=False)
-        logger.info(f"Информация о квартире в {city_name} отправлена пользователю.")
+    """Предлагает пользователю базовую квартиру города из кеша каталога."""
+    city_catalog = await get_catalog_cache().get_city(city_name)
+
+    if not city_catalog.base:
+        error_message = f"Извините, для города {city_name} базовая квартира пока не найдена. Пожалуйста, попробуйте другой город или обратитесь в поддержку."
+        await type_message(query, error_message, is_edit=True)
+        logger.warning(f"Базовая квартира для города {city_name} не найдена в БД.")
+        await send_city_selection(query, "выбранный месяц")
+        return
+
+    # После первой отправки видео уходит по file_id, без передачи файла
+    if await get_video_tours().send(query.message, city_catalog.base, caption="Видео-тур по квартире:"):
+        logger.info(f"Отправлен видео-тур для квартиры в {city_name}.")
+
+    offer_text = city_catalog.offer_text
+    # Ближайшие места берутся из геоиндекса в памяти, без запросов к БД
+    nearby_points = await get_nearby_search().points_near(city_catalog.base)
+    if nearby_points:
+        offer_text += f"\n🗺 Поблизости:\n{format_nearby_points(nearby_points)}\n"
+    await type_message(query, offer_text, is_edit=False)
+
+    action_message = "У вас остались вопросы?"
+    await type_message(query, action_message, reply_markup=city_catalog.reply_markup, is_edit=False)
+    logger.info(f"Информация о квартире в {city_name} отправлена пользователю.")
+
+def parse_month(value: str) -> int:
+    """Номер месяца из callback_data"""
+    month = int(value)
+    if month not in MONTH_NAMES_RU:
+        raise ValueError(f"Недопустимый месяц: {value}")
+    return month
+
+def parse_city(value: str) -> str:
+    """Город из callback_data; принимаются только города из списка"""
+    if value not in THAILAND_CITIES:
+        raise ValueError(f"Неизвестный город: {value}")
+    return value
+
+@callback_router.route(CB_NO_AVAILABILITY, answer=False)
+async def no_availability(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Нажатие на месяц или город без свободных квартир"""
+    await update.callback_query.answer("На это время свободных квартир нет. Выберите другой вариант.", show_alert=True)
+
+@callback_router.route(CB_PLAN_DATE)
+async def plan_date_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await send_month_selection(update.callback_query)
+    logger.info("Пользователь выбрал 'ДАТА'. Отправлены кнопки выбора месяца.")
+
+@callback_router.route(CB_PLAN_LATER)
+async def plan_later(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    subscribe_message = "У вас остались вопросы? Если вы готовы, предлагаем оформить подписку."
+    keyboard = [
+        [InlineKeyboardButton("Оформить подписку", callback_data=callback_data(CB_SUBSCRIBE_NOW))],
+        [InlineKeyboardButton("Задать вопрос", callback_data=callback_data(CB_ASK_QUESTION))],
+        [InlineKeyboardButton("Вернуться в начало", callback_data=callback_data(CB_START_OVER))]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await type_message(update.callback_query, subscribe_message, reply_markup=reply_markup, is_edit=True)
+    logger.info("Пользователь выбрал 'Определюсь позже', предложено оформить подписку.")
 
-    finally:
-        db_session.close()
+@callback_router.route(CB_MONTH, year=int, month=parse_month)
+async def select_month(update: Update, context: ContextTypes.DEFAULT_TYPE, year: int, month: int):
+    await send_city_selection(update.callback_query, MONTH_NAMES_RU[month], (year, month))
 
-async def button_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик нажатий на инлайн-кнопки"""
+@callback_router.route(CB_CITY, city=parse_city)
+async def select_city(update: Update, context: ContextTypes.DEFAULT_TYPE, city: str):
     query = update.callback_query
-    await query.answer()
-
-    logger.info(f"Получен callback_data: {query.data} от пользователя {query.from_user.id}")
-
-    if query.data == "plan_date_choice":
-        await send_month_selection(query)
-        logger.info("Пользователь выбрал 'ДАТА'. Отправлены кнопки выбора месяца.")
-    elif query.data == "plan_later":
-        subscribe_message = "У вас остались вопросы? Если вы готовы, предлагаем оформить подписку."
-        keyboard = [
-            [InlineKeyboardButton("Оформить подписку", callback_data="subscribe_now")],
-            [InlineKeyboardButton("Задать вопрос", callback_data="ask_question")],
-            [InlineKeyboardButton("Вернуться в начало", callback_data="start_over")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await type_message(query, subscribe_message, reply_markup=reply_markup, is_edit=True)
-        logger.info("Пользователь выбрал 'Определюсь позже', предложено оформить подписку.")
-    
-    elif query.data.startswith("select_month_"):
-        month_number = int(query.data.split('_')[2])
-        selected_month_name = MONTH_NAMES_RU[month_number]
-        await send_city_selection(query, selected_month_name)
-    
-    elif query.data.startswith("select_city_"):
-        city_name = query.data.split('_')[2]
-        await type_message(query, f"Вы выбрали город: {city_name}. Теперь я подберу для вас квартиру. Минуточку...", is_edit=True)
-        await asyncio.sleep(2)
-        await offer_apartment(query, city_name)
-        logger.info(f"Пользователь выбрал город: {city_name}. Запущен подбор квартиры.")
-
-    elif query.data == "subscribe_now":
-        await type_message(query, "Отлично! Для оформления подписки, пожалуйста, введите ваше Имя и Фамилию.", is_edit=True)
-        logger.info("Пользователь выбрал 'Оформить подписку'.")
-    elif query.data == "ask_question":
-        await type_message(query, "Пожалуйста, задайте свой вопрос. Я постараюсь на него ответить или свяжу вас с поддержкой.", is_edit=True)
-        logger.info("Пользователь выбрал 'Задать вопрос'.")
-    elif query.data == "start_over":
-        await type_message(query, "Вы вернулись в начало. Отправьте /start снова, чтобы увидеть приветствие.", is_edit=False)
-        logger.info("Пользователь выбрал 'Вернуться в начало'.")
-
-    elif query.data == "back_to_main_menu":
-        current_date = datetime.now()
-        available_date_for_7_nights = get_nearest_available_date(current_date, min_nights=7)
-        formatted_available_date = available_date_for_7_nights.strftime("%d.%m.%Y")
-
-        question_text = f"Когда вы планируете свой отпуск?\n\nБлижайшая доступная дата для 7 ночей: {formatted_available_date}"
-
-        keyboard = [
-            [
-                InlineKeyboardButton("ДАТА", callback_data="plan_date_choice"),
-                InlineKeyboardButton("ОПРЕДЕЛЮСЬ ПОЗЖЕ", callback_data="plan_later")
-            ]
+    await type_message(query, f"Вы выбрали город: {city}. Теперь я подберу для вас квартиру. Минуточку...", is_edit=True)
+    await asyncio.sleep(2)
+    await offer_apartment(query, city)
+    logger.info(f"Пользователь выбрал город: {city}. Запущен подбор квартиры.")
+
+@callback_router.route(CB_SUBSCRIBE_NOW)
+async def subscribe_now(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await type_message(update.callback_query, "Отлично! Для оформления подписки, пожалуйста, введите ваше Имя и Фамилию.", is_edit=True)
+    logger.info("Пользователь выбрал 'Оформить подписку'.")
+
+@callback_router.route(CB_ASK_QUESTION)
+async def ask_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Следующие текстовые сообщения пользователя уходят помощнику
+    context.user_data['state'] = WAITING_QUESTION
+    await type_message(update.callback_query, "Пожалуйста, задайте свой вопрос. Я постараюсь на него ответить или свяжу вас с поддержкой.", is_edit=True)
+    logger.info("Пользователь выбрал 'Задать вопрос'.")
+
+@callback_router.route(CB_START_OVER)
+async def start_over(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    clear_question_state(context)
+    await type_message(update.callback_query, "Вы вернулись в начало. Отправьте /start снова, чтобы увидеть приветствие.", is_edit=False)
+    logger.info("Пользователь выбрал 'Вернуться в начало'.")
+
+@callback_router.route(CB_BACK_TO_MAIN_MENU)
+async def back_to_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    question_text = build_plan_question(await get_nearest_available_date())
+
+    keyboard = [
+        [
+            InlineKeyboardButton("ДАТА", callback_data=callback_data(CB_PLAN_DATE)),
+            InlineKeyboardButton("ОПРЕДЕЛЮСЬ ПОЗЖЕ", callback_data=callback_data(CB_PLAN_LATER))
         ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await type_message(query, question_text, reply_markup=reply_markup, is_edit=True)
-        logger.info("Пользователь вернулся к главному меню планирования отпуска.")
-    
-    elif query.data == "back_to_month_selection":
-        await send_month_selection(query)
-        logger.info("Пользователь вернулся к выбору месяца.")
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await type_message(update.callback_query, question_text, reply_markup=reply_markup, is_edit=True)
+    logger.info("Пользователь вернулся к главному меню планирования отпуска.")
+
+@callback_router.route(CB_BACK_TO_MONTH_SELECTION)
+async def back_to_month_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await send_month_selection(update.callback_query)
+    logger.info("Пользователь вернулся к выбору месяца.")
+
+# Обработчики подписки; check_payment сам отвечает на callback
+callback_router.add(CB_SUBSCRIBE, subscribe)
+callback_router.add(CB_CHECK_PAYMENT, check_payment, answer=False)
+callback_router.add(CB_CANCEL_SUBSCRIPTION, cancel_subscription)
+
+async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Текстовые сообщения: вопрос помощнику или ввод имени при оформлении подписки"""
+    if context.user_data.get('state') == WAITING_QUESTION:
+        await answer_question(update, context)
+    else:
+        await handle_name_input(update, context)
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик ошибок"""
@@ -292,17 +327,11 @@ def setup_handlers(application: Application):
     # Базовые команды
     application.add_handler(CommandHandler("start", start))
     
-    # Обработчики подписок
-    application.add_handler(CallbackQueryHandler(subscribe, pattern="^subscribe$"))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_name_input))
-    application.add_handler(CallbackQueryHandler(check_payment, pattern="^check_payment$"))
-    application.add_handler(CallbackQueryHandler(cancel_subscription, pattern="^cancel_subscription$"))
-    
-    # Обработчики бронирования
-    application.add_handler(CallbackQueryHandler(send_month_selection, pattern="^book$"))
-    application.add_handler(CallbackQueryHandler(send_city_selection, pattern="^month_"))
-    application.add_handler(CallbackQueryHandler(offer_apartment, pattern="^city_"))
-    application.add_handler(CallbackQueryHandler(button_callback_handler))
+    # Ввод имени при оформлении подписки и вопросы помощнику
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
+
+    # Все инлайн-кнопки: один обработчик, действие выбирается по коду из callback_data
+    application.add_handler(CallbackQueryHandler(callback_router.dispatch))
     
     # Обработчик ошибок
     application.add_error_handler(error_handler)
\ No newline at end of file
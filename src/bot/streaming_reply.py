@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import time
+from typing import Callable, List, Optional
+
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter
+
+from config import GEMINI_STREAM_EDIT_INTERVAL
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Ограничение Telegram на длину текста сообщения
+MESSAGE_MAX_LENGTH = 4096
+# Попытки показать текст, который нельзя пропустить: итог ответа и заполненное сообщение
+REQUIRED_EDIT_ATTEMPTS = 3
+
+
+class StreamingReply:
+    """
+    Ответ, который показывается пользователю по мере поступления текста.
+
+    Первый фрагмент отправляется сразу новым сообщением, дальше сообщение
+    редактируется не чаще одного раза в edit_interval секунд: фрагменты,
+    пришедшие между правками, объединяются в одну правку. Текст длиннее
+    лимита Telegram продолжается в следующем сообщении. Если Telegram просит
+    подождать, промежуточная правка пропускается, а итоговая и заполненное
+    до лимита сообщение отправляются после ожидания.
+    """
+
+    def __init__(self, reply_to: Message, edit_interval: float = GEMINI_STREAM_EDIT_INTERVAL,
+                 clock: Callable[[], float] = time.monotonic):
+        self.reply_to = reply_to
+        self.edit_interval = edit_interval
+        self.clock = clock
+        self.messages: List[Message] = []
+        self.edits = 0
+        self._text = ""
+        # Начало текста текущего сообщения, само сообщение и показанный в нем текст
+        self._offset = 0
+        self._current: Optional[Message] = None
+        self._shown = ""
+        self._next_edit_at = 0.0
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    async def _show(self, text: str, required: bool = False):
+        """
+        Отправляет или редактирует текущее сообщение
+
+        Промежуточная правка при RetryAfter пропускается: следующая покажет накопившийся
+        текст. Обязательная (required) повторяется после ожидания, которое просит Telegram.
+        """
+        for attempt in range(REQUIRED_EDIT_ATTEMPTS if required else 1):
+            try:
+                if self._current is None:
+                    self._current = await self.reply_to.reply_text(text)
+                    self.messages.append(self._current)
+                else:
+                    await self._current.edit_text(text)
+                    self.edits += 1
+                self._shown = text
+            except RetryAfter as e:
+                logger.warning(f"Telegram просит подождать {e.retry_after} с перед правкой ответа")
+                self._next_edit_at = self.clock() + float(e.retry_after)
+                if required and attempt + 1 < REQUIRED_EDIT_ATTEMPTS:
+                    await asyncio.sleep(float(e.retry_after))
+                    continue
+                if required:
+                    logger.error(f"Не удалось показать ответ после {REQUIRED_EDIT_ATTEMPTS} попыток")
+                return
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    raise
+                self._shown = text
+            break
+        self._next_edit_at = self.clock() + self.edit_interval
+
+    async def _complete_full_messages(self):
+        """Дописывает заполненные до лимита сообщения; остаток текста пойдет в следующее"""
+        while len(self._text) - self._offset > MESSAGE_MAX_LENGTH:
+            await self._show(self._text[self._offset:self._offset + MESSAGE_MAX_LENGTH], required=True)
+            self._offset += MESSAGE_MAX_LENGTH
+            self._current = None
+            self._shown = ""
+
+    async def append(self, chunk: str):
+        """Добавляет фрагмент; сообщение обновляется, если с прошлой правки прошел интервал"""
+        self._text += chunk
+        await self._complete_full_messages()
+        current = self._text[self._offset:]
+        if current != self._shown and self.clock() >= self._next_edit_at:
+            await self._show(current)
+
+    async def finish(self, suffix: Optional[str] = None):
+        """Показывает весь текст, дождавшись интервала после предыдущей правки"""
+        if suffix:
+            self._text += suffix
+            await self._complete_full_messages()
+        current = self._text[self._offset:]
+        if current == self._shown:
+            return
+        delay = self._next_edit_at - self.clock()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await self._show(current, required=True)
@@ -1,10 +1,13 @@
 import logging
-from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from database.models import User, Subscription, Payment, PaymentStatus, SubscriptionStatus
-from database.migrations import init_db
-from ton.ton_client import TONClient
+from database.migrations import get_async_session
+from database.models import PaymentStatus
+from services.subscription_service import SubscriptionService
+from bot.callback_router import CB_CANCEL_SUBSCRIPTION, CB_CHECK_PAYMENT, callback_data
+from services.exchange_rate import ExchangeRateUnavailable
+from config import TON_WALLET_ADDRESS
+from utils.helpers import build_ton_transfer_link, format_nanotons, from_nanotons, is_valid_ton_address
 import os
 from dotenv import load_dotenv
 
@@ -48,37 +51,53 @@ async def handle_name_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['first_name'] = first_name
     context.user_data['last_name'] = last_name
     
-    # Инициализируем TON клиент
-    if not TON_API_KEY:
-        logger.error("TON_API_KEY не найден в .env файле.")
-        await update.message.reply_text("Ошибка: TON API ключ не настроен. Пожалуйста, свяжитесь с поддержкой.")
+    # Без ключа API и кошелька сервиса счет выставить нельзя
+    if not TON_API_KEY or not is_valid_ton_address(TON_WALLET_ADDRESS):
+        if not TON_API_KEY:
+            logger.error("TON_API_KEY не найден в .env файле.")
+        else:
+            logger.error(f"TON_WALLET_ADDRESS не задан или некорректен: {TON_WALLET_ADDRESS!r}")
+        await update.message.reply_text("Оплата временно недоступна. Пожалуйста, свяжитесь с поддержкой.")
         context.user_data.clear() # Очищаем состояние
         return
     
-    ton_client = TONClient(api_key=TON_API_KEY)
-    
-    amount_rub = 3000  # Стоимость подписки в рублях
-    amount_ton = ton_client.calculate_ton_amount(amount_rub)
-    
-    payment_info = ton_client.generate_payment_address(amount_ton)
-    
-    context.user_data['payment_address'] = payment_info['address']
-    context.user_data['amount_ton'] = amount_ton
+    try:
+        async with get_async_session() as session:
+            # Счет сохраняется ожидающим платежом: его подтвердит сверка платежей
+            _, _, payment = await SubscriptionService(session).create_subscription(
+                telegram_id=update.effective_user.id,
+                first_name=first_name,
+                last_name=last_name
+            )
+    except ExchangeRateUnavailable as e:
+        logger.error(str(e))
+        await update.message.reply_text("Не удалось получить курс TON. Пожалуйста, попробуйте позже.")
+        return
+    except Exception as e:
+        logger.error(f"Ошибка при выставлении счета пользователю {update.effective_user.id}: {str(e)}", exc_info=True)
+        await update.message.reply_text("Произошла ошибка при выставлении счета. Пожалуйста, попробуйте позже.")
+        return
+
+    context.user_data['payment_memo'] = payment.memo
     
     message = (
         f"Отлично, {first_name}!\n\n"
-        f"Для активации подписки необходимо оплатить {amount_ton:.2f} TON\n\n"
+        f"Для активации подписки необходимо оплатить {from_nanotons(payment.amount_nanoton):.2f} TON\n\n"
         f"Инструкция по оплате:\n"
         f"1. Откройте ваш TON кошелек\n"
-        f"2. Отправьте {amount_ton:.2f} TON на адрес:\n"
-        f"`{payment_info['address']}`\n\n"
+        f"2. Отправьте {format_nanotons(payment.amount_nanoton)} на адрес:\n"
+        f"`{payment.ton_address}`\n"
+        f"3. Обязательно укажите в комментарии к переводу код счета:\n"
+        f"`{payment.memo}`\n\n"
+        f"Без кода платеж не будет зачислен автоматически.\n"
         f"После подтверждения платежа, ваша подписка будет активирована автоматически.\n"
         f"Срок действия счета: 24 часа"
     )
     
     keyboard = [
-        [InlineKeyboardButton("Проверить статус оплаты", callback_data="check_payment")],
-        [InlineKeyboardButton("Отменить", callback_data="cancel_subscription")]
+        [InlineKeyboardButton("Оплатить в кошельке", url=build_ton_transfer_link(payment.ton_address, payment.amount_nanoton, payment.memo))],
+        [InlineKeyboardButton("Проверить статус оплаты", callback_data=callback_data(CB_CHECK_PAYMENT))],
+        [InlineKeyboardButton("Отменить", callback_data=callback_data(CB_CANCEL_SUBSCRIPTION))]
     ]
     
     await update.message.reply_text(
@@ -92,73 +111,34 @@ async def handle_name_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def check_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик проверки статуса платежа"""
-    if not context.user_data.get('payment_address'):
+    if not context.user_data.get('payment_memo'):
         logger.warning(f"Пользователь {update.effective_user.id} пытается проверить несуществующий платеж")
         await update.callback_query.answer("Ошибка: платеж не найден")
         return
     
     logger.info(f"Пользователь {update.effective_user.id} проверяет статус платежа")
-    
-    if not TON_API_KEY:
-        logger.error("TON_API_KEY не найден в .env файле.")
-        await update.callback_query.answer("Ошибка: TON API ключ не настроен. Пожалуйста, свяжитесь с поддержкой.", show_alert=True)
-        return
 
-    ton_client = TONClient(api_key=TON_API_KEY)
-    payment_status = ton_client.check_payment_status(context.user_data['payment_address'])
-    
-    if payment_status['status'] == 'completed':
-        session = init_db()
-        try:
-            # Проверяем, существует ли пользователь, если нет - создаем
-            user = session.query(User).filter_by(telegram_id=update.effective_user.id).first()
-            if not user:
-                user = User(
-                    telegram_id=update.effective_user.id,
-                    first_name=context.user_data['first_name'],
-                    last_name=context.user_data['last_name']
-                )
-                session.add(user)
-                session.commit()
-                session.refresh(user) # Обновляем user, чтобы получить id
+    try:
+        async with get_async_session() as session:
+            # Платеж подтверждает сверка с транзакциями кошелька, здесь только читается его статус
+            payment = await SubscriptionService(session).get_payment(context.user_data['payment_memo'])
+    except Exception as e:
+        logger.error(f"Ошибка при проверке платежа пользователя {update.effective_user.id}: {str(e)}", exc_info=True)
+        await update.callback_query.answer("Произошла ошибка при проверке оплаты. Пожалуйста, попробуйте позже.", show_alert=True)
+        return
 
-            # Проверяем, существует ли активная подписка
-            subscription = session.query(Subscription).filter_by(user_id=user.id, status=SubscriptionStatus.ACTIVE).first()
-            if not subscription:
-                subscription = Subscription(
-                    user_id=user.id,
-                    start_date=datetime.utcnow(),
-                    status='active',
-                    amount_rub=3000.0,
-                    amount_ton=context.user_data['amount_ton']
-                )
-                session.add(subscription)
-                session.commit()
-                session.refresh(subscription)
+    if payment is None:
+        logger.warning(f"Счет {context.user_data['payment_memo']} пользователя {update.effective_user.id} не найден")
+        await update.callback_query.answer("Ошибка: платеж не найден")
+        return
 
-            payment = Payment(
-                subscription_id=subscription.id,
-                amount_ton=context.user_data['amount_ton'],
-                status=PaymentStatus.COMPLETED,
-                ton_address=context.user_data['payment_address'],
-                completed_at=datetime.utcnow()
-            )
-            session.add(payment)
-            session.commit()
-            
-            logger.info(f"Платеж подтвержден для пользователя {update.effective_user.id}")
-            
-            await update.callback_query.edit_message_text(
-                "Оплата подтверждена! Ваша подписка активирована.\n\n"
-                "Теперь вы можете накапливать ночи для вашего отпуска."
-            )
-            context.user_data.clear() # Очищаем данные пользователя после успешной подписки
-        except Exception as e:
-            logger.error(f"Ошибка при сохранении данных пользователя {update.effective_user.id}: {str(e)}", exc_info=True)
-            session.rollback()
-            await update.callback_query.answer("Произошла ошибка при активации подписки. Пожалуйста, попробуйте позже.", show_alert=True)
-        finally:
-            session.close()
+    if payment.status == PaymentStatus.COMPLETED:
+        logger.info(f"Платеж подтвержден для пользователя {update.effective_user.id}")
+        await update.callback_query.edit_message_text(
+            "Оплата подтверждена! Ваша подписка активирована.\n\n"
+            "Теперь вы можете накапливать ночи для вашего отпуска."
+        )
+        context.user_data.clear() # Очищаем данные пользователя после успешной подписки
     else:
         logger.info(f"Платеж еще не получен для пользователя {update.effective_user.id}")
         await update.callback_query.answer(
@@ -0,0 +1,100 @@
+import asyncio
+import contextlib
+import inspect
+import logging
+from typing import Any, Awaitable, Dict, Hashable, List, Optional
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Параллельная обработка обновлений с сохранением порядка внутри чата.
+
+    Обновления разных чатов обрабатываются одновременно, но не более
+    max_concurrent_updates сразу. Обновления одного чата обрабатываются
+    строго по очереди, в порядке поступления: следующее нажатие пользователя
+    ждет, пока закончится обработка предыдущего.
+
+    Ожидающие своей очереди обновления не занимают слоты обработки,
+    поэтому один "медленный" чат не блокирует остальных. max_pending_updates
+    ограничивает общее число принятых в работу обновлений.
+    """
+
+    def __init__(self, max_concurrent_updates: int, max_pending_updates: int = 1024):
+        super().__init__(max(max_pending_updates, max_concurrent_updates))
+        self.max_processing_updates = max_concurrent_updates
+        self._processing = asyncio.BoundedSemaphore(max_concurrent_updates)
+        # Блокировка чата и число обновлений, которые ее удерживают или ждут
+        self._chat_locks: Dict[Hashable, List[Any]] = {}
+        self.waiting = 0
+        self.in_flight = 0
+        self.processed = 0
+
+    @staticmethod
+    def chat_key(update: object) -> Optional[Hashable]:
+        """Ключ очереди: чат, а для обновлений без чата - пользователь"""
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat:
+            return update.effective_chat.id
+        if update.effective_user:
+            return ('user', update.effective_user.id)
+        return None
+
+    def _acquire_chat_lock(self, key: Hashable) -> asyncio.Lock:
+        entry = self._chat_locks.get(key)
+        if entry is None:
+            entry = self._chat_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        return entry[0]
+
+    def _release_chat_lock(self, key: Hashable):
+        entry = self._chat_locks[key]
+        entry[1] -= 1
+        if not entry[1]:
+            # Блокировки неактивных чатов не накапливаются
+            del self._chat_locks[key]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self.chat_key(update)
+        # asyncio.Lock отдает блокировку ожидающим в порядке очереди
+        chat_lock = self._acquire_chat_lock(key) if key is not None else contextlib.nullcontext()
+        self.waiting += 1
+        started = False
+        try:
+            async with chat_lock, self._processing:
+                self.waiting -= 1
+                started = True
+                self.in_flight += 1
+                try:
+                    await coroutine
+                finally:
+                    self.in_flight -= 1
+                    self.processed += 1
+        finally:
+            if not started:
+                # Обработка отменена, пока обновление ждало очереди
+                self.waiting -= 1
+                if inspect.iscoroutine(coroutine):
+                    coroutine.close()
+            if key is not None:
+                self._release_chat_lock(key)
+
+    def stats(self) -> dict:
+        """Текущие метрики обработки обновлений"""
+        return {
+            'waiting': self.waiting,
+            'in_flight': self.in_flight,
+            'processed': self.processed,
+            'active_chats': len(self._chat_locks),
+            'max_concurrent_updates': self.max_processing_updates,
+        }
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+from typing import Dict, Optional
+
+from sqlalchemy import update
+from telegram import Message
+from telegram.error import BadRequest, TelegramError
+
+from database.migrations import get_async_session
+from database.models import Apartment
+from utils.metrics import register_metrics
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Ответы Telegram на file_id, который бот больше не может отправить
+STALE_FILE_ID_ERRORS = ("wrong file identifier", "wrong remote file identifier", "file reference")
+
+
+def is_stale_file_id_error(error: BadRequest) -> bool:
+    """BadRequest из-за недействительного file_id, а не из-за подписи, чата и т.п."""
+    message = str(error).lower()
+    return any(marker in message for marker in STALE_FILE_ID_ERRORS)
+
+
+class VideoTourSender:
+    """
+    Отправка видео-туров квартир по file_id Telegram.
+
+    Первая отправка передает видео из video_url (ссылка или file_id, сохраненный
+    импортером); file_id и превью из ответа Telegram сохраняются в квартире и в
+    кеше каталога, и дальше видео отправляется по ним без передачи файла. Если
+    Telegram отклоняет сохраненный file_id (например, после смены токена бота),
+    видео один раз отправляется из источника и file_id обновляется. Если источника
+    нет или в video_url записан тот же file_id (так сохраняет видео импортер),
+    file_id стирается, и видео нужно заново загрузить импортером. Одновременные
+    первые отправки одной квартиры ждут первую, чтобы файл передавался один раз.
+    """
+
+    def __init__(self):
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self.sent_by_file_id = 0
+        self.uploads = 0
+        self.stale_file_ids = 0
+        self.failures = 0
+        register_metrics('video_tours', self.stats)
+
+    async def _remember(self, apartment: dict, message: Message):
+        """Сохраняет file_id из ответа Telegram, если он изменился"""
+        video = message.video if message else None
+        if video is None:
+            return
+        thumbnail_id = video.thumbnail.file_id if video.thumbnail else None
+        if video.file_id == apartment.get('video_file_id') and thumbnail_id == apartment.get('video_thumbnail_file_id'):
+            return
+        try:
+            async with get_async_session() as session:
+                await session.execute(
+                    update(Apartment)
+                    .where(Apartment.id == apartment['id'])
+                    .values(video_file_id=video.file_id, video_thumbnail_file_id=thumbnail_id)
+                )
+                await session.commit()
+        except Exception as e:
+            # Видео уже отправлено; file_id сохранится при следующей отправке
+            logger.error(f"Не удалось сохранить file_id видео-тура квартиры {apartment['id']}: {str(e)}")
+            return
+        # Кеш каталога обновляется на месте: перечитывать весь каталог ради file_id незачем
+        apartment['video_file_id'] = video.file_id
+        apartment['video_thumbnail_file_id'] = thumbnail_id
+        logger.info(f"Сохранен file_id видео-тура квартиры {apartment['id']}")
+
+    async def _forget(self, apartment: dict, file_id: str):
+        """Стирает отклоненный file_id, если повторно отправить видео не из чего"""
+        values = {'video_file_id': None, 'video_thumbnail_file_id': None}
+        if apartment.get('video_url') == file_id:
+            values['video_url'] = None
+        try:
+            async with get_async_session() as session:
+                await session.execute(
+                    update(Apartment)
+                    .where(Apartment.id == apartment['id'], Apartment.video_file_id == file_id)
+                    .values(**values)
+                )
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Не удалось стереть file_id видео-тура квартиры {apartment['id']}: {str(e)}")
+            return
+        apartment.update(values)
+        logger.warning(f"Видео-тур квартиры {apartment['id']} нужно заново загрузить импортером")
+
+    async def _send_by_file_id(self, reply_to: Message, apartment: dict, caption: str) -> Optional[Message]:
+        """Отправка по сохраненному file_id; None, если его нет или Telegram его не принял"""
+        file_id = apartment.get('video_file_id')
+        if not file_id:
+            return None
+        try:
+            message = await reply_to.reply_video(video=file_id, caption=caption)
+        except BadRequest as e:
+            if not is_stale_file_id_error(e):
+                raise
+            self.stale_file_ids += 1
+            logger.warning(f"Telegram отклонил file_id видео-тура квартиры {apartment['id']}: {str(e)}")
+            return None
+        self.sent_by_file_id += 1
+        return message
+
+    async def send(self, reply_to: Message, apartment: Optional[dict], caption: str) -> Optional[Message]:
+        """
+        Отправляет видео-тур квартиры в ответ на сообщение
+
+        Returns:
+            Отправленное сообщение или None, если у квартиры нет видео или отправить его не удалось
+        """
+        if not apartment or not (apartment.get('video_file_id') or apartment.get('video_url')):
+            return None
+        try:
+            tried_file_id = apartment.get('video_file_id')
+            message = await self._send_by_file_id(reply_to, apartment, caption)
+            if message is None:
+                lock = self._locks.setdefault(apartment['id'], asyncio.Lock())
+                async with lock:
+                    # Пока ждали, file_id могла сохранить или обновить другая отправка
+                    if apartment.get('video_file_id') != tried_file_id:
+                        message = await self._send_by_file_id(reply_to, apartment, caption)
+                    if message is None:
+                        source = apartment.get('video_url')
+                        stale = tried_file_id is not None and apartment.get('video_file_id') == tried_file_id
+                        # Источник - тот же отклоненный file_id: повторная отправка снова не пройдет
+                        if not source or (stale and source == tried_file_id):
+                            if stale:
+                                await self._forget(apartment, tried_file_id)
+                            return None
+                        message = await reply_to.reply_video(video=source, caption=caption)
+                        self.uploads += 1
+                    await self._remember(apartment, message)
+                return message
+        except TelegramError as e:
+            self.failures += 1
+            logger.error(f"Не удалось отправить видео-тур квартиры {apartment['id']}: {str(e)}")
+            return None
+        # Превью могло появиться позже, чем file_id, например у видео, загруженного импортером
+        await self._remember(apartment, message)
+        return message
+
+    def stats(self) -> dict:
+        return {
+            'sent_by_file_id': self.sent_by_file_id,
+            'uploads': self.uploads,
+            'stale_file_ids': self.stale_file_ids,
+            'failures': self.failures,
+        }
+
+
+_video_tours: Optional[VideoTourSender] = None
+
+
+def get_video_tours() -> VideoTourSender:
+    """Общий для процесса отправитель видео-туров"""
+    global _video_tours
+    if _video_tours is None:
+        _video_tours = VideoTourSender()
+    return _video_tours
@@ -0,0 +1,76 @@
+import logging
+import secrets
+from typing import Optional
+from telegram import Bot, Update
+from telegram.ext import Application
+from config import WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET_TOKEN
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Заголовок, в котором Telegram передает secret_token, указанный в setWebhook
+WEBHOOK_SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+def get_webhook_url(base_url: Optional[str] = WEBHOOK_URL, path: str = WEBHOOK_PATH) -> str:
+    """Полный адрес эндпоинта для обновлений Telegram"""
+    if not base_url:
+        raise ValueError("WEBHOOK_URL не установлен в файле .env")
+    return base_url.rstrip('/') + '/' + path.lstrip('/')
+
+def is_valid_secret_token(token: Optional[str], expected: Optional[str] = None) -> bool:
+    """Проверка секрета из заголовка запроса (сравнение за постоянное время)"""
+    expected = expected or WEBHOOK_SECRET_TOKEN
+    if not token or not expected:
+        return False
+    return secrets.compare_digest(token.encode(), expected.encode())
+
+async def set_webhook(bot: Bot, url: Optional[str] = None, drop_pending_updates: bool = False) -> bool:
+    """Регистрирует вебхук в Telegram с секретом WEBHOOK_SECRET_TOKEN"""
+    if not WEBHOOK_SECRET_TOKEN:
+        raise ValueError("WEBHOOK_SECRET_TOKEN не установлен в файле .env")
+    url = url or get_webhook_url()
+    result = await bot.set_webhook(
+        url=url,
+        secret_token=WEBHOOK_SECRET_TOKEN,
+        allowed_updates=Update.ALL_TYPES,
+        drop_pending_updates=drop_pending_updates,
+    )
+    logger.info(f"Вебхук установлен: {url}")
+    return result
+
+async def start_webhook_application() -> Application:
+    """
+    Запускает бота в режиме webhook внутри текущего цикла событий.
+
+    Updater не создается: обновления кладет в update_queue эндпоинт
+    веб-приложения, а приложение PTB разбирает очередь как обычно.
+    """
+    from bot.application import build_application
+
+    if not WEBHOOK_SECRET_TOKEN:
+        raise ValueError("WEBHOOK_SECRET_TOKEN не установлен в файле .env")
+
+    application = build_application(Application.builder().updater(None))
+    await application.initialize()
+    await application.start()
+    if WEBHOOK_URL:
+        await set_webhook(application.bot)
+    else:
+        logger.warning("WEBHOOK_URL не задан, вебхук нужно установить вручную: python src/bot/clear_webhook.py set")
+    logger.info("Бот запущен в режиме webhook")
+    return application
+
+async def stop_webhook_application(application: Application):
+    """Обрабатывает уже принятые обновления и останавливает приложение PTB
+
+    Вебхук при этом не удаляется: пока процесс перезапускается,
+    Telegram копит обновления и доставит их новому процессу.
+    """
+    if application.running:
+        await application.stop()
+    await application.shutdown()
+
+async def feed_update(application: Application, data: dict):
+    """Передает обновление из запроса Telegram в очередь приложения PTB"""
+    update = Update.de_json(data, application.bot)
+    await application.update_queue.put(update)
@@ -8,13 +8,94 @@ load_dotenv()
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 TON_API_KEY = os.getenv('TON_API_KEY')
 
+# Режим получения обновлений: polling - отдельный процесс бота опрашивает Telegram,
+# webhook - Telegram присылает обновления в веб-приложение, бот работает в том же процессе
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # публичный адрес веб-приложения, например https://example.up.railway.app
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram/webhook')
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN')
+
+# Параллельная обработка обновлений: обновления разных чатов обрабатываются одновременно,
+# обновления одного чата - строго по очереди
+BOT_MAX_CONCURRENT_UPDATES = int(os.getenv('BOT_MAX_CONCURRENT_UPDATES', '32'))
+BOT_MAX_PENDING_UPDATES = int(os.getenv('BOT_MAX_PENDING_UPDATES', '1024'))
+METRICS_LOG_INTERVAL = int(os.getenv('METRICS_LOG_INTERVAL', '60'))  # секунд
+
+# Очередь исходящих сообщений: Telegram допускает около 30 сообщений в секунду на бота
+# и не больше одного сообщения в секунду в один чат
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', '25'))  # сообщений в секунду
+OUTBOUND_PER_CHAT_INTERVAL = float(os.getenv('OUTBOUND_PER_CHAT_INTERVAL', '1'))  # секунд между сообщениями в чат
+OUTBOUND_MAX_IN_FLIGHT = int(os.getenv('OUTBOUND_MAX_IN_FLIGHT', '16'))  # одновременных запросов к Bot API
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', '3'))
+
+# Рассылки: получатели читаются страницами, прогресс сохраняется после каждой страницы
+BROADCAST_PAGE_SIZE = int(os.getenv('BROADCAST_PAGE_SIZE', '1000'))
+BROADCAST_POLL_INTERVAL = int(os.getenv('BROADCAST_POLL_INTERVAL', '30'))  # секунд между проверками новых рассылок
+
+# Ежемесячное начисление ночей активным подпискам
+ACCRUAL_NIGHTS_PER_PERIOD = int(os.getenv('ACCRUAL_NIGHTS_PER_PERIOD', '1'))
+ACCRUAL_CHUNK_SIZE = int(os.getenv('ACCRUAL_CHUNK_SIZE', '5000'))  # подписок в одной транзакции
+ACCRUAL_CHECK_INTERVAL = int(os.getenv('ACCRUAL_CHECK_INTERVAL', '3600'))  # секунд между проверками начала периода
+
+# Напоминания о продлении подписки
+RENEWAL_REMINDER_DAYS = int(os.getenv('RENEWAL_REMINDER_DAYS', '3'))  # за сколько дней до срока платежа
+RENEWAL_SCAN_BATCH_SIZE = int(os.getenv('RENEWAL_SCAN_BATCH_SIZE', '1000'))
+RENEWAL_SCAN_INTERVAL = int(os.getenv('RENEWAL_SCAN_INTERVAL', '3600'))  # секунд
+
 # Настройки базы данных
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///bot.db')
 
 # Настройки подписки
 SUBSCRIPTION_PRICE_RUB = 3000
 MIN_NIGHTS_FOR_VACATION = 7
+# Список городов Таиланда из ТЗ
+THAILAND_CITIES = ["Пхукет", "Бангкок", "Паттайя", "Самуи", "Пхи-Пхи", "Краби"]
 
 # Настройки TON
 TON_API_URL = "https://toncenter.com/api/v2"
-TON_WALLET_ADDRESS = os.getenv('TON_WALLET_ADDRESS') 
\ No newline at end of file
+TON_WALLET_ADDRESS = os.getenv('TON_WALLET_ADDRESS')
+
+# Настройки кеша каталога квартир
+CATALOG_CACHE_TTL = int(os.getenv('CATALOG_CACHE_TTL', '600'))  # секунд
+CATALOG_VERSION_POLL_INTERVAL = int(os.getenv('CATALOG_VERSION_POLL_INTERVAL', '30'))  # секунд
+
+# Календари занятости квартир
+AVAILABILITY_HORIZON_DAYS = int(os.getenv('AVAILABILITY_HORIZON_DAYS', '730'))  # на сколько дней вперед искать свободные даты
+AVAILABILITY_RELOAD_INTERVAL = int(os.getenv('AVAILABILITY_RELOAD_INTERVAL', '300'))  # секунд между полными перечитываниями
+BOOKING_MAX_ATTEMPTS = int(os.getenv('BOOKING_MAX_ATTEMPTS', '5'))  # попыток при одновременном бронировании квартиры
+
+# Разговоры с Gemini: у каждого пользователя свой контекст ограниченного размера
+GEMINI_HISTORY_TURNS = int(os.getenv('GEMINI_HISTORY_TURNS', '6'))  # последних реплик, передаваемых модели целиком
+GEMINI_SUMMARY_MAX_CHARS = int(os.getenv('GEMINI_SUMMARY_MAX_CHARS', '1500'))  # длина краткого содержания старых реплик
+GEMINI_SESSION_TTL = int(os.getenv('GEMINI_SESSION_TTL', '3600'))  # секунд без сообщений до удаления разговора
+GEMINI_SESSIONS_MAX_BYTES = int(os.getenv('GEMINI_SESSIONS_MAX_BYTES', str(32 * 1024 * 1024)))  # на все разговоры процесса
+GEMINI_MAX_CONCURRENT = int(os.getenv('GEMINI_MAX_CONCURRENT', '8'))  # одновременных запросов к Gemini
+GEMINI_FIRST_CHUNK_TIMEOUT = float(os.getenv('GEMINI_FIRST_CHUNK_TIMEOUT', '15'))  # секунд до первого фрагмента ответа
+GEMINI_RESPONSE_TIMEOUT = float(os.getenv('GEMINI_RESPONSE_TIMEOUT', '60'))  # секунд на весь ответ
+# Ответ показывается по мере генерации: сообщение редактируется не чаще раза в интервал
+GEMINI_STREAM_EDIT_INTERVAL = float(os.getenv('GEMINI_STREAM_EDIT_INTERVAL', '1'))  # секунд
+# Ответы на частые вопросы без обращения к Gemini
+FAQ_CACHE_SIZE = int(os.getenv('FAQ_CACHE_SIZE', '1000'))  # ответов модели в кеше
+FAQ_CACHE_TTL = int(os.getenv('FAQ_CACHE_TTL', '86400'))  # секунд
+FAQ_CONFIDENCE = float(os.getenv('FAQ_CONFIDENCE', '0.75'))  # насколько вопрос должен совпасть с частым, от 0 до 1
+FAQ_SNIPPET_COVERAGE = float(os.getenv('FAQ_SNIPPET_COVERAGE', '0.5'))  # доля слов вопроса, найденных во фрагменте
+FAQ_SNIPPETS = int(os.getenv('FAQ_SNIPPETS', '3'))  # фрагментов в запросе к модели
+# Поиск квартир и мест по расстоянию
+GEO_CELL_KM = float(os.getenv('GEO_CELL_KM', '1'))  # размер ячейки сетки геоиндекса
+GEO_NEARBY_RADIUS_KM = float(os.getenv('GEO_NEARBY_RADIUS_KM', '3'))  # радиус поиска мест рядом с квартирой
+GEO_OFFER_ATTRACTIONS = int(os.getenv('GEO_OFFER_ATTRACTIONS', '3'))  # мест в предложении квартиры
+
+# Настройки общего пула HTTP-соединений
+HTTP_POOL_LIMIT = int(os.getenv('HTTP_POOL_LIMIT', '100'))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv('HTTP_POOL_LIMIT_PER_HOST', '20'))
+HTTP_KEEPALIVE_TIMEOUT = int(os.getenv('HTTP_KEEPALIVE_TIMEOUT', '60'))  # секунд
+
+# Ограничения клиента toncenter: без ключа API разрешен 1 запрос в секунду, с ключом - 10
+TON_API_RPS = float(os.getenv('TON_API_RPS', '10' if TON_API_KEY else '1'))
+TON_API_TIMEOUT = float(os.getenv('TON_API_TIMEOUT', '10'))  # секунд на один запрос
+TON_API_MAX_RETRIES = int(os.getenv('TON_API_MAX_RETRIES', '3'))
+
+# Настройки курса TON/RUB
+EXCHANGE_RATE_TTL = int(os.getenv('EXCHANGE_RATE_TTL', '300'))  # секунд
+EXCHANGE_RATE_REFRESH_INTERVAL = int(os.getenv('EXCHANGE_RATE_REFRESH_INTERVAL', '240'))  # секунд
+EXCHANGE_RATE_URL = "https://api.coingecko.com/api/v3/simple/price?ids=the-open-network&vs_currencies=rub"
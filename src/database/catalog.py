@@ -0,0 +1,30 @@
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from .models import CatalogVersion
+
+# Каталог хранит единственную строку версии
+CATALOG_VERSION_ID = 1
+
+def bump_catalog_version(session: Session) -> int:
+    """Увеличивает версию каталога квартир в текущей транзакции
+
+    Вызывается импортером после добавления или обновления квартир.
+    Возвращает новую версию.
+    """
+    updated = session.execute(
+        update(CatalogVersion)
+        .where(CatalogVersion.id == CATALOG_VERSION_ID)
+        .values(version=CatalogVersion.version + 1)
+    ).rowcount
+    if not updated:
+        session.add(CatalogVersion(id=CATALOG_VERSION_ID, version=1))
+        session.flush()
+    return session.get(CatalogVersion, CATALOG_VERSION_ID, populate_existing=True).version
+
+async def get_catalog_version(session: AsyncSession) -> int:
+    """Возвращает текущую версию каталога (0, если каталог еще не импортировался)"""
+    result = await session.execute(
+        select(CatalogVersion.version).where(CatalogVersion.id == CATALOG_VERSION_ID)
+    )
+    return result.scalar() or 0
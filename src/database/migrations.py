@@ -1,8 +1,14 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from contextlib import asynccontextmanager, contextmanager
+from threading import Lock
+from typing import AsyncIterator, Iterator, Optional
 from dotenv import load_dotenv
 import os
 from .models import Base
+from .search import create_fulltext_index
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -14,12 +20,27 @@ DATABASE_URL = os.getenv('DATABASE_URL')
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL не установлен в файле .env")
 
+# Настройки пула соединений (общего для всего процесса)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '20'))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', '30'))
+# MySQL по умолчанию закрывает неактивные соединения через 8 часов,
+# поэтому пересоздаем их заранее
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+
+# Движок и фабрика сессий создаются лениво, один раз на процесс
+_engine: Optional[Engine] = None
+_session_factory: Optional[sessionmaker] = None
+_engine_lock = Lock()
+_async_engine: Optional[AsyncEngine] = None
+_async_session_factory: Optional[async_sessionmaker] = None
+
 def get_database_url(db_url=None):
     """Преобразует DATABASE_URL в формат, понятный SQLAlchemy
-    
+
     Args:
         db_url: URL базы данных. Если не указан, используется DATABASE_URL из окружения
-    
+
     Returns:
         Преобразованный URL для SQLAlchemy
     """
@@ -29,22 +50,215 @@ def get_database_url(db_url=None):
         return url.replace('mysql://', 'mysql+pymysql://', 1)
     return url
 
+def get_async_database_url(db_url=None):
+    """Преобразует DATABASE_URL в URL с асинхронным драйвером
+
+    mysql:// работает через aiomysql, sqlite:// - через aiosqlite (используется в тестах).
+    """
+    url = db_url or DATABASE_URL
+    if url and url.startswith(('mysql://', 'mysql+pymysql://')):
+        return 'mysql+aiomysql://' + url.split('://', 1)[1]
+    if url and url.startswith(('sqlite://', 'sqlite+pysqlite://')):
+        return 'sqlite+aiosqlite://' + url.split('://', 1)[1]
+    return url
+
+def _engine_options(db_url: str) -> dict:
+    """Параметры пула соединений для create_engine"""
+    options = {'pool_pre_ping': True}
+    if make_url(db_url).get_backend_name() != 'sqlite':
+        # SQLite использует собственные пулы без этих параметров
+        options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+        )
+    return options
+
+def get_engine(db_url=None) -> Engine:
+    """Возвращает общий для процесса движок SQLAlchemy, создавая его при первом вызове
+
+    Args:
+        db_url: URL базы данных. Учитывается только при первом вызове
+    """
+    global _engine, _session_factory
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                url = get_database_url(db_url)
+                _engine = create_engine(url, **_engine_options(url))
+                _session_factory = sessionmaker(autocommit=False, autoflush=False, bind=_engine)
+    return _engine
+
+def get_session() -> Session:
+    """Возвращает новую сессию из общего пула соединений
+
+    Сессия не разделяется между корутинами и потоками: каждый обработчик
+    получает свою и обязан ее закрыть. Само соединение берется из пула движка.
+    """
+    get_engine()
+    return _session_factory()
+
+@contextmanager
+def session_scope() -> Iterator[Session]:
+    """Контекстный менеджер для сессии: commit при успехе, rollback при ошибке"""
+    session = get_session()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def get_async_engine(db_url=None) -> AsyncEngine:
+    """Возвращает общий для процесса асинхронный движок с теми же настройками пула
+
+    Args:
+        db_url: URL базы данных. Учитывается только при первом вызове
+    """
+    global _async_engine, _async_session_factory
+    if _async_engine is None:
+        with _engine_lock:
+            if _async_engine is None:
+                url = get_async_database_url(db_url)
+                _async_engine = create_async_engine(url, **_engine_options(url))
+                # expire_on_commit=False: после commit атрибуты объектов остаются
+                # доступны без повторного (неявного и невозможного в asyncio) запроса
+                _async_session_factory = async_sessionmaker(
+                    _async_engine, autoflush=False, expire_on_commit=False
+                )
+    return _async_engine
+
+def get_async_session() -> AsyncSession:
+    """Возвращает новую асинхронную сессию из общего пула
+
+    Используется в обработчиках бота и эндпоинтах FastAPI, чтобы запросы к БД
+    не блокировали цикл событий. Закрывается через `async with` или `await session.close()`.
+    """
+    get_async_engine()
+    return _async_session_factory()
+
+@asynccontextmanager
+async def async_session_scope() -> AsyncIterator[AsyncSession]:
+    """Асинхронный аналог session_scope: commit при успехе, rollback при ошибке"""
+    async with get_async_session() as session:
+        try:
+            yield session
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+
+def _upgrade_payments(connection):
+    """Переводит существующую таблицу payments на коды счетов и суммы в нанотонах
+
+    Добавляет колонки memo и amount_nanoton, переносит суммы из amount_ton
+    и удаляет старую колонку. Для новой таблицы ничего не делает.
+    """
+    columns = {column['name'] for column in inspect(connection).get_columns('payments')}
+    if 'memo' not in columns:
+        connection.execute(text("ALTER TABLE payments ADD COLUMN memo VARCHAR(16)"))
+    if 'amount_nanoton' not in columns:
+        connection.execute(text("ALTER TABLE payments ADD COLUMN amount_nanoton BIGINT NOT NULL DEFAULT 0"))
+        if 'amount_ton' in columns:
+            connection.execute(text("UPDATE payments SET amount_nanoton = ROUND(amount_ton * 1000000000)"))
+            connection.execute(text("ALTER TABLE payments DROP COLUMN amount_ton"))
+
+def _upgrade_subscriptions(connection):
+    """Добавляет в существующую таблицу subscriptions срок следующего платежа
+
+    Срок заполняется по последнему подтвержденному платежу подписки.
+    Для новой таблицы ничего не делает.
+    """
+    columns = {column['name'] for column in inspect(connection).get_columns('subscriptions')}
+    if 'renewal_reminder_sent_at' not in columns:
+        connection.execute(text("ALTER TABLE subscriptions ADD COLUMN renewal_reminder_sent_at DATETIME"))
+    if 'next_payment_due' not in columns:
+        connection.execute(text("ALTER TABLE subscriptions ADD COLUMN next_payment_due DATETIME"))
+        if connection.dialect.name == 'sqlite':
+            next_due = "datetime(MAX(payments.completed_at), '+30 days')"
+        else:
+            next_due = "DATE_ADD(MAX(payments.completed_at), INTERVAL 30 DAY)"
+        connection.execute(text(
+            f"UPDATE subscriptions SET next_payment_due = (SELECT {next_due} FROM payments "
+            "WHERE payments.subscription_id = subscriptions.id AND payments.status = 'COMPLETED')"
+        ))
+
+def _upgrade_apartments(connection):
+    """Добавляет в существующую таблицу apartments версию календаря бронирований, координаты и file_id видео"""
+    columns = {column['name'] for column in inspect(connection).get_columns('apartments')}
+    if 'booking_version' not in columns:
+        connection.execute(text("ALTER TABLE apartments ADD COLUMN booking_version INTEGER NOT NULL DEFAULT 0"))
+    for name in ('latitude', 'longitude'):
+        if name not in columns:
+            connection.execute(text(f"ALTER TABLE apartments ADD COLUMN {name} FLOAT"))
+    for name in ('video_file_id', 'video_thumbnail_file_id'):
+        if name not in columns:
+            connection.execute(text(f"ALTER TABLE apartments ADD COLUMN {name} VARCHAR(255)"))
+
+def _upgrade_bookings(connection):
+    """Добавляет в существующую таблицу bookings подписку, с которой списаны ночи"""
+    columns = {column['name'] for column in inspect(connection).get_columns('bookings')}
+    if 'subscription_id' not in columns:
+        connection.execute(text("ALTER TABLE bookings ADD COLUMN subscription_id INTEGER REFERENCES subscriptions(id)"))
+
+def _create_schema(connection):
+    """Создает отсутствующие таблицы и индексы
+
+    create_all не добавляет новые колонки и индексы к уже существующим таблицам,
+    поэтому колонки дополняются миграциями, а индексы проверяются и создаются отдельно.
+    Полнотекстовый индекс квартир зависит от СУБД и создается вне метаданных моделей.
+    """
+    Base.metadata.create_all(connection)
+    _upgrade_payments(connection)
+    _upgrade_subscriptions(connection)
+    _upgrade_apartments(connection)
+    _upgrade_bookings(connection)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+    create_fulltext_index(connection)
+
+def create_schema():
+    """Создание всех таблиц. Вызывается один раз при запуске, а не в обработчиках"""
+    with get_engine().begin() as connection:
+        _create_schema(connection)
+
+async def create_schema_async():
+    """Асинхронный вариант create_schema для приложений, работающих через asyncio"""
+    async with get_async_engine().begin() as connection:
+        await connection.run_sync(_create_schema)
+
+def dispose_engine():
+    """Закрывает все соединения пула и сбрасывает общий движок"""
+    global _engine, _session_factory
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+        _engine = None
+        _session_factory = None
+
+async def dispose_async_engine():
+    """Закрывает соединения асинхронного пула и сбрасывает асинхронный движок"""
+    global _async_engine, _async_session_factory
+    engine = _async_engine
+    _async_engine = None
+    _async_session_factory = None
+    if engine is not None:
+        await engine.dispose()
+
 def init_db():
-    """Инициализация базы данных"""
-    # Получаем правильный URL для SQLAlchemy
-    db_url = get_database_url()
-    # Создание движка SQLAlchemy
-    engine = create_engine(db_url)
-    
-    # Создание всех таблиц
-    Base.metadata.create_all(engine)
-    
-    # Создание сессии
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    
-    return SessionLocal()
+    """Инициализация базы данных
+
+    Создает таблицы и возвращает сессию из общего пула. Используется скриптами
+    и при запуске; обработчики должны вызывать get_session().
+    """
+    create_schema()
+    return get_session()
 
 if __name__ == "__main__":
     # Создание базы данных при запуске скрипта
-    init_db()
-    print("База данных успешно инициализирована!") 
\ No newline at end of file
+    init_db().close()
+    print("База данных успешно инициализирована!")
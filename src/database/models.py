@@ -1,7 +1,7 @@
 import enum
 from datetime import datetime
 
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean, Enum
+from sqlalchemy import Column, Integer, BigInteger, String, Float, DateTime, ForeignKey, Boolean, Enum, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship # Импортируем relationship
 
@@ -30,6 +30,9 @@ class PaymentStatus(enum.Enum):
 # чтобы избежать NameError при ссылке на ReferralBonus.user_id в User.
 class ReferralBonus(Base):
     __tablename__ = "referral_bonuses"
+    __table_args__ = (
+        Index("ix_referral_bonuses_user_id", "user_id"),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -53,6 +56,10 @@ class ReferralBonus(Base):
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # Рассылка приглашенным пользователям (сегмент referrals)
+        Index("ix_users_referrer_id", "referrer_id"),
+    )
 
     id = Column(Integer, primary_key=True)
     telegram_id = Column(Integer, unique=True, nullable=False)
@@ -96,6 +103,12 @@ class User(Base):
 
 class Subscription(Base):
     __tablename__ = "subscriptions"
+    __table_args__ = (
+        # Поиск активной подписки пользователя
+        Index("ix_subscriptions_user_id_status", "user_id", "status"),
+        # Поиск подписок, срок оплаты которых скоро наступит
+        Index("ix_subscriptions_status_next_payment_due", "status", "next_payment_due"),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -105,6 +118,10 @@ class Subscription(Base):
     payment_token = Column(String(255))
     amount_rub = Column(Float, nullable=False)
     amount_ton = Column(Float, nullable=False)
+    # Срок следующего платежа; продлевается при каждой оплате
+    next_payment_due = Column(DateTime)
+    # Напоминание о продлении за текущий срок уже отправлено; сбрасывается при оплате
+    renewal_reminder_sent_at = Column(DateTime)
 
     # Отношения
     user = relationship("User", back_populates="subscriptions")
@@ -113,12 +130,20 @@ class Subscription(Base):
 
 class Apartment(Base):
     __tablename__ = "apartments"
+    __table_args__ = (
+        # Выбор базовой квартиры города
+        Index("ix_apartments_city_type", "city", "apartment_type"),
+    )
 
     id = Column(Integer, primary_key=True)
     city = Column(String(100), nullable=False)
     address = Column(String(500), nullable=False)
     description = Column(String(2000))
     video_url = Column(String(500))
+    # Идентификаторы видео-тура и его превью на серверах Telegram: повторная
+    # отправка по file_id не передает сам файл. Действительны только для этого бота
+    video_file_id = Column(String(255))
+    video_thumbnail_file_id = Column(String(255))
     features = Column(String(2000))
     nearby_attractions = Column(String(2000))
     status = Column(String(50), default="available")
@@ -126,13 +151,38 @@ class Apartment(Base):
     num_bedrooms = Column(Integer, default=1)
     apartment_type = Column(String(50), default="Base")
     owner_id = Column(Integer, ForeignKey("users.id"))
+    # Координаты квартиры для поиска по расстоянию (градусы WGS 84)
+    latitude = Column(Float)
+    longitude = Column(Float)
+    # Версия календаря квартиры: увеличивается каждым бронированием и отменой,
+    # по ней BookingService обнаруживает одновременные бронирования (оптимистичная блокировка)
+    booking_version = Column(Integer, nullable=False, default=0)
 
     # Отношения
     bookings = relationship("Booking", back_populates="apartment")
 
 
+class PointOfInterest(Base):
+    """Достопримечательность или другое место, рядом с которым ищут квартиры"""
+    __tablename__ = "points_of_interest"
+    __table_args__ = (
+        # Замена мест города импортером
+        Index("ix_points_of_interest_city", "city"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    city = Column(String(100), nullable=False)
+    name = Column(String(255), nullable=False)
+    latitude = Column(Float, nullable=False)
+    longitude = Column(Float, nullable=False)
+
+
 class Booking(Base):
     __tablename__ = "bookings"
+    __table_args__ = (
+        # Проверка пересечения бронирований квартиры по датам
+        Index("ix_bookings_apartment_dates", "apartment_id", "start_date", "end_date"),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -140,6 +190,8 @@ class Booking(Base):
     start_date = Column(DateTime, nullable=False)
     end_date = Column(DateTime, nullable=False)
     nights_used = Column(Integer, nullable=False)
+    # Подписка, с которой списаны ночи: при отмене они возвращаются на нее же
+    subscription_id = Column(Integer, ForeignKey("subscriptions.id"))
     status = Column(String(50), default="pending")
 
     # Отношения
@@ -149,10 +201,19 @@ class Booking(Base):
 
 class Payment(Base):
     __tablename__ = "payments"
+    __table_args__ = (
+        # Выборка ожидающих платежей за последние сутки в PaymentChecker
+        Index("ix_payments_status_created_at", "status", "created_at"),
+        # Сопоставление входящего перевода со счетом по комментарию
+        Index("ux_payments_memo", "memo", unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     subscription_id = Column(Integer, ForeignKey("subscriptions.id"), nullable=False)
-    amount_ton = Column(Float, nullable=False)
+    # Код счета, который плательщик указывает в комментарии к переводу
+    memo = Column(String(16))
+    # Сумма в нанотонах: целые числа сравниваются с суммой перевода точно
+    amount_nanoton = Column(BigInteger, nullable=False)
     status = Column(Enum(PaymentStatus), default=PaymentStatus.PENDING)
     created_at = Column(DateTime, default=datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)
@@ -160,6 +221,10 @@ class Payment(Base):
 
     subscription = relationship("Subscription", back_populates="payments")
 
+    @property
+    def amount_ton(self) -> float:
+        return self.amount_nanoton / 10 ** 9
+
 
 class PaymentTransaction(Base):
     __tablename__ = "payment_transactions"
@@ -171,4 +236,99 @@ class PaymentTransaction(Base):
     transaction_hash = Column(String(255), unique=True)
     status = Column(String(50), default="pending")
     type = Column(String(50), nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+# Версия каталога квартир: импортер увеличивает ее при каждом изменении каталога,
+# а запущенные процессы бота и веб-приложения опрашивают ее и сбрасывают кеш
+class CatalogVersion(Base):
+    __tablename__ = "catalog_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+# Курсор сверки входящих транзакций кошелька: последняя обработанная транзакция
+# (logical time и hash), с которой продолжается следующий цикл сверки
+class WalletCursor(Base):
+    __tablename__ = "wallet_cursors"
+
+    id = Column(Integer, primary_key=True)
+    address = Column(String(255), unique=True, nullable=False)
+    last_lt = Column(BigInteger, nullable=False, default=0)
+    last_hash = Column(String(64))
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+# История курсов TON: каждое полученное от провайдера значение сохраняется,
+# чтобы можно было проверить, по какому курсу выставлялся счет
+class ExchangeRate(Base):
+    __tablename__ = "exchange_rates"
+    __table_args__ = (
+        Index("ix_exchange_rates_pair_fetched_at", "pair", "fetched_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    pair = Column(String(20), nullable=False)
+    rate = Column(Float, nullable=False)
+    source = Column(String(50), nullable=False)
+    fetched_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+# Рассылка по сегменту пользователей. Получатели перебираются по возрастанию
+# users.id, last_user_id - контрольная точка: всем пользователям с id не больше
+# нее рассылка уже обработана, поэтому после перезапуска она продолжается с нее
+class BroadcastCampaign(Base):
+    __tablename__ = "broadcast_campaigns"
+    __table_args__ = (
+        Index("ix_broadcast_campaigns_status", "status"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    text = Column(String(4096), nullable=False)
+    segment = Column(String(50), nullable=False)
+    segment_param = Column(Integer)
+    status = Column(String(20), nullable=False, default="pending")
+    last_user_id = Column(Integer, nullable=False, default=0)
+    sent_count = Column(Integer, nullable=False, default=0)
+    failed_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+
+# Журнал отправок рассылки: запись появляется сразу после отправки, чтобы
+# при возобновлении после сбоя не отправить сообщение повторно
+class BroadcastDelivery(Base):
+    __tablename__ = "broadcast_deliveries"
+    __table_args__ = (
+        Index("ux_broadcast_deliveries_campaign_user", "campaign_id", "user_id", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    campaign_id = Column(Integer, ForeignKey("broadcast_campaigns.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    status = Column(String(20), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+# Журнал начисления ночей: одна запись на расчетный период (месяц). Ночи
+# начисляются порциями подписок по возрастанию id; last_subscription_id сдвигается
+# в той же транзакции, что и начисление порции, поэтому повторный запуск
+# за период продолжает с места остановки и не начисляет ночи дважды
+class NightAccrualRun(Base):
+    __tablename__ = "night_accrual_runs"
+
+    id = Column(Integer, primary_key=True)
+    period = Column(String(7), unique=True, nullable=False)  # YYYY-MM
+    cutoff = Column(DateTime, nullable=False)  # подписки, оформленные до этого момента
+    nights = Column(Integer, nullable=False)
+    status = Column(String(20), nullable=False, default="accruing")
+    max_subscription_id = Column(Integer, nullable=False, default=0)
+    last_subscription_id = Column(Integer, nullable=False, default=0)
+    notified_subscription_id = Column(Integer, nullable=False, default=0)
+    credited_count = Column(Integer, nullable=False, default=0)
+    notified_count = Column(Integer, nullable=False, default=0)
+    started_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime)
@@ -0,0 +1,98 @@
+from typing import List
+from sqlalchemy import case, column, func, inspect, literal_column, or_, table, text
+from sqlalchemy.dialects.mysql import match
+from .models import Apartment
+
+# Текстовые колонки квартиры, по которым идет полнотекстовый поиск
+SEARCH_COLUMNS = ('city', 'address', 'description', 'features', 'nearby_attractions')
+
+# MySQL: индекс FULLTEXT по текстовым колонкам таблицы apartments
+FULLTEXT_INDEX = 'ft_apartments_text'
+
+# SQLite: внешняя таблица FTS5 над apartments, синхронизируется триггерами
+FTS_TABLE = 'apartments_fts'
+
+def _fts_values(prefix: str) -> str:
+    return ", ".join(f"{prefix}.{name}" for name in SEARCH_COLUMNS)
+
+def _create_sqlite_fts(connection):
+    """Создает таблицу FTS5 и триггеры; индекс существующих строк строится один раз"""
+    exists = inspect(connection).has_table(FTS_TABLE)
+    columns = ", ".join(SEARCH_COLUMNS)
+    connection.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5({columns}, "
+        "content='apartments', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+    ))
+    connection.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON apartments BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {_fts_values('new')}); END"
+    ))
+    connection.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON apartments BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.id, {_fts_values('old')}); END"
+    ))
+    # Изменения других колонок (например, версии календаря) индекс не трогают
+    connection.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF {columns} ON apartments BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.id, {_fts_values('old')}); "
+        f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {_fts_values('new')}); END"
+    ))
+    if not exists:
+        connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+
+def create_fulltext_index(connection):
+    """Создает полнотекстовый индекс квартир: FULLTEXT в MySQL, FTS5 в SQLite
+
+    Для других СУБД ничего не делает: поиск по тексту в них идет через LIKE без индекса.
+    """
+    if connection.dialect.name == 'sqlite':
+        _create_sqlite_fts(connection)
+    elif connection.dialect.name == 'mysql':
+        indexes = {index['name'] for index in inspect(connection).get_indexes('apartments')}
+        if FULLTEXT_INDEX not in indexes:
+            connection.execute(text(
+                f"ALTER TABLE apartments ADD FULLTEXT INDEX {FULLTEXT_INDEX} ({', '.join(SEARCH_COLUMNS)})"
+            ))
+
+def _prefix_terms(terms: List[str]) -> List[str]:
+    """Каждое слово запроса ищется как префикс: основа слова находит все его формы
+
+    Слова состоят только из букв и цифр, поэтому синтаксис запроса в них не встречается.
+    Запись "слово*" одинаково понимают FTS5 и MySQL в BOOLEAN MODE.
+    """
+    return [f"{term}*" for term in terms]
+
+def _like_match(terms: List[str]):
+    """Поиск без полнотекстового индекса: LIKE по текстовым колонкам, оценка - число найденных слов
+
+    Просматривает таблицу целиком, поэтому годится только для СУБД, где индекса нет.
+    """
+    found = [
+        or_(*(getattr(Apartment, name).icontains(term, autoescape=True) for name in SEARCH_COLUMNS))
+        for term in dict.fromkeys(terms)
+    ]
+    scores = [case((condition, 1), else_=0) for condition in found]
+    return or_(*found), sum(scores[1:], scores[0]), None
+
+def fulltext_match(dialect_name: str, terms: List[str]):
+    """Условие совпадения, оценка релевантности (больше - лучше) и таблица для соединения
+
+    Квартира подходит, если в ней есть любое из слов; больше совпадений - выше оценка.
+    В СУБД без полнотекстового индекса слова ищутся через LIKE.
+
+    Returns:
+        (условие WHERE, выражение оценки, таблица FTS для соединения или None)
+    """
+    if dialect_name == 'sqlite':
+        fts = table(FTS_TABLE, column('rowid'))
+        condition = text(f"{FTS_TABLE} MATCH :fulltext_query").bindparams(fulltext_query=" OR ".join(_prefix_terms(terms)))
+        # bm25() в FTS5 отрицательна: чем меньше, тем релевантнее
+        score = -func.bm25(literal_column(FTS_TABLE))
+        return condition, score, fts
+    if dialect_name == 'mysql':
+        relevance = match(
+            *(getattr(Apartment, name) for name in SEARCH_COLUMNS),
+            against=" ".join(_prefix_terms(terms))
+        ).in_boolean_mode()
+        return relevance > 0, relevance, None
+    return _like_match(terms)
@@ -5,8 +5,12 @@ import sys
 import asyncio
 import nest_asyncio
 from dotenv import load_dotenv
-from telegram.ext import Application, ContextTypes, MessageHandler, CallbackQueryHandler, filters
-from bot.handlers import setup_handlers
+from telegram.ext import Application
+from bot.application import build_application
+from config import BOT_MODE
+from database.migrations import create_schema, dispose_engine, dispose_async_engine
+from services.background import start_background_tasks, stop_background_tasks
+from utils.http import close_http_session
 from telegram import Update
 
 # Применяем патч для поддержки вложенных циклов событий
@@ -33,8 +37,13 @@ if not BOT_TOKEN:
 # Глобальная переменная для хранения приложения
 application = None
 
-async def log_all_updates(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.info(f"ПОЛУЧЕН АПДЕЙТ: {update}")
+async def post_init(application: Application):
+    """Прогрев кешей и запуск фоновых задач"""
+    application.bot_data['background_tasks'] = await start_background_tasks(application.bot)
+
+async def post_stop(application: Application):
+    """Отправка оставшихся сообщений и остановка фоновых задач (до закрытия соединений бота)"""
+    await stop_background_tasks(application.bot_data.pop('background_tasks', []))
 
 async def shutdown(application: Application):
     """Корректное завершение работы бота"""
@@ -42,6 +51,9 @@ async def shutdown(application: Application):
     if application and application.running:
         await application.stop()
         await application.shutdown()
+    await close_http_session()
+    dispose_engine()
+    await dispose_async_engine()
 
 def signal_handler(signum, frame):
     """Обработчик сигналов для корректного завершения работы"""
@@ -56,15 +68,16 @@ async def main():
     """Основная функция запуска бота"""
     global application
     
-    # Создаем приложение
-    application = Application.builder().token(BOT_TOKEN).build()
+    if BOT_MODE == 'webhook':
+        # В режиме webhook бот работает внутри веб-приложения (python start.py)
+        logger.error("BOT_MODE=webhook: бот запускается вместе с веб-приложением, polling не используется")
+        return
     
-    # Настраиваем обработчики
-    setup_handlers(application)
+    # Схема БД создается один раз при запуске, а не в обработчиках
+    create_schema()
     
-    # Логируем все сообщения и callback-и
-    application.add_handler(MessageHandler(filters.ALL, log_all_updates), group=999)
-    application.add_handler(CallbackQueryHandler(log_all_updates), group=999)
+    # Создаем приложение с обработчиками
+    application = build_application(Application.builder().post_init(post_init).post_stop(post_stop))
     
     # Запускаем бота
     logger.info("Бот запущен")
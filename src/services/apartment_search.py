@@ -0,0 +1,131 @@
+import base64
+import binascii
+import json
+import logging
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import Apartment
+from database.search import fulltext_match
+from services.catalog_cache import apartment_to_dict
+from utils.bm25 import tokenize
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Оценка релевантности округляется в запросе: курсор хранит ровно то значение, с которым сравнивается
+SCORE_DIGITS = 6
+
+
+class InvalidCursor(ValueError):
+    """Курсор страницы поврежден или получен для другого запроса"""
+
+
+def encode_cursor(score: Optional[float], apartment_id: int) -> str:
+    """Курсор следующей страницы: позиция последней квартиры в порядке выдачи"""
+    raw = json.dumps([score, apartment_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[float], int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        score, apartment_id = json.loads(raw)
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise InvalidCursor(f"Неверный курсор: {cursor}") from e
+    if not isinstance(apartment_id, int) or not (score is None or isinstance(score, (int, float))):
+        raise InvalidCursor(f"Неверный курсор: {cursor}")
+    return score, apartment_id
+
+
+class ApartmentSearchService:
+    """
+    Полнотекстовый поиск квартир для Mini App.
+
+    Текст ищется по полнотекстовому индексу (FULLTEXT в MySQL, FTS5 в SQLite),
+    каждое слово запроса - по основе, поэтому "бассейном" находит "бассейн".
+    Результаты упорядочены по релевантности, при равной - по id; без текста
+    запроса - по id. Страницы выдаются по курсору (keyset): следующая страница
+    продолжает с позиции последней квартиры, а не пропускает OFFSET строк,
+    поэтому ее стоимость не растет с номером страницы.
+
+    Курсор - пара (оценка, id). Оценка округляется до SCORE_DIGITS знаков,
+    чтобы сравнение с ней не зависело от погрешности вещественных чисел,
+    а уникальный id разрешает совпадения оценок: квартиры с одинаковой
+    оценкой идут по возрастанию id, и ни одна не пропускается и не повторяется.
+    """
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    @staticmethod
+    def _filters(city: Optional[str], min_bedrooms: Optional[int], max_bedrooms: Optional[int],
+                 min_area: Optional[float], max_area: Optional[float]) -> list:
+        filters = []
+        if city:
+            filters.append(Apartment.city == city)
+        if min_bedrooms is not None:
+            filters.append(Apartment.num_bedrooms >= min_bedrooms)
+        if max_bedrooms is not None:
+            filters.append(Apartment.num_bedrooms <= max_bedrooms)
+        if min_area is not None:
+            filters.append(Apartment.area_sqm >= min_area)
+        if max_area is not None:
+            filters.append(Apartment.area_sqm <= max_area)
+        return filters
+
+    async def search(self, query: str = "", city: Optional[str] = None,
+                     min_bedrooms: Optional[int] = None, max_bedrooms: Optional[int] = None,
+                     min_area: Optional[float] = None, max_area: Optional[float] = None,
+                     limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None) -> dict:
+        """
+        Страница результатов поиска
+
+        Returns:
+            {'items': квартиры с оценкой релевантности в 'score', 'next_cursor': курсор или None}
+
+        Raises:
+            InvalidCursor: курсор не разобран или не подходит к запросу
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        after = decode_cursor(cursor) if cursor else None
+        terms = tokenize(query)
+        filters = self._filters(city, min_bedrooms, max_bedrooms, min_area, max_area)
+
+        if terms:
+            condition, score, fts = fulltext_match(self.session.bind.dialect.name, terms)
+            score = func.round(score, SCORE_DIGITS)
+            stmt = select(Apartment, score.label('score'))
+            if fts is not None:
+                stmt = stmt.join(fts, fts.c.rowid == Apartment.id)
+            stmt = stmt.where(condition, *filters)
+            if after is not None:
+                last_score, last_id = after
+                if last_score is None:
+                    raise InvalidCursor("Курсор получен для запроса без текста")
+                stmt = stmt.where(or_(score < last_score, and_(score == last_score, Apartment.id > last_id)))
+            stmt = stmt.order_by(score.desc(), Apartment.id)
+        else:
+            score = None
+            stmt = select(Apartment).where(*filters)
+            if after is not None:
+                stmt = stmt.where(Apartment.id > after[1])
+            stmt = stmt.order_by(Apartment.id)
+
+        # Лишняя строка показывает, есть ли следующая страница
+        result = await self.session.execute(stmt.limit(limit + 1))
+        rows = result.all()
+        items = []
+        for row in rows[:limit]:
+            item = apartment_to_dict(row[0])
+            item['score'] = row[1] if score is not None else None
+            items.append(item)
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = encode_cursor(items[-1]['score'], items[-1]['id'])
+        return {'items': items, 'next_cursor': next_cursor}
@@ -0,0 +1,422 @@
+import asyncio
+import logging
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select
+
+from config import AVAILABILITY_HORIZON_DAYS, AVAILABILITY_RELOAD_INTERVAL, MIN_NIGHTS_FOR_VACATION
+from database.migrations import get_async_session
+from database.models import Apartment, Booking
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Бронирования в этом статусе не занимают квартиру
+BOOKING_CANCELLED = "cancelled"
+
+# Квартиры в этом статусе участвуют в подборе дат
+APARTMENT_AVAILABLE = "available"
+
+
+def _to_date(value) -> date:
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _month_bounds(year: int, month: int) -> Tuple[date, date]:
+    """Первый день месяца и первый день следующего"""
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start, end
+
+
+def upcoming_months(today: date, count: int = 12) -> List[Tuple[int, int]]:
+    """count месяцев (год, месяц) начиная с текущего"""
+    months = []
+    year, month = today.year, today.month
+    for _ in range(count):
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+class OccupancyCalendar:
+    """
+    Занятые ночи одной квартиры.
+
+    Хранит бронирования как отсортированные непересекающиеся интервалы дат
+    [заезд, выезд): ночь выезда свободна. Поиск свободного окна - бинарный
+    поиск по началам интервалов и проход по промежуткам между ними.
+    """
+
+    def __init__(self):
+        self._bookings: Dict[int, Tuple[date, date]] = {}
+        self._starts: List[date] = []
+        self._ends: List[date] = []
+
+    def __len__(self) -> int:
+        return len(self._bookings)
+
+    def _rebuild(self):
+        """Сливает пересекающиеся бронирования в непересекающиеся интервалы"""
+        starts, ends = [], []
+        for start, end in sorted(self._bookings.values()):
+            if ends and start <= ends[-1]:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        self._starts, self._ends = starts, ends
+
+    def get(self, booking_id: int) -> Optional[Tuple[date, date]]:
+        """Даты заезда и выезда бронирования или None, если его нет в календаре"""
+        return self._bookings.get(booking_id)
+
+    def bookings(self) -> List[Tuple[date, date]]:
+        """Даты всех бронирований календаря, включая пересекающиеся"""
+        return list(self._bookings.values())
+
+    def replace(self, bookings: Iterable[Tuple[int, date, date]]):
+        """Заменяет все бронирования календаря (id, заезд, выезд) с одной перестройкой интервалов"""
+        self._bookings = {booking_id: (start, end) for booking_id, start, end in bookings}
+        self._rebuild()
+
+    def add(self, booking_id: int, start: date, end: date) -> Optional[Tuple[date, date]]:
+        """Добавляет или переносит бронирование. Возвращает прежние даты, если оно уже было"""
+        previous = self._bookings.get(booking_id)
+        self._bookings[booking_id] = (start, end)
+        if previous is not None:
+            self._rebuild()
+            return previous
+        i = bisect_right(self._starts, start)
+        # Частый случай - бронирование в свободном промежутке: вставка без перестройки
+        if (i == 0 or self._ends[i - 1] < start) and (i == len(self._starts) or end < self._starts[i]):
+            self._starts.insert(i, start)
+            self._ends.insert(i, end)
+        else:
+            self._rebuild()
+        return None
+
+    def remove(self, booking_id: int) -> Optional[Tuple[date, date]]:
+        """Удаляет бронирование. Возвращает его даты или None, если его не было"""
+        removed = self._bookings.pop(booking_id, None)
+        if removed is not None:
+            self._rebuild()
+        return removed
+
+    def is_free(self, start: date, end: date) -> bool:
+        """Свободны ли все ночи с start до end (не включая end)"""
+        # Первый интервал, который заканчивается позже start
+        i = bisect_right(self._ends, start)
+        return i == len(self._starts) or self._starts[i] >= end
+
+    def earliest_free(self, not_before: date, nights: int, until: date) -> Optional[date]:
+        """Первая дата заезда не раньше not_before, с которой свободны nights ночей подряд до until"""
+        candidate = not_before
+        # Первый интервал, который заканчивается позже candidate
+        i = bisect_right(self._ends, candidate)
+        while i < len(self._starts) and self._starts[i] < candidate + timedelta(days=nights):
+            candidate = max(candidate, self._ends[i])
+            i += 1
+        if candidate + timedelta(days=nights) > until:
+            return None
+        return candidate
+
+
+class AvailabilityMatrix:
+    """
+    Матрица занятости квартиры x день на horizon_days дней от origin.
+
+    Строки квартир сгруппированы по городам, в ячейке - число бронирований,
+    занимающих ночь. Вместе с матрицей поддерживается число свободных
+    квартир по городу и дню, поэтому свободные ночи города за любой месяц -
+    это сумма по отрезку одной строки, а бронирование меняет только свой
+    отрезок дней у одной квартиры и одного города.
+    """
+
+    def __init__(self, apartments: List[Tuple[int, str]], origin: date, horizon_days: int):
+        self.origin = origin
+        self.horizon_days = horizon_days
+        ordered = sorted(apartments, key=lambda apartment: (apartment[1], apartment[0]))
+        self.cities: List[str] = sorted({city for _, city in ordered})
+        self._city_index = {city: i for i, city in enumerate(self.cities)}
+        self._row = {apartment_id: row for row, (apartment_id, _) in enumerate(ordered)}
+        self._row_city = np.array([self._city_index[city] for _, city in ordered], dtype=np.intp)
+        self.occupancy = np.zeros((len(ordered), horizon_days), dtype=np.uint8)
+        self.city_free = np.zeros((len(self.cities), horizon_days), dtype=np.int32)
+        self._recount()
+
+    def _recount(self):
+        """Пересчитывает свободные квартиры по городам и дням по всей матрице"""
+        free = self.occupancy == 0
+        if len(self.cities):
+            city_starts = np.searchsorted(self._row_city, np.arange(len(self.cities)))
+            self.city_free = np.add.reduceat(free, city_starts, axis=0, dtype=np.int32)
+
+    def _columns(self, start: date, end: date) -> Tuple[int, int]:
+        return (
+            min(max((start - self.origin).days, 0), self.horizon_days),
+            min(max((end - self.origin).days, 0), self.horizon_days),
+        )
+
+    def load_bookings(self, bookings: List[Tuple[int, date, date]]):
+        """Заполняет матрицу бронированиями (квартира, заезд, выезд) и пересчитывает итоги"""
+        for apartment_id, start, end in bookings:
+            row = self._row.get(apartment_id)
+            if row is not None:
+                first, last = self._columns(start, end)
+                self.occupancy[row, first:last] += 1
+        self._recount()
+
+    def apply(self, apartment_id: int, start: date, end: date, delta: int):
+        """Добавляет (delta=1) или снимает (delta=-1) бронирование"""
+        row = self._row.get(apartment_id)
+        if row is None:
+            return
+        first, last = self._columns(start, end)
+        if first >= last:
+            return
+        cells = self.occupancy[row, first:last]
+        if delta > 0:
+            became_busy = cells == 0
+            cells += 1
+            self.city_free[self._row_city[row], first:last] -= became_busy
+        else:
+            became_free = cells == 1
+            cells -= (cells > 0).astype(np.uint8)
+            self.city_free[self._row_city[row], first:last] += became_free
+
+    def _month_columns(self, months: List[Tuple[int, int]], today: date) -> List[Tuple[int, int]]:
+        columns = []
+        for year, month in months:
+            month_start, next_month = _month_bounds(year, month)
+            columns.append(self._columns(max(month_start, today), next_month))
+        return columns
+
+    def free_nights_by_month(self, city: Optional[str], months: List[Tuple[int, int]], today: date) -> List[int]:
+        """Свободные ночи (квартиро-ночи) города или всех городов по месяцам"""
+        if city is None:
+            free_by_day = self.city_free.sum(axis=0)
+        elif city in self._city_index:
+            free_by_day = self.city_free[self._city_index[city]]
+        else:
+            return [0] * len(months)
+        return [int(free_by_day[first:last].sum()) for first, last in self._month_columns(months, today)]
+
+    def free_nights_by_city(self, year: int, month: int, today: date) -> Dict[str, int]:
+        """Свободные ночи месяца по всем городам"""
+        [(first, last)] = self._month_columns([(year, month)], today)
+        totals = self.city_free[:, first:last].sum(axis=1)
+        return {city: int(total) for city, total in zip(self.cities, totals)}
+
+
+class AvailabilityEngine:
+    """
+    Календари занятости квартир в памяти процесса.
+
+    Для поиска окон на N ночей подряд у каждой квартиры есть OccupancyCalendar,
+    для подсчета свободных ночей по городам и месяцам - общая AvailabilityMatrix.
+    Загружается одним запросом к apartments и bookings, затем обновляется
+    по событиям booking_created / booking_cancelled и периодически
+    перечитывается целиком, чтобы учесть изменения из других процессов.
+    Ответы на частые вопросы меню кешируются до ближайшего изменения
+    календарей города.
+    """
+
+    def __init__(self, horizon_days: int = AVAILABILITY_HORIZON_DAYS, reload_interval: int = AVAILABILITY_RELOAD_INTERVAL):
+        self.horizon_days = horizon_days
+        self.reload_interval = reload_interval
+        self._calendars: Dict[int, OccupancyCalendar] = {}
+        self._city_of: Dict[int, str] = {}
+        self._apartments_by_city: Dict[str, List[int]] = {}
+        self._cache: Dict[Optional[str], dict] = {}
+        self._cache_day: Optional[date] = None
+        self._matrix: Optional[AvailabilityMatrix] = None
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        # События бронирований, пришедшие во время перечитывания из БД
+        self._pending_events: Optional[list] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def load(self, apartments: List[Tuple[int, str]], bookings: List[Tuple[int, int, date, date]],
+             today: Optional[date] = None):
+        """Заменяет календари: apartments - (id, город), bookings - (id, квартира, заезд, выезд)"""
+        calendars = {apartment_id: OccupancyCalendar() for apartment_id, _ in apartments}
+        city_of = dict(apartments)
+        by_city: Dict[str, List[int]] = {}
+        for apartment_id, city in apartments:
+            by_city.setdefault(city, []).append(apartment_id)
+        by_apartment: Dict[int, List[Tuple[int, date, date]]] = {}
+        for booking_id, apartment_id, start, end in bookings:
+            if apartment_id in calendars:
+                by_apartment.setdefault(apartment_id, []).append((booking_id, _to_date(start), _to_date(end)))
+        for apartment_id, apartment_bookings in by_apartment.items():
+            calendars[apartment_id].replace(apartment_bookings)
+        matrix = AvailabilityMatrix(apartments, today or date.today(), self.horizon_days)
+        matrix.load_bookings([
+            (apartment_id, start, end)
+            for apartment_id, calendar in calendars.items() for start, end in calendar.bookings()
+        ])
+        self._calendars, self._city_of, self._apartments_by_city = calendars, city_of, by_city
+        self._matrix = matrix
+        self._cache.clear()
+        self._loaded = True
+
+    async def reload(self, today: Optional[date] = None):
+        """Перечитывает квартиры и будущие бронирования из БД"""
+        today = today or date.today()
+        self._pending_events = []
+        try:
+            apartments, bookings = await self._fetch(today)
+        finally:
+            events, self._pending_events = self._pending_events, None
+        self.load(apartments, bookings, today)
+        # Бронирования, сохраненные во время чтения, повторно применяются к новым календарям
+        for handler, booking in events:
+            handler(booking)
+        logger.info(f"Календари занятости загружены: {len(apartments)} квартир, {len(bookings)} бронирований")
+
+    async def _fetch(self, today: date) -> tuple:
+        async with get_async_session() as session:
+            result = await session.execute(
+                select(Apartment.id, Apartment.city).where(Apartment.status == APARTMENT_AVAILABLE)
+            )
+            apartments = result.all()
+            result = await session.execute(
+                select(Booking.id, Booking.apartment_id, Booking.start_date, Booking.end_date).where(
+                    Booking.end_date > datetime.combine(today, datetime.min.time()),
+                    Booking.status != BOOKING_CANCELLED
+                )
+            )
+            bookings = result.all()
+        return apartments, bookings
+
+    async def ensure_loaded(self) -> 'AvailabilityEngine':
+        if not self._loaded:
+            async with self._lock:
+                # Пока ждали блокировку, календари мог загрузить другой обработчик
+                if not self._loaded:
+                    await self.reload()
+        return self
+
+    async def watch(self):
+        """Периодически перечитывает календари. Запускается фоновой задачей"""
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                async with self._lock:
+                    await self.reload()
+            except Exception as e:
+                logger.error(f"Ошибка при обновлении календарей занятости: {str(e)}", exc_info=True)
+
+    def _invalidate(self, apartment_id: int):
+        self._cache.pop(self._city_of.get(apartment_id), None)
+        self._cache.pop(None, None)
+
+    def booking_created(self, booking: Booking):
+        """Учитывает новое бронирование"""
+        if self._pending_events is not None:
+            self._pending_events.append((self.booking_created, booking))
+        calendar = self._calendars.get(booking.apartment_id)
+        if calendar is None or booking.status == BOOKING_CANCELLED:
+            return
+        start, end = _to_date(booking.start_date), _to_date(booking.end_date)
+        previous = calendar.add(booking.id, start, end)
+        if previous is not None:
+            self._matrix.apply(booking.apartment_id, *previous, delta=-1)
+        self._matrix.apply(booking.apartment_id, start, end, delta=1)
+        self._invalidate(booking.apartment_id)
+
+    def booking_cancelled(self, booking: Booking):
+        """Освобождает ночи отмененного бронирования"""
+        if self._pending_events is not None:
+            self._pending_events.append((self.booking_cancelled, booking))
+        calendar = self._calendars.get(booking.apartment_id)
+        if calendar is None:
+            return
+        previous = calendar.remove(booking.id)
+        if previous is not None:
+            self._matrix.apply(booking.apartment_id, *previous, delta=-1)
+            self._invalidate(booking.apartment_id)
+
+    def _apartments(self, city: Optional[str]) -> List[int]:
+        if city is None:
+            return list(self._calendars)
+        return self._apartments_by_city.get(city, [])
+
+    def _cached(self, city: Optional[str], key: tuple, today: date, compute):
+        if self._cache_day != today:
+            self._cache.clear()
+            self._cache_day = today
+        city_cache = self._cache.setdefault(city, {})
+        if key not in city_cache:
+            city_cache[key] = compute()
+        return city_cache[key]
+
+    def is_free(self, apartment_id: int, start: date, end: date) -> bool:
+        calendar = self._calendars.get(apartment_id)
+        return calendar is not None and calendar.is_free(_to_date(start), _to_date(end))
+
+    def earliest_start(self, city: Optional[str] = None, nights: int = MIN_NIGHTS_FOR_VACATION,
+                       today: Optional[date] = None) -> Optional[date]:
+        """Ближайшая дата заезда хотя бы в одну квартиру города (или любого города) на nights ночей"""
+        today = today or date.today()
+
+        def compute():
+            until = today + timedelta(days=self.horizon_days)
+            dates = [
+                found for found in (
+                    self._calendars[apartment_id].earliest_free(today, nights, until)
+                    for apartment_id in self._apartments(city)
+                ) if found is not None
+            ]
+            return min(dates, default=None)
+
+        return self._cached(city, ('earliest', nights), today, compute)
+
+    def months_with_capacity(self, city: Optional[str] = None, nights: int = MIN_NIGHTS_FOR_VACATION,
+                             months: int = 12, today: Optional[date] = None) -> List[Tuple[int, int]]:
+        """Месяцы (год, месяц) начиная с текущего, в которые можно заехать хотя бы в одну квартиру на nights ночей"""
+        today = today or date.today()
+
+        def compute():
+            until = today + timedelta(days=self.horizon_days)
+            result = []
+            for year, month in upcoming_months(today, months):
+                month_start, next_month = _month_bounds(year, month)
+                not_before = max(month_start, today)
+                for apartment_id in self._apartments(city):
+                    found = self._calendars[apartment_id].earliest_free(not_before, nights, until)
+                    if found is not None and found < next_month:
+                        result.append((year, month))
+                        break
+            return result
+
+        return self._cached(city, ('months', nights, months), today, compute)
+
+    def free_nights_by_month(self, city: Optional[str] = None, months: int = 12,
+                             today: Optional[date] = None) -> Dict[Tuple[int, int], int]:
+        """Свободные ночи города (или всех городов) по месяцам начиная с текущего"""
+        today = today or date.today()
+        upcoming = upcoming_months(today, months)
+        return dict(zip(upcoming, self._matrix.free_nights_by_month(city, upcoming, today)))
+
+    def free_nights_by_city(self, year: int, month: int, today: Optional[date] = None) -> Dict[str, int]:
+        """Свободные ночи месяца по городам"""
+        return self._matrix.free_nights_by_city(year, month, today or date.today())
+
+
+# Календари общие для всех обработчиков процесса
+_availability_engine: Optional[AvailabilityEngine] = None
+
+def get_availability_engine() -> AvailabilityEngine:
+    """Возвращает общий для процесса движок доступности, создавая его при первом вызове"""
+    global _availability_engine
+    if _availability_engine is None:
+        _availability_engine = AvailabilityEngine()
+    return _availability_engine
@@ -0,0 +1,62 @@
+import asyncio
+import logging
+from typing import List, Optional
+
+from telegram import Bot
+
+from config import METRICS_LOG_INTERVAL
+from services.availability import get_availability_engine
+from services.broadcast import BroadcastRunner
+from services.catalog_cache import get_catalog_cache
+from services.exchange_rate import get_exchange_rate_service
+from services.message_queue import drain_message_queue, get_message_queue
+from services.night_accrual import NightAccrualEngine
+from services.payment_checker import PaymentChecker
+from services.renewal_reminders import RenewalReminderScanner
+from utils.metrics import log_metrics
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+async def start_background_tasks(bot: Optional[Bot] = None) -> List[asyncio.Task]:
+    """
+    Прогрев кешей и запуск фоновых задач процесса.
+
+    Вызывается один раз при запуске процесса бота или веб-приложения.
+    bot передается только процессом, в котором работает бот: там же
+    запускаются очередь исходящих сообщений (через пул соединений этого бота)
+    и сверка платежей, чтобы при раздельном запуске они не работали дважды.
+    """
+    catalog_cache = get_catalog_cache()
+    await catalog_cache.warm()
+    availability = get_availability_engine()
+    await availability.reload()
+    # Курс TON/RUB обновляется заранее, чтобы счета не ждали провайдера
+    exchange_rate_service = get_exchange_rate_service()
+    await exchange_rate_service.load_last_known()
+    tasks = [
+        asyncio.create_task(catalog_cache.watch_version()),
+        asyncio.create_task(availability.watch()),
+        asyncio.create_task(exchange_rate_service.run_refresher()),
+        asyncio.create_task(log_metrics(METRICS_LOG_INTERVAL)),
+    ]
+    if bot is not None:
+        tasks.append(get_message_queue(bot).start())
+        # Сверка ожидающих платежей с входящими транзакциями кошелька
+        tasks.append(asyncio.create_task(PaymentChecker().start()))
+        # Новые и прерванные рассылки
+        tasks.append(asyncio.create_task(BroadcastRunner().watch()))
+        # Начисление ночей за прошедший месяц и уведомления о нем
+        tasks.append(asyncio.create_task(NightAccrualEngine().start()))
+        # Напоминания о скором сроке оплаты подписки
+        tasks.append(asyncio.create_task(RenewalReminderScanner().start()))
+    return tasks
+
+
+async def stop_background_tasks(tasks: List[asyncio.Task], drain_timeout: float = 10):
+    """Отправляет оставшиеся в очереди сообщения, отменяет фоновые задачи и дожидается их завершения"""
+    await drain_message_queue(drain_timeout)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
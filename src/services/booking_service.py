@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import random
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import BOOKING_MAX_ATTEMPTS, MIN_NIGHTS_FOR_VACATION
+from database.models import Apartment, Booking, Subscription, SubscriptionStatus, User
+from services.availability import BOOKING_CANCELLED, AvailabilityEngine, get_availability_engine
+from utils.helpers import validate_booking_dates
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+BOOKING_CONFIRMED = "confirmed"
+
+
+class BookingError(Exception):
+    """Бронирование не может быть создано"""
+
+
+class InvalidBookingDates(BookingError):
+    """Даты не образуют допустимый отпуск"""
+
+
+class DatesUnavailable(BookingError):
+    """Квартира занята на эти даты или не сдается"""
+
+
+class NotEnoughNights(BookingError):
+    """У пользователя нет активной подписки с достаточным количеством ночей"""
+
+
+class BookingConflict(BookingError):
+    """Не удалось забронировать из-за постоянных одновременных изменений календаря квартиры"""
+
+
+class BookingService:
+    """
+    Бронирование квартир за накопленные ночи.
+
+    Одновременные бронирования одной квартиры разрешаются оптимистичной
+    блокировкой: транзакция увеличивает apartments.booking_version, только если
+    версия не изменилась с момента проверки пересечений. Если календарь квартиры
+    успел измениться, транзакция откатывается и повторяется с новой проверкой.
+    Списание ночей (с подписки и с users.current_nights) и запись бронирования
+    происходят в той же транзакции.
+    """
+
+    def __init__(self, session: AsyncSession, availability: Optional[AvailabilityEngine] = None,
+                 max_attempts: int = BOOKING_MAX_ATTEMPTS):
+        self.session = session
+        self.availability = availability or get_availability_engine()
+        self.max_attempts = max_attempts
+
+    async def _has_overlap(self, apartment_id: int, start_date: datetime, end_date: datetime) -> bool:
+        """Пересечение с бронированиями квартиры по индексу ix_bookings_apartment_dates"""
+        result = await self.session.execute(
+            select(Booking.id).where(
+                Booking.apartment_id == apartment_id,
+                Booking.start_date < end_date,
+                Booking.end_date > start_date,
+                Booking.status != BOOKING_CANCELLED
+            ).limit(1)
+        )
+        return result.first() is not None
+
+    async def _active_subscription_id(self, user_id: int) -> Optional[int]:
+        """Активная подписка пользователя (по индексу ix_subscriptions_user_id_status)"""
+        result = await self.session.execute(
+            select(Subscription.id)
+            .where(Subscription.user_id == user_id, Subscription.status == SubscriptionStatus.ACTIVE)
+            .order_by(Subscription.id)
+            .limit(1)
+        )
+        return result.scalar()
+
+    async def _add_user_nights(self, user_id: int, nights: int):
+        """Изменяет users.current_nights в текущей транзакции; отрицательное значение списывает ночи"""
+        await self.session.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(current_nights=func.coalesce(User.current_nights, 0) + nights)
+            .execution_options(synchronize_session=False)
+        )
+
+    async def _bump_version(self, apartment_id: int, version: int) -> bool:
+        """Увеличивает версию календаря квартиры, если ее никто не изменил"""
+        result = await self.session.execute(
+            update(Apartment)
+            .where(Apartment.id == apartment_id, Apartment.booking_version == version)
+            .values(booking_version=version + 1)
+        )
+        return result.rowcount == 1
+
+    async def _try_create(self, user_id: int, apartment_id: int, start_date: datetime,
+                          end_date: datetime, nights: int) -> Optional[Booking]:
+        """Одна попытка. Возвращает None, если календарь квартиры изменился во время проверки"""
+        result = await self.session.execute(
+            select(Apartment.booking_version, Apartment.status).where(Apartment.id == apartment_id)
+        )
+        apartment = result.first()
+        if apartment is None or apartment.status != "available":
+            raise DatesUnavailable(f"Квартира {apartment_id} не сдается")
+        if await self._has_overlap(apartment_id, start_date, end_date):
+            raise DatesUnavailable(f"Квартира {apartment_id} занята с {start_date:%d.%m.%Y} по {end_date:%d.%m.%Y}")
+
+        if not await self._bump_version(apartment_id, apartment.booking_version):
+            return None
+
+        subscription_id = await self._active_subscription_id(user_id)
+        # Ночи списываются условным UPDATE, поэтому баланс не уходит в минус
+        # и при одновременных бронированиях одного пользователя в разные квартиры
+        result = await self.session.execute(
+            update(Subscription)
+            .where(Subscription.id == subscription_id, Subscription.accumulated_nights >= nights)
+            .values(accumulated_nights=Subscription.accumulated_nights - nights)
+            .execution_options(synchronize_session=False)
+        )
+        if subscription_id is None or result.rowcount != 1:
+            raise NotEnoughNights(f"Для бронирования нужно {nights} ночей")
+        await self._add_user_nights(user_id, -nights)
+
+        booking = Booking(
+            user_id=user_id,
+            apartment_id=apartment_id,
+            start_date=start_date,
+            end_date=end_date,
+            nights_used=nights,
+            subscription_id=subscription_id,
+            status=BOOKING_CONFIRMED
+        )
+        self.session.add(booking)
+        await self.session.commit()
+        return booking
+
+    async def create_booking(self, user_id: int, apartment_id: int, start_date: datetime, end_date: datetime) -> Booking:
+        """
+        Бронирует квартиру и списывает ночи с активной подписки пользователя
+
+        Raises:
+            InvalidBookingDates, DatesUnavailable, NotEnoughNights, BookingConflict
+        """
+        if not validate_booking_dates(start_date, end_date, MIN_NIGHTS_FOR_VACATION):
+            raise InvalidBookingDates(f"Минимальный отпуск - {MIN_NIGHTS_FOR_VACATION} ночей")
+        nights = (end_date - start_date).days
+
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                booking = await self._try_create(user_id, apartment_id, start_date, end_date, nights)
+            except BookingError:
+                await self.session.rollback()
+                raise
+            except OperationalError as e:
+                # Блокировка или взаимоблокировка в БД - такой же конфликт, как смена версии
+                logger.warning(f"Конфликт блокировок при бронировании квартиры {apartment_id}: {e.orig}")
+                booking = None
+            if booking is not None:
+                self.availability.booking_created(booking)
+                logger.info(f"Квартира {apartment_id} забронирована пользователем {user_id} на {nights} ночей")
+                return booking
+            await self.session.rollback()
+            # Небольшая случайная пауза, чтобы повторные попытки не совпадали
+            await asyncio.sleep(random.uniform(0, 0.01 * attempt))
+
+        raise BookingConflict(f"Не удалось забронировать квартиру {apartment_id} за {self.max_attempts} попыток")
+
+    async def cancel_booking(self, booking_id: int) -> bool:
+        """Отменяет бронирование и возвращает ночи на подписку, с которой они были списаны"""
+        booking = await self.session.get(Booking, booking_id)
+        if booking is None or booking.status == BOOKING_CANCELLED:
+            return False
+        result = await self.session.execute(
+            update(Booking)
+            .where(Booking.id == booking_id, Booking.status != BOOKING_CANCELLED)
+            .values(status=BOOKING_CANCELLED)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            await self.session.rollback()
+            return False
+        await self.session.execute(
+            update(Apartment)
+            .where(Apartment.id == booking.apartment_id)
+            .values(booking_version=Apartment.booking_version + 1)
+        )
+        # Бронирования, созданные до появления subscription_id, возвращают ночи на активную подписку
+        subscription_id = booking.subscription_id or await self._active_subscription_id(booking.user_id)
+        if subscription_id is not None:
+            await self.session.execute(
+                update(Subscription)
+                .where(Subscription.id == subscription_id)
+                .values(accumulated_nights=Subscription.accumulated_nights + booking.nights_used)
+                .execution_options(synchronize_session=False)
+            )
+        await self._add_user_nights(booking.user_id, booking.nights_used)
+        await self.session.commit()
+        self.availability.booking_cancelled(booking)
+        return True
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import and_, exists, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import BROADCAST_PAGE_SIZE, BROADCAST_POLL_INTERVAL, MIN_NIGHTS_FOR_VACATION
+from database.migrations import get_async_session
+from database.models import (
+    BroadcastCampaign, BroadcastDelivery, Subscription, SubscriptionStatus, User
+)
+from services.message_queue import OutboundMessageQueue, Priority, get_message_queue
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Статусы рассылки
+PENDING = "pending"
+RUNNING = "running"
+COMPLETED = "completed"
+CANCELLED = "cancelled"
+
+# Статусы отправки
+SENT = "sent"
+FAILED = "failed"
+
+
+def _has_active_subscription(*conditions):
+    return exists().where(
+        Subscription.user_id == User.id,
+        Subscription.status == SubscriptionStatus.ACTIVE,
+        *conditions
+    )
+
+
+# Сегменты получателей: имя -> условие на users по параметру сегмента
+SEGMENTS = {
+    # Все пользователи
+    'all': lambda param: [],
+    # Пользователи с активной подпиской
+    'active_subscribers': lambda param: [_has_active_subscription()],
+    # Накопили достаточно ночей для отпуска (по умолчанию MIN_NIGHTS_FOR_VACATION)
+    'vacation_ready': lambda param: [_has_active_subscription(
+        Subscription.accumulated_nights >= (param if param is not None else MIN_NIGHTS_FOR_VACATION)
+    )],
+    # Приглашенные пользователем с users.id = param
+    'referrals': lambda param: [User.referrer_id == param],
+}
+
+
+def segment_conditions(segment: str, param: Optional[int] = None) -> list:
+    """Условия выборки получателей сегмента"""
+    if segment not in SEGMENTS:
+        raise ValueError(f"Неизвестный сегмент рассылки: {segment}. Доступны: {', '.join(SEGMENTS)}")
+    if segment == 'referrals' and param is None:
+        raise ValueError("Для сегмента referrals нужен id пригласившего пользователя")
+    return SEGMENTS[segment](param)
+
+
+async def create_campaign(session: AsyncSession, text: str, segment: str,
+                          segment_param: Optional[int] = None) -> BroadcastCampaign:
+    """Создает рассылку. Ее подхватит BroadcastRunner в процессе бота"""
+    segment_conditions(segment, segment_param)
+    campaign = BroadcastCampaign(text=text, segment=segment, segment_param=segment_param, status=PENDING)
+    session.add(campaign)
+    await session.commit()
+    return campaign
+
+
+class BroadcastRunner:
+    """
+    Выполнение рассылок через общую очередь исходящих сообщений.
+
+    Получатели читаются страницами по возрастанию users.id (keyset-пагинация),
+    каждая страница - потоково (yield_per), поэтому в памяти находится не больше
+    одной страницы получателей. Следующая страница ставится в очередь только
+    после отправки предыдущей: очередь не переполняется, а соединение с БД
+    не удерживается, пока сообщения ждут своей очереди.
+
+    Каждая отправка сразу записывается в broadcast_deliveries, а после страницы
+    сдвигается контрольная точка last_user_id. Рассылка, прерванная сбоем,
+    продолжается с контрольной точки, пропуская уже записанных получателей.
+    """
+
+    def __init__(self, queue: Optional[OutboundMessageQueue] = None, page_size: int = BROADCAST_PAGE_SIZE,
+                 poll_interval: int = BROADCAST_POLL_INTERVAL):
+        self.queue = queue or get_message_queue()
+        self.page_size = page_size
+        self.poll_interval = poll_interval
+
+    async def stream_recipients(self, campaign: BroadcastCampaign,
+                                after_user_id: int = 0) -> AsyncIterator[List[Tuple[int, int]]]:
+        """Страницы получателей (users.id, telegram_id) с id больше after_user_id"""
+        conditions = segment_conditions(campaign.segment, campaign.segment_param)
+        while True:
+            query = (
+                select(User.id, User.telegram_id)
+                .where(User.id > after_user_id, *conditions)
+                .order_by(User.id)
+                .limit(self.page_size)
+                .execution_options(yield_per=self.page_size)
+            )
+            async with get_async_session() as session:
+                result = await session.stream(query)
+                page = [tuple(row) async for row in result]
+            if not page:
+                return
+            yield page
+            if len(page) < self.page_size:
+                return
+            after_user_id = page[-1][0]
+
+    async def _delivered_user_ids(self, session: AsyncSession, campaign_id: int,
+                                  first_user_id: int, last_user_id: int) -> Set[int]:
+        """Получатели страницы, которым сообщение уже отправлялось до сбоя"""
+        result = await session.execute(
+            select(BroadcastDelivery.user_id).where(
+                BroadcastDelivery.campaign_id == campaign_id,
+                BroadcastDelivery.user_id.between(first_user_id, last_user_id)
+            )
+        )
+        return set(result.scalars().all())
+
+    async def _send_page(self, session: AsyncSession, campaign: BroadcastCampaign,
+                         page: List[Tuple[int, int]]) -> Tuple[int, int]:
+        """Отправляет страницу и записывает каждую отправку по мере завершения"""
+        delivered = await self._delivered_user_ids(session, campaign.id, page[0][0], page[-1][0])
+        futures: Dict[asyncio.Future, int] = {
+            self.queue.enqueue(telegram_id, campaign.text, Priority.BROADCAST): user_id
+            for user_id, telegram_id in page if user_id not in delivered
+        }
+        sent = failed = 0
+        remaining = set(futures)
+        while remaining:
+            done, remaining = await asyncio.wait(remaining, return_when=asyncio.FIRST_COMPLETED)
+            rows = []
+            for future in done:
+                status = FAILED if future.exception() else SENT
+                rows.append({'campaign_id': campaign.id, 'user_id': futures[future], 'status': status})
+                if status == SENT:
+                    sent += 1
+                else:
+                    failed += 1
+            await session.execute(insert(BroadcastDelivery), rows)
+            await session.commit()
+        return sent, failed
+
+    async def run_campaign(self, campaign_id: int) -> Optional[BroadcastCampaign]:
+        """Выполняет (или продолжает) рассылку до конца сегмента"""
+        async with get_async_session() as session:
+            campaign = await session.get(BroadcastCampaign, campaign_id)
+            if campaign is None or campaign.status not in (PENDING, RUNNING):
+                return campaign
+            if campaign.status == PENDING:
+                campaign.status = RUNNING
+                campaign.started_at = datetime.utcnow()
+                await session.commit()
+            else:
+                logger.info(f"Рассылка {campaign.id} продолжается с users.id > {campaign.last_user_id}")
+
+        async for page in self.stream_recipients(campaign, after_user_id=campaign.last_user_id):
+            async with get_async_session() as session:
+                status = await session.scalar(select(BroadcastCampaign.status).where(BroadcastCampaign.id == campaign.id))
+                if status == CANCELLED:
+                    logger.info(f"Рассылка {campaign.id} отменена")
+                    campaign.status = CANCELLED
+                    return campaign
+                sent, failed = await self._send_page(session, campaign, page)
+                campaign.last_user_id = page[-1][0]
+                campaign.sent_count += sent
+                campaign.failed_count += failed
+                # Контрольная точка: страница полностью обработана
+                await session.execute(
+                    update(BroadcastCampaign)
+                    .where(BroadcastCampaign.id == campaign.id)
+                    .values(
+                        last_user_id=campaign.last_user_id,
+                        sent_count=BroadcastCampaign.sent_count + sent,
+                        failed_count=BroadcastCampaign.failed_count + failed,
+                    )
+                )
+                await session.commit()
+
+        async with get_async_session() as session:
+            await session.execute(
+                update(BroadcastCampaign)
+                .where(BroadcastCampaign.id == campaign.id, BroadcastCampaign.status == RUNNING)
+                .values(status=COMPLETED, finished_at=datetime.utcnow())
+            )
+            await session.commit()
+        campaign.status = COMPLETED
+        logger.info(f"Рассылка {campaign.id} завершена: отправлено {campaign.sent_count}, ошибок {campaign.failed_count}")
+        return campaign
+
+    async def run_pending(self) -> int:
+        """Выполняет все незавершенные рассылки по порядку. Возвращает их количество"""
+        async with get_async_session() as session:
+            result = await session.execute(
+                select(BroadcastCampaign.id)
+                .where(BroadcastCampaign.status.in_([PENDING, RUNNING]))
+                .order_by(BroadcastCampaign.id)
+            )
+            campaign_ids = result.scalars().all()
+        for campaign_id in campaign_ids:
+            await self.run_campaign(campaign_id)
+        return len(campaign_ids)
+
+    async def watch(self):
+        """Фоновая задача процесса бота: подхватывает новые и прерванные рассылки"""
+        while True:
+            try:
+                await self.run_pending()
+            except Exception as e:
+                logger.error(f"Ошибка при выполнении рассылки: {str(e)}", exc_info=True)
+            await asyncio.sleep(self.poll_interval)
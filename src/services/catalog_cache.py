@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy import select
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from bot.callback_router import CB_ASK_QUESTION, CB_START_OVER, CB_SUBSCRIBE_NOW, callback_data
+from config import CATALOG_CACHE_TTL, CATALOG_VERSION_POLL_INTERVAL
+from database.catalog import get_catalog_version
+from database.migrations import get_async_session
+from database.models import Apartment, PointOfInterest
+from utils.helpers import format_apartment_info
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Колонки квартиры, которые отдаются в API Mini App
+APARTMENT_FIELDS = (
+    'id', 'city', 'address', 'description', 'video_url', 'features', 'nearby_attractions',
+    'status', 'area_sqm', 'num_bedrooms', 'apartment_type', 'owner_id', 'latitude', 'longitude',
+    'video_file_id', 'video_thumbnail_file_id'
+)
+
+# Колонки места рядом с квартирами
+POINT_FIELDS = ('id', 'city', 'name', 'latitude', 'longitude')
+
+def apartment_to_dict(apartment: Apartment) -> dict:
+    """Преобразует квартиру в словарь, не связанный с сессией БД"""
+    return {field: getattr(apartment, field) for field in APARTMENT_FIELDS}
+
+def build_offer_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура действий под предложением квартиры"""
+    keyboard = [
+        [InlineKeyboardButton("Оформить подписку", callback_data=callback_data(CB_SUBSCRIBE_NOW))],
+        [InlineKeyboardButton("Задать вопрос", callback_data=callback_data(CB_ASK_QUESTION))],
+        [InlineKeyboardButton("Вернуться в начало", callback_data=callback_data(CB_START_OVER))]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+class CityCatalog:
+    """Закешированный каталог одного города: данные для API и готовое предложение для бота"""
+
+    def __init__(self, city: str, apartments: List[dict]):
+        self.city = city
+        self.apartments = apartments
+        self.base = next((a for a in apartments if a['apartment_type'] == "Base"), None)
+        self.offer_text = None
+        self.video_url = None
+        self.reply_markup = None
+        if self.base:
+            self.offer_text = (
+                f"На эти даты есть прекрасная квартира бизнес-класса в {self.base['city']}.\n\n"
+                + format_apartment_info(self.base)
+            )
+            self.video_url = self.base['video_url']
+            self.reply_markup = build_offer_keyboard()
+
+class CatalogCache:
+    """
+    Кеш каталога квартир по городам.
+
+    Записи живут не дольше ttl секунд и сбрасываются сразу, как только
+    импортер увеличивает версию каталога в таблице catalog_version.
+    """
+
+    def __init__(self, ttl: int = CATALOG_CACHE_TTL, poll_interval: int = CATALOG_VERSION_POLL_INTERVAL):
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self._cities: Dict[str, CityCatalog] = {}
+        self._points: List[dict] = []
+        self._loaded_at: Optional[float] = None
+        self._version: Optional[int] = None
+        self._lock = asyncio.Lock()
+        # Увеличивается при каждой загрузке: по нему зависимые индексы узнают об обновлении каталога
+        self.generation = 0
+
+    def _is_fresh(self) -> bool:
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    async def warm(self):
+        """Загружает весь каталог одним запросом и заменяет содержимое кеша"""
+        async with get_async_session() as session:
+            version = await get_catalog_version(session)
+            result = await session.execute(select(Apartment).order_by(Apartment.id))
+            apartments = [apartment_to_dict(a) for a in result.scalars()]
+            # Места меняет тот же импортер, поэтому они версионируются вместе с квартирами
+            result = await session.execute(select(PointOfInterest).order_by(PointOfInterest.id))
+            points = [{field: getattr(p, field) for field in POINT_FIELDS} for p in result.scalars()]
+
+        by_city: Dict[str, List[dict]] = {}
+        for apartment in apartments:
+            by_city.setdefault(apartment['city'], []).append(apartment)
+
+        self._cities = {city: CityCatalog(city, items) for city, items in by_city.items()}
+        self._points = points
+        self._version = version
+        self.generation += 1
+        self._loaded_at = time.monotonic()
+        logger.info(f"Каталог квартир загружен в кеш: {len(apartments)} квартир, версия {version}")
+
+    async def ensure_fresh(self):
+        """Перезагружает кеш, если он устарел"""
+        if not self._is_fresh():
+            async with self._lock:
+                # Пока ждали блокировку, кеш мог обновить другой обработчик
+                if not self._is_fresh():
+                    await self.warm()
+
+    async def get_city(self, city: str) -> CityCatalog:
+        """Возвращает каталог города, при необходимости перезагружая кеш"""
+        await self.ensure_fresh()
+        return self._cities.get(city) or CityCatalog(city, [])
+
+    async def all_apartments(self) -> List[dict]:
+        """Все квартиры каталога, при необходимости перезагружая кеш"""
+        await self.ensure_fresh()
+        return [apartment for catalog in self._cities.values() for apartment in catalog.apartments]
+
+    async def all_points(self) -> List[dict]:
+        """Все места рядом с квартирами, при необходимости перезагружая кеш"""
+        await self.ensure_fresh()
+        return self._points
+
+    def invalidate(self):
+        """Помечает кеш устаревшим: следующий запрос перечитает каталог из БД"""
+        self._loaded_at = None
+
+    async def check_version(self) -> bool:
+        """Сравнивает версию каталога в БД с закешированной. Возвращает True, если кеш обновлен"""
+        async with get_async_session() as session:
+            version = await get_catalog_version(session)
+        if self._version is not None and version == self._version:
+            return False
+        logger.info(f"Версия каталога изменилась ({self._version} -> {version}), обновляем кеш")
+        async with self._lock:
+            await self.warm()
+        return True
+
+    async def watch_version(self):
+        """Периодически опрашивает версию каталога. Запускается фоновой задачей"""
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.check_version()
+            except Exception as e:
+                logger.error(f"Ошибка при проверке версии каталога: {str(e)}", exc_info=True)
+
+# Кеш общий для всех обработчиков процесса
+_catalog_cache: Optional[CatalogCache] = None
+
+def get_catalog_cache() -> CatalogCache:
+    """Возвращает общий для процесса кеш каталога, создавая его при первом вызове"""
+    global _catalog_cache
+    if _catalog_cache is None:
+        _catalog_cache = CatalogCache()
+    return _catalog_cache
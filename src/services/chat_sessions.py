@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import time
+from itertools import islice
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from config import (
+    GEMINI_HISTORY_TURNS, GEMINI_SESSION_TTL, GEMINI_SESSIONS_MAX_BYTES, GEMINI_SUMMARY_MAX_CHARS
+)
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Вопрос пользователя и ответ модели
+Turn = Tuple[str, str]
+# Свертка старых реплик: (прежнее краткое содержание, вытесняемые реплики) -> новое краткое содержание
+Summarizer = Callable[[str, List[Turn]], Awaitable[str]]
+
+
+def _text_size(text: str) -> int:
+    return len(text.encode('utf-8'))
+
+
+def format_turns(turns: List[Turn]) -> str:
+    return "\n".join(f"Пользователь: {question}\nПомощник: {answer}" for question, answer in turns)
+
+
+async def truncate_summary(summary: str, turns: List[Turn], max_chars: int = GEMINI_SUMMARY_MAX_CHARS) -> str:
+    """Свертка без обращения к модели: последние max_chars символов переписки"""
+    text = "\n".join(part for part in (summary, format_turns(turns)) if part)
+    return text[-max_chars:]
+
+
+class ChatHistory:
+    """Контекст разговора одного пользователя: краткое содержание старых реплик и последние реплики целиком"""
+
+    def __init__(self, now: float):
+        self.summary = ""
+        self.turns: Deque[Turn] = deque()
+        self.last_used = now
+        self.size = 0
+        # Свертки одного разговора идут по очереди, чтобы ни одна не потеряла краткое содержание другой
+        self.fold_lock = asyncio.Lock()
+
+    def _recount(self):
+        self.size = _text_size(self.summary) + sum(_text_size(q) + _text_size(a) for q, a in self.turns)
+
+    def contents(self, question: str) -> List[dict]:
+        """История в формате contents Gemini, завершенная новым вопросом"""
+        contents = []
+        if self.summary:
+            contents.append({'role': 'user', 'parts': [f"Краткое содержание предыдущего разговора:\n{self.summary}"]})
+            contents.append({'role': 'model', 'parts': ["Понял, учту."]})
+        for previous_question, answer in self.turns:
+            contents.append({'role': 'user', 'parts': [previous_question]})
+            contents.append({'role': 'model', 'parts': [answer]})
+        contents.append({'role': 'user', 'parts': [question]})
+        return contents
+
+
+class ChatSessionManager:
+    """
+    Разговоры с моделью по пользователям Telegram.
+
+    В каждом разговоре хранятся не больше max_turns последних реплик; более
+    старые сворачиваются summarizer-ом в краткое содержание ограниченной
+    длины, поэтому размер запроса к модели не растет с длиной переписки.
+    Разговоры, не использовавшиеся ttl секунд, удаляются; если общий размер
+    историй превышает max_bytes, удаляются давно не использовавшиеся.
+    """
+
+    def __init__(self, max_turns: int = GEMINI_HISTORY_TURNS, ttl: float = GEMINI_SESSION_TTL,
+                 max_bytes: int = GEMINI_SESSIONS_MAX_BYTES, summary_max_chars: int = GEMINI_SUMMARY_MAX_CHARS,
+                 summarizer: Optional[Summarizer] = None, clock: Callable[[], float] = time.monotonic):
+        self.max_turns = max_turns
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.summary_max_chars = summary_max_chars
+        self.summarizer = summarizer
+        self.clock = clock
+        # Порядок - от давно не использовавшихся к недавним
+        self._sessions: "OrderedDict[int, ChatHistory]" = OrderedDict()
+        self.total_bytes = 0
+        self.evicted = 0
+        self.summarized = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _evict_expired(self, now: float):
+        while self._sessions:
+            user_id, history = next(iter(self._sessions.items()))
+            if now - history.last_used < self.ttl:
+                break
+            self._remove(user_id)
+
+    def _evict_over_budget(self, keep: int):
+        while self.total_bytes > self.max_bytes and len(self._sessions) > 1:
+            user_id = next(iter(self._sessions))
+            if user_id == keep:
+                break
+            self._remove(user_id)
+
+    def _remove(self, user_id: int, evicted: bool = True):
+        history = self._sessions.pop(user_id)
+        self.total_bytes -= history.size
+        if evicted:
+            self.evicted += 1
+
+    def get(self, user_id: int) -> ChatHistory:
+        """Разговор пользователя; создается при первом обращении или после удаления"""
+        now = self.clock()
+        self._evict_expired(now)
+        history = self._sessions.get(user_id)
+        if history is None:
+            history = self._sessions[user_id] = ChatHistory(now)
+        else:
+            self._sessions.move_to_end(user_id)
+            history.last_used = now
+        return history
+
+    def drop(self, user_id: int):
+        """Забывает разговор пользователя"""
+        if user_id in self._sessions:
+            self._remove(user_id, evicted=False)
+
+    async def _summarize(self, summary: str, turns: List[Turn]) -> str:
+        if self.summarizer is not None:
+            try:
+                return (await self.summarizer(summary, turns))[-self.summary_max_chars:]
+            except Exception as e:
+                logger.warning(f"Не удалось свернуть историю разговора моделью: {str(e)}")
+        return await truncate_summary(summary, turns, self.summary_max_chars)
+
+    async def record(self, user_id: int, question: str, answer: str):
+        """Добавляет реплику в разговор и сворачивает вытесненные окном реплики"""
+        history = self.get(user_id)
+        history.turns.append((question, answer))
+        if len(history.turns) > self.max_turns:
+            async with history.fold_lock:
+                # Пока ждали, окно могла свернуть предыдущая запись
+                if len(history.turns) > self.max_turns:
+                    # Сворачиваем сразу половину окна, чтобы обращаться к модели за сверткой реже
+                    fold = max(len(history.turns) - self.max_turns, self.max_turns // 2)
+                    folded = list(islice(history.turns, fold))
+                    # Реплики остаются в разговоре, пока модель готовит свертку: одновременный
+                    # запрос видит либо их, либо краткое содержание, которое их заменило
+                    summary = await self._summarize(history.summary, folded)
+                    for _ in range(fold):
+                        history.turns.popleft()
+                    history.summary = summary
+                    self.summarized += 1
+        previous_size = history.size
+        history._recount()
+        # Разговор мог быть удален по бюджету, пока шла свертка
+        if self._sessions.get(user_id) is history:
+            self.total_bytes += history.size - previous_size
+            self._evict_over_budget(keep=user_id)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'sessions': len(self._sessions),
+            'bytes': self.total_bytes,
+            'evicted': self.evicted,
+            'summarized': self.summarized,
+        }
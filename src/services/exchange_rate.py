@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+import aiohttp
+from sqlalchemy import select
+
+from config import EXCHANGE_RATE_TTL, EXCHANGE_RATE_REFRESH_INTERVAL, EXCHANGE_RATE_URL
+from database.migrations import get_async_session
+from database.models import ExchangeRate
+from utils.http import get_http_session
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+TON_RUB = "TON/RUB"
+COINGECKO_SOURCE = "coingecko"
+
+
+class ExchangeRateUnavailable(Exception):
+    """Курс недоступен: провайдер не отвечает и сохраненного значения нет"""
+
+
+async def fetch_coingecko_rate() -> float:
+    """Получение текущей цены TON в рублях у CoinGecko"""
+    timeout = aiohttp.ClientTimeout(total=10)
+    async with get_http_session().get(EXCHANGE_RATE_URL, timeout=timeout) as response:
+        response.raise_for_status()
+        data = await response.json()
+    return float(data['the-open-network']['rub'])
+
+
+class ExchangeRateService:
+    """
+    Курс TON/RUB с кешированием.
+
+    - Значение живет ttl секунд и обновляется фоновой задачей заранее.
+    - Одновременные запросы при устаревшем курсе ждут одного обращения к провайдеру.
+    - Если провайдер недоступен, используется последний полученный курс.
+    - Каждый полученный курс сохраняется в таблицу exchange_rates.
+    """
+
+    def __init__(self, fetcher: Callable[[], Awaitable[float]] = fetch_coingecko_rate,
+                 source: str = COINGECKO_SOURCE, ttl: int = EXCHANGE_RATE_TTL,
+                 refresh_interval: int = EXCHANGE_RATE_REFRESH_INTERVAL):
+        self.fetcher = fetcher
+        self.source = source
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self._rate: Optional[float] = None
+        self._fetched_at: Optional[float] = None
+        self._inflight: Optional[asyncio.Task] = None
+
+    @property
+    def last_known_rate(self) -> Optional[float]:
+        return self._rate
+
+    def _is_fresh(self) -> bool:
+        return self._fetched_at is not None and time.monotonic() - self._fetched_at < self.ttl
+
+    async def _fetch_and_store(self) -> float:
+        rate = await self.fetcher()
+        if rate <= 0:
+            raise ValueError(f"Некорректный курс {rate}")
+        self._rate = rate
+        self._fetched_at = time.monotonic()
+        logger.info(f"Курс {TON_RUB} обновлен: {rate}")
+        try:
+            async with get_async_session() as session:
+                session.add(ExchangeRate(pair=TON_RUB, rate=rate, source=self.source))
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Не удалось сохранить курс {TON_RUB} в историю: {str(e)}", exc_info=True)
+        return rate
+
+    async def refresh(self) -> float:
+        """Обновляет курс. Параллельные вызовы разделяют одно обращение к провайдеру"""
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.ensure_future(self._fetch_and_store())
+        # shield: отмена одного ожидающего не отменяет запрос для остальных
+        return await asyncio.shield(self._inflight)
+
+    async def load_last_known(self) -> Optional[float]:
+        """Загружает последний сохраненный курс из истории (например, после перезапуска)"""
+        async with get_async_session() as session:
+            result = await session.execute(
+                select(ExchangeRate.rate)
+                .where(ExchangeRate.pair == TON_RUB)
+                .order_by(ExchangeRate.fetched_at.desc())
+                .limit(1)
+            )
+            rate = result.scalar()
+        if rate is not None and self._rate is None:
+            self._rate = rate
+        return rate
+
+    async def get_rate(self) -> float:
+        """Возвращает курс TON/RUB (сколько рублей стоит 1 TON)"""
+        if self._is_fresh():
+            return self._rate
+        try:
+            return await self.refresh()
+        except Exception as e:
+            if self._rate is None:
+                await self.load_last_known()
+            if self._rate is None:
+                raise ExchangeRateUnavailable(f"Не удалось получить курс {TON_RUB}: {str(e)}") from e
+            logger.warning(f"Не удалось обновить курс {TON_RUB} ({str(e)}), используется последний: {self._rate}")
+            return self._rate
+
+    async def rub_to_ton(self, amount_rub: float) -> float:
+        """Расчет суммы в TON на основе суммы в рублях"""
+        return amount_rub / await self.get_rate()
+
+    async def run_refresher(self):
+        """Фоновое обновление курса до истечения ttl. Запускается отдельной задачей"""
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Ошибка при обновлении курса {TON_RUB}: {str(e)}", exc_info=True)
+            await asyncio.sleep(self.refresh_interval)
+
+
+# Сервис общий для всего процесса
+_exchange_rate_service: Optional[ExchangeRateService] = None
+
+
+def get_exchange_rate_service() -> ExchangeRateService:
+    """Возвращает общий для процесса сервис курса, создавая его при первом вызове"""
+    global _exchange_rate_service
+    if _exchange_rate_service is None:
+        _exchange_rate_service = ExchangeRateService()
+    return _exchange_rate_service
@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+from config import (
+    FAQ_CACHE_SIZE, FAQ_CACHE_TTL, FAQ_CONFIDENCE, FAQ_SNIPPET_COVERAGE, FAQ_SNIPPETS,
+    MIN_NIGHTS_FOR_VACATION, SUBSCRIPTION_PRICE_RUB, THAILAND_CITIES
+)
+from services.catalog_cache import CatalogCache, get_catalog_cache
+from utils.bm25 import BM25Index, tokenize
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Частые вопросы: варианты формулировок и готовый ответ
+FAQ_ENTRIES: List[Tuple[List[str], str]] = [
+    (
+        ["Сколько стоит подписка?", "Сколько стоит?", "Какая цена подписки?", "Стоимость подписки в месяц"],
+        f"Подписка стоит {SUBSCRIPTION_PRICE_RUB:,} руб. в месяц.".replace(',', ' ')
+        + " За каждый оплаченный месяц на ваш счет поступает одна ночь отпуска."
+    ),
+    (
+        ["Сколько ночей нужно для поездки?", "Сколько нужно ночей?", "Минимальное количество ночей для бронирования",
+         "Когда можно забронировать квартиру?"],
+        f"Забронировать квартиру можно, когда накоплено минимум {MIN_NIGHTS_FOR_VACATION} ночей. "
+        f"Ночи начисляются по одной за каждый оплаченный месяц подписки."
+    ),
+    (
+        ["Как оплатить подписку?", "Как оплатить?", "Оплата в TON", "Какие способы оплаты?", "Можно ли оплатить картой?"],
+        "Подписка оплачивается в криптовалюте TON. Бот выставит счет с адресом кошелька и кодом, "
+        "который нужно указать в комментарии к переводу. После поступления платежа подписка активируется автоматически."
+    ),
+    (
+        ["В каких городах есть квартиры?", "Какие города доступны?", "Где находятся квартиры?"],
+        f"Квартиры есть в городах Таиланда: {', '.join(THAILAND_CITIES)}. "
+        f"На стоимость подписки город не влияет."
+    ),
+    (
+        ["Какие квартиры предлагаются?", "Что за квартиры?"],
+        "Односпальные квартиры бизнес-класса в Таиланде напрямую от собственников: "
+        "все в прекрасном состоянии и в хороших локациях."
+    ),
+    (
+        ["Есть ли реферальная программа?", "Что дают за приглашение друзей?", "Бесплатный месяц за друга"],
+        "Приглашайте друзей оформить подписку: за каждого нового участника вы получаете бесплатный месяц."
+    ),
+]
+
+# Длина фрагмента описания квартиры, добавляемого в запрос к модели
+SNIPPET_MAX_CHARS = 500
+
+
+def normalize_question(text: str) -> str:
+    """Ключ кеша ответов: основы значимых слов вопроса без регистра и знаков препинания"""
+    return " ".join(tokenize(text))
+
+
+def apartment_snippet(apartment: dict) -> str:
+    parts = [f"{apartment['city']}, {apartment['address']}."]
+    if apartment.get('description'):
+        parts.append(apartment['description'])
+    if apartment.get('features'):
+        parts.append(f"Удобства: {apartment['features']}.")
+    if apartment.get('nearby_attractions'):
+        parts.append(f"Рядом: {apartment['nearby_attractions']}.")
+    return " ".join(parts)[:SNIPPET_MAX_CHARS]
+
+
+class AnswerCache:
+    """Ответы модели по нормализованному вопросу; записи живут ttl секунд, лишние вытесняются по LRU"""
+
+    def __init__(self, max_size: int = FAQ_CACHE_SIZE, ttl: float = FAQ_CACHE_TTL,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._answers: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._answers)
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._answers.get(key)
+        if entry is None:
+            return None
+        answer, expires_at = entry
+        if self.clock() >= expires_at:
+            del self._answers[key]
+            return None
+        self._answers.move_to_end(key)
+        return answer
+
+    def put(self, key: str, answer: str):
+        self._answers[key] = (answer, self.clock() + self.ttl)
+        self._answers.move_to_end(key)
+        while len(self._answers) > self.max_size:
+            self._answers.popitem(last=False)
+
+
+class KnowledgeBase:
+    """
+    Ответы на частые вопросы без обращения к модели.
+
+    Индекс BM25 строится по формулировкам частых вопросов и описаниям квартир
+    из кеша каталога и перестраивается, когда каталог обновляется. Вопрос,
+    уверенно совпавший с частым вопросом, получает готовый ответ; для остальных
+    найденные фрагменты добавляются в запрос к модели, если они относятся к вопросу.
+    """
+
+    def __init__(self, catalog: Optional[CatalogCache] = None, cache: Optional[AnswerCache] = None,
+                 confidence: float = FAQ_CONFIDENCE, snippet_coverage: float = FAQ_SNIPPET_COVERAGE,
+                 max_snippets: int = FAQ_SNIPPETS):
+        self.catalog = catalog or get_catalog_cache()
+        self.cache = cache or AnswerCache()
+        self.confidence = confidence
+        self.snippet_coverage = snippet_coverage
+        self.max_snippets = max_snippets
+        self._index: Optional[BM25Index] = None
+        # Для каждого документа индекса: номер частого вопроса (или None) и текст фрагмента
+        self._documents: List[Tuple[Optional[int], str]] = []
+        self._generation: Optional[int] = None
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _build(apartments: List[dict]) -> Tuple[BM25Index, List[Tuple[Optional[int], str]]]:
+        documents: List[Tuple[Optional[int], str]] = []
+        texts = []
+        for faq_id, (questions, answer) in enumerate(FAQ_ENTRIES):
+            for question in questions:
+                documents.append((faq_id, answer))
+                texts.append(question)
+        for apartment in apartments:
+            snippet = apartment_snippet(apartment)
+            documents.append((None, snippet))
+            texts.append(snippet)
+        return BM25Index(texts), documents
+
+    async def refresh(self):
+        """Перестраивает индекс, если каталог квартир обновился"""
+        await self.catalog.ensure_fresh()
+        if self._index is not None and self._generation == self.catalog.generation:
+            return
+        async with self._lock:
+            apartments = await self.catalog.all_apartments()
+            generation = self.catalog.generation
+            if self._index is not None and self._generation == generation:
+                return
+            # Построение индекса по большому каталогу не должно задерживать другие обработчики
+            self._index, self._documents = await asyncio.to_thread(self._build, apartments)
+            self._generation = generation
+            logger.info(f"Индекс частых вопросов построен: {len(self._documents)} документов")
+
+    def faq_answer(self, question: str) -> Optional[str]:
+        """Готовый ответ, если вопрос уверенно совпадает с одной из формулировок частого вопроса"""
+        if self._index is None:
+            return None
+        for doc_id, score, coverage in self._index.search(question, limit=1):
+            faq_id, answer = self._documents[doc_id]
+            if faq_id is None or coverage < self.confidence:
+                return None
+            if score >= self.confidence * self._index.self_score(doc_id):
+                return answer
+        return None
+
+    def snippets(self, question: str) -> List[str]:
+        """Фрагменты частых вопросов и описаний квартир, относящиеся к вопросу"""
+        if self._index is None:
+            return []
+        found = []
+        for doc_id, _, coverage in self._index.search(question, limit=self.max_snippets * 4):
+            text = self._documents[doc_id][1]
+            if coverage >= self.snippet_coverage and text not in found:
+                found.append(text)
+                if len(found) == self.max_snippets:
+                    break
+        return found
+
+    async def answer(self, question: str, first_turn: bool) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Ответ без модели
+
+        Кешированные ответы модели выдаются только на первый вопрос разговора:
+        ответ на уточняющий вопрос зависит от предыдущих реплик.
+
+        Returns:
+            Ответ и его источник ('cache' или 'faq') либо (None, None)
+        """
+        if first_turn:
+            cached = self.cache.get(normalize_question(question))
+            if cached is not None:
+                return cached, 'cache'
+        try:
+            await self.refresh()
+        except Exception as e:
+            # Без свежего каталога остаются частые вопросы и прежний индекс
+            logger.error(f"Не удалось обновить индекс частых вопросов: {str(e)}")
+        answer = self.faq_answer(question)
+        if answer is not None:
+            return answer, 'faq'
+        return None, None
+
+    def remember(self, question: str, answer: str):
+        """Сохраняет ответ модели на первый вопрос разговора"""
+        key = normalize_question(question)
+        if key:
+            self.cache.put(key, answer)
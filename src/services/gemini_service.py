@@ -1,7 +1,18 @@
+import asyncio
+import logging
 import os
+import time
 from dotenv import load_dotenv
 import google.generativeai as genai
-from typing import Optional
+from typing import AsyncIterator, List, Optional
+
+from config import GEMINI_FIRST_CHUNK_TIMEOUT, GEMINI_MAX_CONCURRENT, GEMINI_RESPONSE_TIMEOUT
+from services.chat_sessions import ChatSessionManager, Turn, format_turns
+from services.faq import KnowledgeBase
+from utils.metrics import register_metrics
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -10,36 +21,188 @@ load_dotenv()
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 genai.configure(api_key=GEMINI_API_KEY)
 
+# Контекст о сервисе; добавляется только к текущему вопросу и не сохраняется в истории
+SERVICE_CONTEXT = """
+Вы - помощник сервиса OtpuskPass, который предоставляет услуги краткосрочной аренды квартир бизнес-класса в Таиланде по подписочной модели.
+Стоимость подписки: 3 000 руб. в месяц.
+Минимальное количество ночей для бронирования: 7.
+Оплата производится в криптовалюте TON.
+"""
+
+ERROR_REPLY = "Извините, произошла ошибка при обработке вашего запроса. Пожалуйста, попробуйте позже или обратитесь в поддержку."
+
+
+class GeminiUnavailable(Exception):
+    """Gemini не ответил: ошибка API, таймаут или все слоты заняты"""
+
+
 class GeminiService:
-    def __init__(self):
-        self.model = genai.GenerativeModel('gemini-pro')
-        self.chat = self.model.start_chat(history=[])
+    """
+    Ответы Gemini на вопросы пользователей.
 
-    async def get_response(self, user_input: str) -> Optional[str]:
-        """Получение ответа от Gemini на запрос пользователя"""
+    Запросы идут через асинхронный API SDK и не блокируют цикл событий.
+    Одновременно выполняется не больше max_concurrent запросов, остальные ждут
+    свободного слота. Ответ читается потоком: первый фрагмент должен прийти
+    за first_chunk_timeout секунд, весь ответ - за response_timeout.
+
+    Если передана база знаний, частые вопросы и повторы уже заданных
+    вопросов получают ответ без обращения к модели.
+    """
+
+    def __init__(self, model=None, sessions: Optional[ChatSessionManager] = None,
+                 max_concurrent: int = GEMINI_MAX_CONCURRENT,
+                 first_chunk_timeout: float = GEMINI_FIRST_CHUNK_TIMEOUT,
+                 response_timeout: float = GEMINI_RESPONSE_TIMEOUT,
+                 knowledge: Optional[KnowledgeBase] = None):
+        self.model = model or genai.GenerativeModel('gemini-pro')
+        # У каждого пользователя свой разговор; старые реплики сворачиваются моделью
+        self.sessions = sessions or ChatSessionManager(summarizer=self.summarize)
+        self.first_chunk_timeout = first_chunk_timeout
+        self.response_timeout = response_timeout
+        self.knowledge = knowledge
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self.in_flight = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.questions = 0
+        self.model_calls = 0
+        self.cache_hits = 0
+        self.faq_answers = 0
+        register_metrics('gemini_sessions', self.sessions.stats)
+        register_metrics('gemini_requests', self.stats)
+
+    async def _acquire_slot(self):
         try:
-            # Добавление контекста о сервисе
-            context = """
-            Вы - помощник сервиса OtpuskPass, который предоставляет услуги краткосрочной аренды квартир бизнес-класса в Таиланде по подписочной модели.
-            Стоимость подписки: 3 000 руб. в месяц.
-            Минимальное количество ночей для бронирования: 7.
-            Оплата производится в криптовалюте TON.
-            """
-            
-            full_prompt = f"{context}\n\nВопрос пользователя: {user_input}"
-            
-            response = await self.chat.send_message(full_prompt)
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.response_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise GeminiUnavailable("Все слоты запросов к Gemini заняты")
+        self.in_flight += 1
+
+    def _release_slot(self):
+        self.in_flight -= 1
+        self._slots.release()
+
+    async def summarize(self, summary: str, turns: List[Turn]) -> str:
+        """Краткое содержание разговора для контекста следующих вопросов"""
+        prompt = (
+            f"Кратко перескажи разговор пользователя с помощником, не длиннее "
+            f"{self.sessions.summary_max_chars} символов. Сохрани имена, даты, города и договоренности.\n\n"
+            f"{summary}\n{format_turns(turns)}"
+        )
+        await self._acquire_slot()
+        try:
+            response = await asyncio.wait_for(self.model.generate_content_async(prompt), timeout=self.response_timeout)
             return response.text
-            
+        finally:
+            self._release_slot()
+
+    async def stream_response(self, user_id: int, user_input: str) -> AsyncIterator[str]:
+        """
+        Фрагменты ответа Gemini по мере генерации
+
+        Реплика сохраняется в разговоре пользователя, только если ответ получен полностью.
+
+        Raises:
+            GeminiUnavailable: ошибка API или таймаут; уже выданные фрагменты остаются у вызывающего
+        """
+        history = self.sessions.get(user_id)
+        first_turn = not history.turns and not history.summary
+        self.questions += 1
+        snippets = []
+        if self.knowledge is not None:
+            answer, source = await self.knowledge.answer(user_input, first_turn)
+            if answer is not None:
+                if source == 'cache':
+                    self.cache_hits += 1
+                else:
+                    self.faq_answers += 1
+                yield answer
+                await self.sessions.record(user_id, user_input, answer)
+                return
+            snippets = self.knowledge.snippets(user_input)
+
+        full_prompt = SERVICE_CONTEXT
+        if snippets:
+            # Справочные фрагменты добавляются, только если они относятся к вопросу
+            full_prompt += "\n\nСправочная информация:\n" + "\n".join(f"- {snippet}" for snippet in snippets)
+        full_prompt += f"\n\nВопрос пользователя: {user_input}"
+        contents = history.contents(full_prompt)
+        parts = []
+        await self._acquire_slot()
+        self.model_calls += 1
+        try:
+            started = time.monotonic()
+            first_chunk_deadline = started + min(self.first_chunk_timeout, self.response_timeout)
+            deadline = started + self.response_timeout
+
+            def remaining() -> float:
+                # До первого фрагмента действует first_chunk_timeout, затем - общий срок ответа
+                return max((deadline if parts else first_chunk_deadline) - time.monotonic(), 0)
+
+            response = await asyncio.wait_for(self.model.generate_content_async(contents, stream=True), timeout=remaining())
+            chunks = response.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout=remaining())
+                except StopAsyncIteration:
+                    break
+                if chunk.text:
+                    parts.append(chunk.text)
+                    yield chunk.text
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise GeminiUnavailable("Gemini не ответил вовремя")
         except Exception as e:
-            print(f"Ошибка при получении ответа от Gemini: {str(e)}")
+            self.errors += 1
+            raise GeminiUnavailable(f"Ошибка Gemini: {str(e)}") from e
+        finally:
+            self._release_slot()
+        answer = "".join(parts)
+        if self.knowledge is not None and first_turn and answer:
+            self.knowledge.remember(user_input, answer)
+        await self.sessions.record(user_id, user_input, answer)
+
+    async def get_response(self, user_id: int, user_input: str) -> Optional[str]:
+        """Получение ответа от Gemini на запрос пользователя с учетом его разговора"""
+        try:
+            return "".join([chunk async for chunk in self.stream_response(user_id, user_input)])
+        except GeminiUnavailable as e:
+            logger.error(f"Ошибка при получении ответа от Gemini: {str(e)}")
             return None
 
-    async def process_user_query(self, user_input: str) -> str:
+    async def process_user_query(self, user_id: int, user_input: str) -> str:
         """Обработка запроса пользователя"""
-        response = await self.get_response(user_input)
-        
+        response = await self.get_response(user_id, user_input)
+
         if response:
             return response
         else:
-            return "Извините, произошла ошибка при обработке вашего запроса. Пожалуйста, попробуйте позже или обратитесь в поддержку." 
\ No newline at end of file
+            return ERROR_REPLY
+
+    def stats(self) -> dict:
+        saved = self.cache_hits + self.faq_answers
+        return {
+            'in_flight': self.in_flight,
+            'timeouts': self.timeouts,
+            'errors': self.errors,
+            'questions': self.questions,
+            'model_calls': self.model_calls,
+            'cache_hits': self.cache_hits,
+            'faq_answers': self.faq_answers,
+            'cache_hit_rate': round(self.cache_hits / self.questions, 3) if self.questions else 0.0,
+            # Доля вопросов, на которые ответили без обращения к модели
+            'model_calls_saved': saved,
+            'model_calls_saved_rate': round(saved / self.questions, 3) if self.questions else 0.0,
+        }
+
+
+_gemini_service: Optional[GeminiService] = None
+
+
+def get_gemini_service() -> GeminiService:
+    """Общий для процесса сервис Gemini"""
+    global _gemini_service
+    if _gemini_service is None:
+        _gemini_service = GeminiService(knowledge=KnowledgeBase())
+    return _gemini_service
@@ -0,0 +1,280 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from enum import IntEnum
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from telegram import Bot, Message
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+from telegram.request import HTTPXRequest
+
+from config import (
+    BOT_TOKEN, OUTBOUND_GLOBAL_RATE, OUTBOUND_PER_CHAT_INTERVAL,
+    OUTBOUND_MAX_IN_FLIGHT, OUTBOUND_MAX_RETRIES
+)
+from utils.metrics import register_metrics
+from utils.rate_limit import TokenBucket
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Очереди сообщений: меньшее значение отправляется раньше"""
+    TRANSACTIONAL = 0  # ответы на действия пользователя, подтверждения оплаты
+    NOTIFICATION = 1   # персональные уведомления: ночи, напоминания, окончание подписки
+    BROADCAST = 2      # массовые рассылки
+
+
+class OutboundMessage:
+    """Сообщение в очереди на отправку"""
+
+    def __init__(self, chat_id: int, text: str, priority: Priority, kwargs: Dict[str, Any]):
+        self.chat_id = chat_id
+        self.text = text
+        self.priority = priority
+        self.kwargs = kwargs
+        self.attempts = 0
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class OutboundMessageQueue:
+    """
+    Очередь исходящих сообщений с соблюдением лимитов Telegram.
+
+    - Общий token bucket ограничивает число сообщений в секунду на бота.
+    - В один чат отправляется не чаще одного сообщения в per_chat_interval секунд;
+      сообщения одного чата уходят в порядке постановки.
+    - Транзакционные сообщения обгоняют уведомления и рассылки.
+    - При 429 (RetryAfter) отправка приостанавливается на указанное Telegram время,
+      а сообщение возвращается в начало своей очереди.
+    - Запросы идут через общий пул соединений бота.
+    """
+
+    # Сколько сообщений просматривается в поиске чата, в который уже можно писать
+    SCAN_LIMIT = 256
+
+    def __init__(self, bot: Optional[Bot] = None, global_rate: float = OUTBOUND_GLOBAL_RATE,
+                 per_chat_interval: float = OUTBOUND_PER_CHAT_INTERVAL,
+                 max_in_flight: int = OUTBOUND_MAX_IN_FLIGHT, max_retries: int = OUTBOUND_MAX_RETRIES,
+                 retry_backoff: float = 1.0):
+        self.bot = bot or Bot(token=BOT_TOKEN, request=HTTPXRequest(connection_pool_size=max_in_flight))
+        self.global_bucket = TokenBucket(rate=global_rate, capacity=1)
+        self.per_chat_interval = per_chat_interval
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._lanes: Dict[Priority, Deque[OutboundMessage]] = {priority: deque() for priority in Priority}
+        self._chat_ready_at: Dict[int, float] = {}
+        self._paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._in_flight = 0
+        self._runner: Optional[asyncio.Task] = None
+        self._sent_at: Deque[float] = deque()
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.flood_waits = 0
+
+    @property
+    def backlog(self) -> int:
+        return sum(len(lane) for lane in self._lanes.values())
+
+    @property
+    def running(self) -> bool:
+        return self._runner is not None and not self._runner.done()
+
+    def enqueue(self, chat_id: int, text: str, priority: Priority = Priority.TRANSACTIONAL,
+                **kwargs) -> asyncio.Future:
+        """
+        Ставит сообщение в очередь и сразу возвращает управление.
+
+        Returns:
+            Future с отправленным Message или с исключением, если отправить не удалось
+        """
+        message = OutboundMessage(chat_id, text, priority, kwargs)
+        self._lanes[priority].append(message)
+        self._idle.clear()
+        self._wakeup.set()
+        return message.future
+
+    async def send(self, chat_id: int, text: str, priority: Priority = Priority.TRANSACTIONAL,
+                   **kwargs) -> Message:
+        """Ставит сообщение в очередь и ждет его отправки"""
+        return await self.enqueue(chat_id, text, priority, **kwargs)
+
+    def _requeue(self, message: OutboundMessage, delay: float = 0.0):
+        """Возвращает сообщение в начало очереди; чат не используется delay секунд"""
+        if delay:
+            self._chat_ready_at[message.chat_id] = time.monotonic() + delay
+        self._lanes[message.priority].appendleft(message)
+        self._wakeup.set()
+
+    def _pop_ready(self, now: float) -> Tuple[Optional[OutboundMessage], Optional[float]]:
+        """
+        Достает первое сообщение, чат которого готов принять следующее.
+
+        Returns:
+            Сообщение или None и сколько секунд ждать до готовности ближайшего чата
+            (None, если очередь пуста)
+        """
+        wait = None
+        for priority in Priority:
+            lane = self._lanes[priority]
+            for index, message in enumerate(lane):
+                if index >= self.SCAN_LIMIT:
+                    break
+                ready_at = self._chat_ready_at.get(message.chat_id, 0.0)
+                if ready_at <= now:
+                    del lane[index]
+                    self._chat_ready_at[message.chat_id] = now + self.per_chat_interval
+                    return message, None
+                wait = ready_at - now if wait is None else min(wait, ready_at - now)
+        return None, wait
+
+    def _prune_chats(self, now: float):
+        """Забывает чаты, в которые уже снова можно писать"""
+        if len(self._chat_ready_at) > 10000:
+            self._chat_ready_at = {chat_id: ready_at for chat_id, ready_at in self._chat_ready_at.items()
+                                   if ready_at > now}
+
+    async def _next_message(self) -> OutboundMessage:
+        while True:
+            now = time.monotonic()
+            if self._paused_until > now:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._wakeup.clear()
+            message, wait = self._pop_ready(now)
+            if message is not None:
+                self._prune_chats(now)
+                return message
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, message: OutboundMessage):
+        message.attempts += 1
+        try:
+            result = await self.bot.send_message(chat_id=message.chat_id, text=message.text, **message.kwargs)
+        except RetryAfter as e:
+            # Ограничение действует на весь бот: приостанавливаем всю отправку
+            self.flood_waits += 1
+            retry_after = float(e.retry_after)
+            logger.warning(f"Telegram просит подождать {retry_after} с перед следующей отправкой")
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            message.attempts -= 1
+            self._requeue(message)
+        except (Forbidden, BadRequest) as e:
+            # Пользователь заблокировал бота или запрос некорректен - повтор не поможет
+            self._fail(message, e)
+        except NetworkError as e:
+            if message.attempts > self.max_retries:
+                self._fail(message, e)
+            else:
+                self.retried += 1
+                self._requeue(message, delay=random.uniform(0, self.retry_backoff * 2 ** message.attempts))
+        except Exception as e:
+            self._fail(message, e)
+        else:
+            self.sent += 1
+            self._sent_at.append(time.monotonic())
+            if not message.future.done():
+                message.future.set_result(result)
+
+    def _fail(self, message: OutboundMessage, error: Exception):
+        self.failed += 1
+        logger.error(f"Не удалось отправить сообщение в чат {message.chat_id}: {str(error)}")
+        if not message.future.done():
+            message.future.set_exception(error)
+            # Исключение считается полученным, даже если отправитель не ждет результат
+            message.future.exception()
+
+    async def _deliver_and_release(self, message: OutboundMessage, slots: asyncio.Semaphore):
+        try:
+            await self._deliver(message)
+        finally:
+            self._in_flight -= 1
+            slots.release()
+            if not self._in_flight and not self.backlog:
+                self._idle.set()
+
+    async def run(self):
+        """Цикл отправки. Запускается отдельной задачей в процессе бота"""
+        await self.bot.initialize()
+        slots = asyncio.Semaphore(self.max_in_flight)
+        tasks = set()
+        while True:
+            await slots.acquire()
+            try:
+                message = await self._next_message()
+                await self.global_bucket.acquire()
+            except BaseException:
+                slots.release()
+                raise
+            self._in_flight += 1
+            task = asyncio.create_task(self._deliver_and_release(message, slots))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    def start(self) -> asyncio.Task:
+        if not self.running:
+            self._runner = asyncio.create_task(self.run())
+        return self._runner
+
+    async def join(self, timeout: Optional[float] = None) -> bool:
+        """Ждет, пока очередь опустеет. Возвращает False, если не успела за timeout"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def stats(self) -> dict:
+        """Текущие метрики очереди"""
+        now = time.monotonic()
+        while self._sent_at and self._sent_at[0] < now - 60:
+            self._sent_at.popleft()
+        return {
+            'backlog': {priority.name.lower(): len(lane) for priority, lane in self._lanes.items()},
+            'in_flight': self._in_flight,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'flood_waits': self.flood_waits,
+            'sent_per_second': round(len(self._sent_at) / 60, 2),
+            'paused_for': round(max(0.0, self._paused_until - now), 2),
+        }
+
+
+# Очередь общая для всего процесса
+_message_queue: Optional[OutboundMessageQueue] = None
+
+
+def get_message_queue(bot: Optional[Bot] = None) -> OutboundMessageQueue:
+    """Возвращает общую для процесса очередь исходящих сообщений, создавая ее при первом вызове
+
+    Args:
+        bot: Бот, через который отправляются сообщения (в процессе бота - application.bot,
+            чтобы использовать его пул соединений). Учитывается только при первом вызове
+    """
+    global _message_queue
+    if _message_queue is None:
+        _message_queue = OutboundMessageQueue(bot=bot)
+        register_metrics('outbound_messages', _message_queue.stats)
+    return _message_queue
+
+
+async def drain_message_queue(timeout: float = 10) -> bool:
+    """Ждет отправки оставшихся сообщений перед остановкой процесса"""
+    if _message_queue is None or not _message_queue.running:
+        return True
+    if await _message_queue.join(timeout):
+        return True
+    logger.warning(f"Очередь исходящих сообщений не опустела за {timeout} с: {_message_queue.stats()}")
+    return False
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from config import GEO_CELL_KM, GEO_NEARBY_RADIUS_KM, GEO_OFFER_ATTRACTIONS
+from services.catalog_cache import CatalogCache, get_catalog_cache
+from utils.geo import GeoGrid, format_distance
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+def _has_coordinates(item: dict) -> bool:
+    return item.get('latitude') is not None and item.get('longitude') is not None
+
+
+class NearbySearch:
+    """
+    Поиск квартир и мест рядом друг с другом.
+
+    Квартиры с координатами и места из кеша каталога раскладываются по сеткам
+    GeoGrid; сетки перестраиваются, когда каталог обновляется. Запросы
+    выполняются в памяти и не обращаются к БД.
+    """
+
+    def __init__(self, catalog: Optional[CatalogCache] = None, cell_km: float = GEO_CELL_KM):
+        self.catalog = catalog or get_catalog_cache()
+        self.cell_km = cell_km
+        self._apartments: Dict[int, dict] = {}
+        self._points: Dict[int, dict] = {}
+        self._apartment_grid = GeoGrid(cell_km)
+        self._point_grid = GeoGrid(cell_km)
+        self._generation: Optional[int] = None
+        self._lock = asyncio.Lock()
+
+    def _build(self, apartments: List[dict], points: List[dict]):
+        apartment_grid, point_grid = GeoGrid(self.cell_km), GeoGrid(self.cell_km)
+        by_id = {}
+        for apartment in filter(_has_coordinates, apartments):
+            apartment_grid.add(apartment['id'], apartment['latitude'], apartment['longitude'])
+            by_id[apartment['id']] = apartment
+        for point in points:
+            point_grid.add(point['id'], point['latitude'], point['longitude'])
+        return by_id, {point['id']: point for point in points}, apartment_grid, point_grid
+
+    async def refresh(self):
+        """Перестраивает сетки, если каталог обновился"""
+        await self.catalog.ensure_fresh()
+        if self._generation == self.catalog.generation:
+            return
+        async with self._lock:
+            apartments = await self.catalog.all_apartments()
+            points = await self.catalog.all_points()
+            generation = self.catalog.generation
+            if self._generation == generation:
+                return
+            # Раскладка большого каталога не должна задерживать другие обработчики
+            built = await asyncio.to_thread(self._build, apartments, points)
+            self._apartments, self._points, self._apartment_grid, self._point_grid = built
+            self._generation = generation
+            logger.info(f"Геоиндекс построен: {len(self._apartments)} квартир, {len(self._points)} мест")
+
+    async def apartments_near(self, lat: float, lon: float, radius_km: Optional[float] = None,
+                              limit: int = 20) -> List[Tuple[dict, float]]:
+        """
+        Квартиры рядом с точкой и расстояния до них в км, от ближней к дальней
+
+        С радиусом - не дальше radius_km (первые limit), без радиуса - limit ближайших.
+        """
+        await self.refresh()
+        if radius_km is not None:
+            found = self._apartment_grid.within(lat, lon, radius_km, limit)
+        else:
+            found = self._apartment_grid.nearest(lat, lon, limit)
+        return [(self._apartments[apartment_id], distance) for apartment_id, distance in found]
+
+    async def get_point(self, point_id: int) -> Optional[dict]:
+        await self.refresh()
+        return self._points.get(point_id)
+
+    async def points_near(self, apartment: dict, limit: int = GEO_OFFER_ATTRACTIONS,
+                          radius_km: float = GEO_NEARBY_RADIUS_KM) -> List[Tuple[dict, float]]:
+        """Ближайшие к квартире места не дальше radius_km; пусто, если у квартиры нет координат"""
+        if not _has_coordinates(apartment):
+            return []
+        await self.refresh()
+        found = self._point_grid.nearest(apartment['latitude'], apartment['longitude'], limit, radius_km)
+        return [(self._points[point_id], distance) for point_id, distance in found]
+
+
+def format_nearby_points(points: List[Tuple[dict, float]]) -> str:
+    """Список мест рядом с квартирой для сообщения бота"""
+    return "\n".join(f"📍 {point['name']} - {format_distance(distance)}" for point, distance in points)
+
+
+_nearby_search: Optional[NearbySearch] = None
+
+
+def get_nearby_search() -> NearbySearch:
+    """Общий для процесса геоиндекс каталога"""
+    global _nearby_search
+    if _nearby_search is None:
+        _nearby_search = NearbySearch()
+    return _nearby_search
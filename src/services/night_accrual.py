@@ -0,0 +1,189 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from config import (
+    ACCRUAL_CHECK_INTERVAL, ACCRUAL_CHUNK_SIZE, ACCRUAL_NIGHTS_PER_PERIOD, MIN_NIGHTS_FOR_VACATION
+)
+from database.migrations import get_async_session
+from database.models import NightAccrualRun, Subscription, SubscriptionStatus, User
+from services.notifications import NotificationService
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Этапы начисления за период
+ACCRUING = "accruing"
+NOTIFYING = "notifying"
+COMPLETED = "completed"
+
+
+def billing_period(now: datetime) -> Tuple[str, datetime]:
+    """
+    Последний завершившийся расчетный период на момент now.
+
+    Returns:
+        Метка прошедшего месяца (YYYY-MM) и начало текущего месяца: ночи за период
+        начисляются подпискам, оформленным до этого момента
+    """
+    cutoff = datetime(now.year, now.month, 1)
+    year, month = (now.year, now.month - 1) if now.month > 1 else (now.year - 1, 12)
+    return f"{year:04d}-{month:02d}", cutoff
+
+
+class NightAccrualEngine:
+    """
+    Ежемесячное начисление ночей активным подпискам, оплаченным за период.
+
+    Ночи начисляются не по одной подписке, а запросами UPDATE ... WHERE на
+    диапазоны id подписок (по chunk_size), каждый диапазон - отдельной короткой
+    транзакцией вместе со сдвигом курсора в журнале периода (NightAccrualRun).
+    После начисления уведомления ставятся в очередь исходящих сообщений
+    страницами того же размера.
+    """
+
+    def __init__(self, notifications: Optional[NotificationService] = None, chunk_size: int = ACCRUAL_CHUNK_SIZE,
+                 nights: int = ACCRUAL_NIGHTS_PER_PERIOD, check_interval: int = ACCRUAL_CHECK_INTERVAL):
+        self.notifications = notifications or NotificationService()
+        self.chunk_size = chunk_size
+        self.nights = nights
+        self.check_interval = check_interval
+
+    @staticmethod
+    def _eligible(run: NightAccrualRun) -> list:
+        """Активные подписки, оформленные до конца периода и оплаченные хотя бы до его конца"""
+        return [
+            Subscription.status == SubscriptionStatus.ACTIVE,
+            Subscription.start_date < run.cutoff,
+            # Неоплаченные и просроченные подписки ночь за период не получают
+            Subscription.next_payment_due >= run.cutoff
+        ]
+
+    async def _start_run(self, period: str, cutoff: datetime) -> NightAccrualRun:
+        """Запись журнала за период: существующая или новая"""
+        async with get_async_session() as session:
+            run = await session.scalar(select(NightAccrualRun).where(NightAccrualRun.period == period))
+            if run is not None:
+                return run
+            # Подписки, оформленные после начала начисления, в этот период не попадают
+            max_id = await session.scalar(select(func.max(Subscription.id)))
+            run = NightAccrualRun(period=period, cutoff=cutoff, nights=self.nights, status=ACCRUING,
+                                  max_subscription_id=max_id or 0)
+            session.add(run)
+            try:
+                await session.commit()
+            except IntegrityError:
+                # Период одновременно начал другой процесс
+                await session.rollback()
+                run = await session.scalar(select(NightAccrualRun).where(NightAccrualRun.period == period))
+            return run
+
+    async def _accrue(self, run: NightAccrualRun):
+        """Начисляет ночи диапазонами id от курсора журнала до max_subscription_id"""
+        while run.last_subscription_id < run.max_subscription_id:
+            lower = run.last_subscription_id
+            upper = min(lower + self.chunk_size, run.max_subscription_id)
+            async with get_async_session() as session:
+                # Курсор сдвигается только с ожидаемого значения: если диапазон уже
+                # начислил другой процесс, транзакция ничего не меняет
+                claimed = await session.execute(
+                    update(NightAccrualRun)
+                    .where(NightAccrualRun.id == run.id, NightAccrualRun.last_subscription_id == lower)
+                    .values(last_subscription_id=upper)
+                )
+                if claimed.rowcount != 1:
+                    await session.rollback()
+                    stored = await session.get(NightAccrualRun, run.id)
+                    run.last_subscription_id, run.credited_count = stored.last_subscription_id, stored.credited_count
+                    continue
+                result = await session.execute(
+                    update(Subscription)
+                    .where(Subscription.id > lower, Subscription.id <= upper, *self._eligible(run))
+                    .values(accumulated_nights=func.coalesce(Subscription.accumulated_nights, 0) + run.nights)
+                    .execution_options(synchronize_session=False)
+                )
+                await session.execute(
+                    update(NightAccrualRun)
+                    .where(NightAccrualRun.id == run.id)
+                    .values(credited_count=NightAccrualRun.credited_count + result.rowcount)
+                )
+                await session.commit()
+            run.last_subscription_id = upper
+            run.credited_count += result.rowcount
+
+    async def _notify(self, run: NightAccrualRun):
+        """Ставит уведомления в очередь страницами, сдвигая курсор после отправки каждой"""
+        while True:
+            async with get_async_session() as session:
+                result = await session.execute(
+                    select(Subscription, User)
+                    .join(User, Subscription.user_id == User.id)
+                    .where(
+                        Subscription.id > run.notified_subscription_id,
+                        Subscription.id <= run.max_subscription_id,
+                        *self._eligible(run)
+                    )
+                    .order_by(Subscription.id)
+                    .limit(self.chunk_size)
+                )
+                page = result.all()
+            if not page:
+                return
+            futures = []
+            for subscription, user in page:
+                nights = subscription.accumulated_nights or 0
+                if nights >= MIN_NIGHTS_FOR_VACATION > nights - run.nights:
+                    futures.append(await self.notifications.send_vacation_ready(user, subscription))
+                else:
+                    futures.append(await self.notifications.send_night_accumulated(user, subscription))
+            # Следующая страница ставится в очередь после отправки предыдущей
+            await asyncio.gather(*futures, return_exceptions=True)
+            run.notified_subscription_id = page[-1][0].id
+            run.notified_count += len(page)
+            async with get_async_session() as session:
+                await session.execute(
+                    update(NightAccrualRun)
+                    .where(NightAccrualRun.id == run.id)
+                    .values(notified_subscription_id=run.notified_subscription_id, notified_count=run.notified_count)
+                )
+                await session.commit()
+
+    async def _set_status(self, run: NightAccrualRun, status: str):
+        values = {'status': status}
+        if status == COMPLETED:
+            values['finished_at'] = datetime.utcnow()
+        async with get_async_session() as session:
+            await session.execute(update(NightAccrualRun).where(NightAccrualRun.id == run.id).values(**values))
+            await session.commit()
+        run.status = status
+
+    async def run_period(self, period: str, cutoff: datetime) -> NightAccrualRun:
+        """Начисляет ночи за период и рассылает уведомления. Повторный вызов безопасен"""
+        run = await self._start_run(period, cutoff)
+        if run.status == ACCRUING:
+            await self._accrue(run)
+            await self._set_status(run, NOTIFYING)
+            logger.info(f"Ночи за {period} начислены: {run.credited_count} подписок")
+        if run.status == NOTIFYING:
+            await self._notify(run)
+            await self._set_status(run, COMPLETED)
+            logger.info(f"Уведомления о начислении за {period} отправлены: {run.notified_count}")
+        return run
+
+    async def run_due(self, now: Optional[datetime] = None) -> NightAccrualRun:
+        """Начисление за последний завершившийся месяц, если оно еще не выполнено"""
+        period, cutoff = billing_period(now or datetime.utcnow())
+        return await self.run_period(period, cutoff)
+
+    async def start(self):
+        """Фоновая задача процесса бота: проверяет, не начался ли новый период"""
+        while True:
+            try:
+                await self.run_due()
+            except Exception as e:
+                logger.error(f"Ошибка при начислении ночей: {str(e)}", exc_info=True)
+            await asyncio.sleep(self.check_interval)
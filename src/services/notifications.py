@@ -1,13 +1,22 @@
-from telegram import Bot
-from config import BOT_TOKEN
+import asyncio
+from config import MIN_NIGHTS_FOR_VACATION
 from database.models import User, Subscription, PaymentStatus
+from services.message_queue import OutboundMessageQueue, Priority, get_message_queue
 from typing import Optional
 
 class NotificationService:
-    def __init__(self):
-        self.bot = Bot(token=BOT_TOKEN)
+    """
+    Уведомления пользователям.
 
-    async def send_payment_success(self, user: User, subscription_id: int):
+    Сообщения не отправляются сразу, а ставятся в общую очередь исходящих
+    сообщений, которая соблюдает лимиты Telegram. Методы возвращаются сразу
+    после постановки в очередь и отдают Future с результатом отправки.
+    """
+
+    def __init__(self, queue: Optional[OutboundMessageQueue] = None):
+        self.queue = queue or get_message_queue()
+
+    async def send_payment_success(self, user: User, subscription_id: int) -> asyncio.Future:
         """
         Отправляет уведомление об успешной оплате
         """
@@ -17,9 +26,9 @@ class NotificationService:
             f"Подписка активирована.\n\n"
             f"Теперь вы можете накапливать ночи для вашего отпуска."
         )
-        await self.bot.send_message(chat_id=user.telegram_id, text=message)
+        return self.queue.enqueue(user.telegram_id, message, Priority.TRANSACTIONAL)
 
-    async def send_payment_reminder(self, user: User, subscription_id: int):
+    async def send_payment_reminder(self, user: User, subscription_id: int) -> asyncio.Future:
         """
         Отправляет напоминание об оплате
         """
@@ -29,33 +38,33 @@ class NotificationService:
             f"Сумма: 3 000 руб.\n\n"
             f"Нажмите /subscribe для оформления подписки."
         )
-        await self.bot.send_message(chat_id=user.telegram_id, text=message)
+        return self.queue.enqueue(user.telegram_id, message, Priority.NOTIFICATION)
 
-    async def send_night_accumulated(self, user: User, subscription: Subscription):
+    async def send_night_accumulated(self, user: User, subscription: Subscription) -> asyncio.Future:
         """
         Отправляет уведомление о накоплении ночи
         """
         message = (
             f"✨ {user.first_name}, поздравляем!\n\n"
             f"Вы накопили {subscription.accumulated_nights} ночей.\n"
-            f"До минимального количества осталось: {7 - subscription.accumulated_nights} ночей.\n\n"
+            f"До минимального количества осталось: {max(MIN_NIGHTS_FOR_VACATION - subscription.accumulated_nights, 0)} ночей.\n\n"
             f"Продолжайте накапливать ночи для вашего отпуска!"
         )
-        await self.bot.send_message(chat_id=user.telegram_id, text=message)
+        return self.queue.enqueue(user.telegram_id, message, Priority.NOTIFICATION)
 
-    async def send_subscription_expiring(self, user: User, subscription: Subscription):
+    async def send_subscription_expiring(self, user: User, subscription: Subscription) -> asyncio.Future:
         """
         Отправляет уведомление об истечении подписки
         """
         message = (
             f"⚠️ {user.first_name}, внимание!\n\n"
-            f"Ваша подписка истекает через 3 дня.\n"
+            f"Ваша подписка истекает {subscription.next_payment_due:%d.%m.%Y}.\n"
             f"Для продления нажмите /subscribe\n\n"
             f"Не теряйте накопленные ночи!"
         )
-        await self.bot.send_message(chat_id=user.telegram_id, text=message)
+        return self.queue.enqueue(user.telegram_id, message, Priority.NOTIFICATION)
 
-    async def send_vacation_ready(self, user: User, subscription: Subscription):
+    async def send_vacation_ready(self, user: User, subscription: Subscription) -> asyncio.Future:
         """
         Отправляет уведомление о готовности к отпуску
         """
@@ -65,4 +74,4 @@ class NotificationService:
             f"Всего накоплено: {subscription.accumulated_nights} ночей\n\n"
             f"Нажмите /book для выбора дат и бронирования квартиры."
         )
-        await self.bot.send_message(chat_id=user.telegram_id, text=message) 
\ No newline at end of file
+        return self.queue.enqueue(user.telegram_id, message, Priority.NOTIFICATION) 
\ No newline at end of file
@@ -0,0 +1,243 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import TON_WALLET_ADDRESS
+from database.migrations import get_async_session
+from database.models import Payment, PaymentStatus, Subscription, SubscriptionStatus, User, WalletCursor
+from services.notifications import NotificationService
+from ton.async_client import AsyncTONClient
+from utils.helpers import extend_next_payment_date, parse_payment_memo
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+class IncomingTransfer:
+    """Входящий перевод на кошелек сервиса, разобранный из ответа toncenter"""
+
+    def __init__(self, lt: int, tx_hash: str, utime: int, source: str, value: int, comment: str):
+        self.lt = lt
+        self.hash = tx_hash
+        self.utime = utime
+        self.source = source
+        self.value = value
+        self.comment = comment
+        self.memo = parse_payment_memo(comment)
+
+    @property
+    def received_at(self) -> datetime:
+        return datetime.utcfromtimestamp(self.utime)
+
+    @classmethod
+    def from_toncenter(cls, tx: dict) -> Optional['IncomingTransfer']:
+        """Возвращает перевод или None для исходящих и пустых транзакций"""
+        in_msg = tx.get('in_msg') or {}
+        value = int(in_msg.get('value') or 0)
+        if not in_msg.get('source') or value <= 0:
+            return None
+        return cls(
+            lt=int(tx['transaction_id']['lt']),
+            tx_hash=tx['transaction_id']['hash'],
+            utime=int(tx.get('utime') or 0),
+            source=in_msg['source'],
+            value=value,
+            comment=in_msg.get('message') or ''
+        )
+
+class PaymentReconciler:
+    """
+    Сверка ожидающих платежей с входящими транзакциями кошелька.
+
+    За один цикл постранично читает новые транзакции кошелька один раз,
+    начиная с сохраненного курсора (lt/hash), сопоставляет их в памяти
+    со счетами по коду из комментария и подтверждает все совпадения одной транзакцией БД.
+    Подтверждение идемпотентно: счет, который уже подтвердила параллельная сверка,
+    пропускается и не продлевает подписку второй раз.
+    Счета - ожидающие платежи, которые записывает SubscriptionService.create_subscription;
+    после подтверждения пользователь получает уведомление через очередь исходящих сообщений.
+    """
+
+    def __init__(self, wallet_address: str = TON_WALLET_ADDRESS, ton_client: Optional[AsyncTONClient] = None,
+                 page_size: int = 100, payment_window: timedelta = timedelta(hours=24),
+                 notifications: Optional[NotificationService] = None):
+        self.wallet_address = wallet_address
+        self.ton_client = ton_client or AsyncTONClient()
+        self.notifications = notifications or NotificationService()
+        self.page_size = page_size
+        self.payment_window = payment_window
+
+    async def _get_transactions(self, lt: Optional[int] = None, tx_hash: Optional[str] = None) -> List[dict]:
+        """Одна страница транзакций кошелька, от новых к старым"""
+        return await self.ton_client.get_transactions(self.wallet_address, limit=self.page_size, lt=lt, tx_hash=tx_hash)
+
+    async def fetch_new_transfers(self, since_lt: int, since_hash: Optional[str],
+                                  not_before: datetime) -> tuple[List[IncomingTransfer], Optional[dict]]:
+        """
+        Читает транзакции новее курсора.
+
+        Returns:
+            Входящие переводы и transaction_id самой новой транзакции (новый курсор)
+        """
+        transfers: List[IncomingTransfer] = []
+        newest = None
+        lt, tx_hash = None, None
+        while True:
+            page = await self._get_transactions(lt, tx_hash)
+            is_last_page = len(page) < self.page_size
+            # Страница, запрошенная по lt/hash, начинается с уже прочитанной транзакции
+            if lt is not None and page and int(page[0]['transaction_id']['lt']) == lt:
+                page = page[1:]
+            if not page:
+                break
+            if newest is None:
+                newest = page[0]['transaction_id']
+            reached_cursor = False
+            for tx in page:
+                tx_lt = int(tx['transaction_id']['lt'])
+                if tx_lt < since_lt or (tx_lt == since_lt and tx['transaction_id']['hash'] == since_hash):
+                    reached_cursor = True
+                    break
+                if datetime.utcfromtimestamp(int(tx.get('utime') or 0)) < not_before:
+                    # Транзакции старше окна оплаты не могут закрыть ни один счет
+                    reached_cursor = True
+                    break
+                transfer = IncomingTransfer.from_toncenter(tx)
+                if transfer:
+                    transfers.append(transfer)
+            if reached_cursor or is_last_page:
+                break
+            last_id = page[-1]['transaction_id']
+            lt, tx_hash = int(last_id['lt']), last_id['hash']
+        return transfers, newest
+
+    @staticmethod
+    def match(payments: List[Payment], transfers: List[IncomingTransfer]) -> List[tuple[Payment, IncomingTransfer]]:
+        """Сопоставляет переводы с ожидающими счетами по коду счета и точной сумме в нанотонах"""
+        by_memo = {payment.memo: payment for payment in payments}
+        matches = []
+        # Переводы обрабатываются от старых к новым: счет закрывает первый подходящий перевод
+        for transfer in sorted(transfers, key=lambda t: t.lt):
+            payment = by_memo.get(transfer.memo)
+            if payment is None or payment.created_at > transfer.received_at:
+                continue
+            if transfer.value < payment.amount_nanoton:
+                logger.warning(
+                    f"Перевод {transfer.hash} по счету {transfer.memo} меньше суммы счета: "
+                    f"{transfer.value} < {payment.amount_nanoton} нанотонов"
+                )
+                continue
+            del by_memo[transfer.memo]
+            matches.append((payment, transfer))
+        return matches
+
+    @staticmethod
+    async def _complete_payments(session: AsyncSession,
+                                 matches: List[tuple[Payment, IncomingTransfer]]) -> List[tuple[Payment, IncomingTransfer]]:
+        """Подтверждает еще ожидающие счета и возвращает только те, что подтверждены этой транзакцией"""
+        completed = []
+        for payment, transfer in matches:
+            # Условие на статус делает повторное подтверждение того же счета пустой операцией
+            result = await session.execute(
+                update(Payment)
+                .where(Payment.id == payment.id, Payment.status == PaymentStatus.PENDING)
+                .values(status=PaymentStatus.COMPLETED, completed_at=transfer.received_at)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 1:
+                completed.append((payment, transfer))
+        return completed
+
+    @staticmethod
+    async def _renew_subscriptions(session: AsyncSession, matches: List[tuple[Payment, IncomingTransfer]]):
+        """Активирует оплаченные подписки и продлевает срок следующего платежа"""
+        result = await session.execute(
+            select(Subscription.id, Subscription.next_payment_due)
+            .where(Subscription.id.in_({payment.subscription_id for payment, _ in matches}))
+            .with_for_update()
+        )
+        due = dict(result.all())
+        for payment, transfer in matches:
+            due[payment.subscription_id] = extend_next_payment_date(due.get(payment.subscription_id), transfer.received_at)
+        await session.execute(update(Subscription), [
+            {'id': subscription_id, 'status': SubscriptionStatus.ACTIVE,
+             'next_payment_due': next_payment_due, 'renewal_reminder_sent_at': None}
+            for subscription_id, next_payment_due in due.items()
+        ])
+
+    async def _notify(self, matches: List[tuple[Payment, IncomingTransfer]]):
+        """Уведомляет владельцев подтвержденных платежей; платежи уже записаны, ошибки только логируются"""
+        subscription_ids = {payment.subscription_id for payment, _ in matches}
+        try:
+            async with get_async_session() as session:
+                result = await session.execute(
+                    select(User, Subscription.id)
+                    .join(Subscription, Subscription.user_id == User.id)
+                    .where(Subscription.id.in_(subscription_ids))
+                )
+                owners = result.all()
+            futures = [await self.notifications.send_payment_success(user, subscription_id) for user, subscription_id in owners]
+            await asyncio.gather(*futures, return_exceptions=True)
+        except Exception as e:
+            logger.error(f"Не удалось отправить уведомления об оплате: {str(e)}", exc_info=True)
+
+    async def _load_cursor(self, session: AsyncSession) -> WalletCursor:
+        result = await session.execute(select(WalletCursor).where(WalletCursor.address == self.wallet_address))
+        cursor = result.scalars().first()
+        if cursor is None:
+            cursor = WalletCursor(address=self.wallet_address, last_lt=0)
+            session.add(cursor)
+        return cursor
+
+    async def run_once(self) -> int:
+        """Один цикл сверки. Возвращает количество подтвержденных платежей"""
+        if not self.wallet_address:
+            logger.warning("TON_WALLET_ADDRESS не задан, сверка платежей пропущена")
+            return 0
+
+        not_before = datetime.utcnow() - self.payment_window
+        async with get_async_session() as session:
+            cursor = await self._load_cursor(session)
+            since_lt, since_hash = cursor.last_lt or 0, cursor.last_hash
+        # Соединение с БД не удерживается, пока идут запросы к toncenter
+
+        transfers, newest = await self.fetch_new_transfers(since_lt, since_hash, not_before)
+        if not newest:
+            return 0
+        memos = {transfer.memo for transfer in transfers if transfer.memo}
+
+        # Поиск счетов, платежи, подписки и курсор - одной транзакцией
+        async with get_async_session() as session:
+            pending = []
+            if memos:
+                # Один запрос по уникальному индексу ux_payments_memo на все новые переводы
+                result = await session.execute(
+                    select(Payment).where(Payment.memo.in_(memos), Payment.status == PaymentStatus.PENDING)
+                )
+                pending = result.scalars().all()
+            matches = self.match(pending, transfers)
+            logger.info(
+                f"Сверка платежей: {len(transfers)} новых переводов, {len(memos)} с кодом счета, "
+                f"{len(matches)} совпадений"
+            )
+            if matches:
+                matches = await self._complete_payments(session, matches)
+            if matches:
+                await self._renew_subscriptions(session, matches)
+            cursor = await self._load_cursor(session)
+            cursor.last_lt = int(newest['lt'])
+            cursor.last_hash = newest['hash']
+            try:
+                await session.commit()
+            except IntegrityError:
+                # Параллельная сверка первой создала курсор кошелька; эти переводы подтвердит она
+                await session.rollback()
+                logger.info(f"Курсор кошелька {self.wallet_address} создан параллельной сверкой, цикл пропущен")
+                return 0
+        if matches:
+            await self._notify(matches)
+        return len(matches)
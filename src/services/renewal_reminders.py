@@ -0,0 +1,76 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import select, update
+
+from config import RENEWAL_REMINDER_DAYS, RENEWAL_SCAN_BATCH_SIZE, RENEWAL_SCAN_INTERVAL
+from database.migrations import get_async_session
+from database.models import Subscription, SubscriptionStatus, User
+from services.notifications import NotificationService
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+class RenewalReminderScanner:
+    """
+    Напоминания о продлении подписки.
+
+    Подписки, срок оплаты которых наступает в ближайшие days_before дней,
+    выбираются диапазонным запросом по индексу (status, next_payment_due)
+    пачками по batch_size. После отправки пачки подписки помечаются
+    renewal_reminder_sent_at, поэтому каждая получает одно напоминание за срок.
+    """
+
+    def __init__(self, notifications: Optional[NotificationService] = None, days_before: int = RENEWAL_REMINDER_DAYS,
+                 batch_size: int = RENEWAL_SCAN_BATCH_SIZE, check_interval: int = RENEWAL_SCAN_INTERVAL):
+        self.notifications = notifications or NotificationService()
+        self.days_before = days_before
+        self.batch_size = batch_size
+        self.check_interval = check_interval
+
+    async def run_once(self, now: Optional[datetime] = None) -> int:
+        """Отправляет все причитающиеся напоминания. Возвращает их количество"""
+        due_before = (now or datetime.utcnow()) + timedelta(days=self.days_before)
+        reminded = 0
+        while True:
+            async with get_async_session() as session:
+                result = await session.execute(
+                    select(Subscription, User)
+                    .join(User, Subscription.user_id == User.id)
+                    .where(
+                        Subscription.status == SubscriptionStatus.ACTIVE,
+                        Subscription.next_payment_due <= due_before,
+                        Subscription.renewal_reminder_sent_at.is_(None)
+                    )
+                    .order_by(Subscription.next_payment_due, Subscription.id)
+                    .limit(self.batch_size)
+                )
+                batch = result.all()
+            if not batch:
+                break
+            futures = [await self.notifications.send_subscription_expiring(user, subscription) for subscription, user in batch]
+            # Следующая пачка ставится в очередь после отправки предыдущей
+            await asyncio.gather(*futures, return_exceptions=True)
+            async with get_async_session() as session:
+                await session.execute(
+                    update(Subscription)
+                    .where(Subscription.id.in_([subscription.id for subscription, _ in batch]))
+                    .values(renewal_reminder_sent_at=datetime.utcnow())
+                )
+                await session.commit()
+            reminded += len(batch)
+        if reminded:
+            logger.info(f"Отправлено напоминаний о продлении подписки: {reminded}")
+        return reminded
+
+    async def start(self):
+        """Фоновая задача процесса бота: периодически проверяет сроки оплаты"""
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Ошибка при отправке напоминаний о продлении: {str(e)}", exc_info=True)
+            await asyncio.sleep(self.check_interval)
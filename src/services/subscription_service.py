@@ -1,108 +1,131 @@
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
 from database.models import User, Subscription, Payment, PaymentStatus, SubscriptionStatus
-from ton.ton_connect import TONConnect
+from ton.async_client import AsyncTONClient
+from services.exchange_rate import get_exchange_rate_service
 from config import SUBSCRIPTION_PRICE_RUB
 from typing import Optional
 
 class SubscriptionService:
-    def __init__(self, session: Session):
+    def __init__(self, session: AsyncSession):
         self.session = session
-        self.ton_connect = TONConnect()
+        self.ton_client = AsyncTONClient()
 
-    def create_subscription(self, telegram_id: int, first_name: str, last_name: str) -> tuple[User, Subscription, Payment]:
+    async def _find_user_and_subscription(self, telegram_id: int) -> tuple[Optional[User], Optional[Subscription]]:
+        """Пользователь и его активная подписка одним запросом"""
+        result = await self.session.execute(
+            select(User, Subscription)
+            .outerjoin(Subscription, and_(
+                Subscription.user_id == User.id,
+                Subscription.status == SubscriptionStatus.ACTIVE
+            ))
+            .where(User.telegram_id == telegram_id)
+            .order_by(Subscription.id)
+            .limit(1)
+        )
+        row = result.first()
+        return (row[0], row[1]) if row else (None, None)
+
+    async def _find_payment(self, memo: str) -> Optional[Payment]:
+        """Платеж по коду счета (индекс ux_payments_memo) вместе с подпиской"""
+        result = await self.session.execute(
+            select(Payment).options(joinedload(Payment.subscription)).where(Payment.memo == memo)
+        )
+        return result.scalars().first()
+
+    async def create_subscription(self, telegram_id: int, first_name: str, last_name: str,
+                                  amount_rub: float = SUBSCRIPTION_PRICE_RUB) -> tuple[User, Subscription, Payment]:
         """
-        Создает новую подписку для пользователя
+        Выставляет счет на подписку и сохраняет его как ожидающий платеж
+
+        Курс и счет запрашиваются до начала транзакции; пользователь,
+        подписка и платеж записываются одним commit. Действующая подписка
+        продлевается этим счетом, новая создается приостановленной и
+        активируется, когда сверка платежей найдет перевод с кодом счета.
         """
-        # Создаем или получаем пользователя
-        user = self.session.query(User).filter_by(telegram_id=telegram_id).first()
-        if not user:
+        # Рассчитываем сумму в TON
+        amount_ton = await get_exchange_rate_service().rub_to_ton(amount_rub)
+        # Выставляем счет: перевод на кошелек сервиса с кодом счета в комментарии
+        payment_info = await self.ton_client.generate_payment_address(amount_ton)
+
+        user, subscription = await self._find_user_and_subscription(telegram_id)
+        if user is None:
             user = User(
                 telegram_id=telegram_id,
                 first_name=first_name,
                 last_name=last_name
             )
             self.session.add(user)
-            self.session.commit()
 
-        # Создаем подписку
-        subscription = Subscription(
-            user_id=user.id,
-            start_date=datetime.utcnow(),
-            status=SubscriptionStatus.ACTIVE
-        )
-        self.session.add(subscription)
-        self.session.commit()
+        elif subscription is None:
+            # Повторный счет до оплаты относится к той же неоплаченной подписке
+            result = await self.session.execute(
+                select(Subscription).where(
+                    Subscription.user_id == user.id,
+                    Subscription.status == SubscriptionStatus.PAUSED,
+                    Subscription.next_payment_due.is_(None)
+                ).order_by(Subscription.id.desc()).limit(1)
+            )
+            subscription = result.scalars().first()
 
-        # Рассчитываем сумму в TON
-        amount_ton = self.ton_connect.calculate_ton_amount(SUBSCRIPTION_PRICE_RUB)
-        
-        # Создаем платеж
-        payment_info = self.ton_connect.create_payment_request(amount_ton)
-        
+        # Внешние ключи проставляются через отношения при единственном flush
+        if subscription is None:
+            subscription = Subscription(
+                user=user,
+                start_date=datetime.utcnow(),
+                status=SubscriptionStatus.PAUSED,
+                amount_rub=amount_rub,
+                amount_ton=amount_ton
+            )
+            self.session.add(subscription)
         payment = Payment(
-            subscription_id=subscription.id,
-            amount_ton=amount_ton,
+            subscription=subscription,
+            memo=payment_info['memo'],
+            amount_nanoton=payment_info['amount_nanoton'],
             status=PaymentStatus.PENDING,
             ton_address=payment_info['address']
         )
         self.session.add(payment)
-        self.session.commit()
+        await self.session.commit()
 
         return user, subscription, payment
 
-    def check_payment(self, payment_id: int) -> bool:
+    async def get_payment(self, memo: str) -> Optional[Payment]:
         """
-        Проверяет статус платежа и обновляет подписку при успешной оплате
+        Возвращает платеж по коду счета вместе с подпиской
         """
-        payment = self.session.query(Payment).get(payment_id)
-        if not payment:
-            return False
+        return await self._find_payment(memo)
 
-        payment_status = self.ton_connect.check_payment_status(payment.ton_address)
-        
-        if payment_status['status'] == 'completed':
-            payment.status = PaymentStatus.COMPLETED
-            payment.completed_at = datetime.utcnow()
-            
-            subscription = payment.subscription
-            subscription.status = SubscriptionStatus.ACTIVE
-            subscription.accumulated_nights += 1
-            
-            self.session.commit()
-            return True
-        
-        return False
-
-    def get_user_subscription(self, telegram_id: int) -> Optional[Subscription]:
+    async def get_user_subscription(self, telegram_id: int) -> Optional[Subscription]:
         """
         Получает активную подписку пользователя
         """
-        user = self.session.query(User).filter_by(telegram_id=telegram_id).first()
-        if not user:
-            return None
-
-        return self.session.query(Subscription)\
-            .filter_by(user_id=user.id, status=SubscriptionStatus.ACTIVE)\
-            .first()
+        result = await self.session.execute(
+            select(Subscription)
+            .join(User, Subscription.user_id == User.id)
+            .where(User.telegram_id == telegram_id, Subscription.status == SubscriptionStatus.ACTIVE)
+        )
+        return result.scalars().first()
 
-    def add_night(self, subscription_id: int) -> bool:
+    async def add_night(self, subscription_id: int) -> bool:
         """
         Добавляет одну ночь к подписке
         """
-        subscription = self.session.query(Subscription).get(subscription_id)
-        if not subscription or subscription.status != SubscriptionStatus.ACTIVE:
-            return False
-
-        subscription.accumulated_nights += 1
-        self.session.commit()
-        return True
+        result = await self.session.execute(
+            update(Subscription)
+            .where(Subscription.id == subscription_id, Subscription.status == SubscriptionStatus.ACTIVE)
+            .values(accumulated_nights=func.coalesce(Subscription.accumulated_nights, 0) + 1)
+        )
+        await self.session.commit()
+        return result.rowcount == 1
 
-    def get_subscription_status(self, subscription_id: int) -> dict:
+    async def get_subscription_status(self, subscription_id: int) -> dict:
         """
         Возвращает статус подписки
         """
-        subscription = self.session.query(Subscription).get(subscription_id)
+        subscription = await self.session.get(Subscription, subscription_id, options=[selectinload(Subscription.user)])
         if not subscription:
             return None
 
@@ -114,4 +137,4 @@ class SubscriptionService:
                 'first_name': subscription.user.first_name,
                 'last_name': subscription.user.last_name
             }
-        } 
\ No newline at end of file
+        }
@@ -1,8 +1,8 @@
 import os
 from dotenv import load_dotenv
-import aiohttp
 from datetime import datetime
 from database.models import PaymentTransaction
+from services.exchange_rate import get_exchange_rate_service
 from sqlalchemy.orm import Session
 
 # Загрузка переменных окружения
@@ -17,16 +17,12 @@ class TONPaymentService:
         self.wallet_address = TON_WALLET_ADDRESS
 
     async def get_ton_price(self) -> float:
-        """Получение текущей цены TON в рублях"""
-        async with aiohttp.ClientSession() as session:
-            async with session.get('https://api.coingecko.com/api/v3/simple/price?ids=the-open-network&vs_currencies=rub') as response:
-                data = await response.json()
-                return data['the-open-network']['rub']
+        """Получение текущей цены TON в рублях из общего кеша курса"""
+        return await get_exchange_rate_service().get_rate()
 
     async def calculate_ton_amount(self, rub_amount: float) -> float:
         """Расчет суммы в TON на основе суммы в рублях"""
-        ton_price = await self.get_ton_price()
-        return rub_amount / ton_price
+        return await get_exchange_rate_service().rub_to_ton(rub_amount)
 
     async def create_payment_transaction(self, user_id: int, rub_amount: float) -> PaymentTransaction:
         """Создание транзакции платежа"""
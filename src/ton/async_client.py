@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from config import (
+    TON_API_KEY, TON_API_URL, TON_WALLET_ADDRESS,
+    TON_API_RPS, TON_API_TIMEOUT, TON_API_MAX_RETRIES
+)
+from utils.helpers import build_ton_transfer_link, generate_payment_memo, to_nanotons
+from utils.http import create_http_session, get_http_session
+from utils.rate_limit import TokenBucket
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Коды ответа, при которых запрос имеет смысл повторить
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# Лимит toncenter действует на ключ API, поэтому ограничитель общий для всех клиентов с одним ключом
+_rate_limiters: Dict[Optional[str], TokenBucket] = {}
+
+
+class TONAPIError(Exception):
+    """Ошибка при обращении к TON API"""
+
+
+def get_rate_limiter(api_key: Optional[str], rps: float = TON_API_RPS) -> TokenBucket:
+    """Возвращает общий ограничитель частоты запросов для ключа API"""
+    limiter = _rate_limiters.get(api_key)
+    if limiter is None:
+        if rps <= 0:
+            raise ValueError(f"TON_API_RPS должен быть больше нуля, задано {rps}")
+        # При лимите меньше одного запроса в секунду в ведре все равно помещается целый запрос
+        limiter = _rate_limiters[api_key] = TokenBucket(rate=rps, capacity=max(rps, 1))
+    return limiter
+
+
+class AsyncTONClient:
+    """
+    Асинхронный клиент toncenter.
+
+    Использует общий пул keep-alive соединений, ограничивает время каждого
+    запроса, повторяет временные ошибки с экспоненциальной задержкой
+    со случайным разбросом и соблюдает лимит запросов в секунду для ключа API.
+    """
+
+    def __init__(self, api_key: Optional[str] = TON_API_KEY, api_url: str = TON_API_URL,
+                 wallet_address: Optional[str] = TON_WALLET_ADDRESS, timeout: float = TON_API_TIMEOUT,
+                 max_retries: int = TON_API_MAX_RETRIES, backoff_base: float = 0.5, backoff_max: float = 8.0,
+                 rate_limiter: Optional[TokenBucket] = None, session: Optional[aiohttp.ClientSession] = None):
+        self.api_key = api_key
+        self.api_url = api_url.rstrip('/')
+        self.wallet_address = wallet_address
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate_limiter = rate_limiter or get_rate_limiter(api_key)
+        self.headers = {"Content-Type": "application/json"}
+        if api_key:
+            self.headers["X-API-Key"] = api_key
+        self._session = session
+
+    def _backoff(self, attempt: int) -> float:
+        """Задержка перед повтором: экспоненциальная, со случайным разбросом (full jitter)"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def request(self, method: str, path: str, **kwargs) -> dict:
+        """Выполняет запрос к API с ограничением частоты, таймаутом и повторами"""
+        session = self._session or get_http_session()
+        url = f"{self.api_url}/{path.lstrip('/')}"
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.acquire()
+            try:
+                async with session.request(method, url, headers=self.headers, timeout=self.timeout, **kwargs) as response:
+                    if response.status in RETRYABLE_STATUSES:
+                        last_error = TONAPIError(f"HTTP {response.status} от {url}")
+                        retry_after = response.headers.get('Retry-After')
+                        delay = float(retry_after) if retry_after and retry_after.isdigit() else self._backoff(attempt)
+                    else:
+                        response.raise_for_status()
+                        return await response.json()
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+                last_error = e
+                delay = self._backoff(attempt)
+            except aiohttp.ClientResponseError as e:
+                raise TONAPIError(f"Ошибка TON API: {str(e)}") from e
+
+            if attempt < self.max_retries:
+                logger.warning(f"Запрос к TON API не удался ({last_error}), повтор через {delay:.2f} с")
+                await asyncio.sleep(delay)
+        raise TONAPIError(f"Ошибка TON API после {self.max_retries + 1} попыток: {last_error}")
+
+    async def create_payment_request(self, amount_ton: float) -> Dict:
+        """
+        Создает запрос на оплату в TON
+        """
+        payload = {
+            "amount": str(amount_ton),
+            "currency": "TON",
+            "expires_at": (datetime.utcnow() + timedelta(hours=24)).isoformat()
+        }
+        return await self.request("POST", "createPayment", json=payload)
+
+    async def check_payment_status(self, payment_id: str) -> Dict:
+        """
+        Проверяет статус платежа
+        """
+        return await self.request("GET", f"payment/{payment_id}")
+
+    async def get_ton_price(self) -> float:
+        """
+        Получает текущий курс TON в рублях из общего кеша курса
+        """
+        from services.exchange_rate import get_exchange_rate_service
+        return await get_exchange_rate_service().get_rate()
+
+    async def calculate_ton_amount(self, amount_rub: float) -> float:
+        """
+        Рассчитывает сумму в TON на основе суммы в рублях
+        """
+        return amount_rub / await self.get_ton_price()
+
+    async def generate_payment_address(self, amount_ton: float) -> Dict:
+        """
+        Выставляет счет: адрес кошелька сервиса и уникальный код для комментария к переводу
+        """
+        memo = generate_payment_memo()
+        amount_nanoton = to_nanotons(amount_ton)
+        return {
+            "address": self.wallet_address,
+            "memo": memo,
+            "amount": amount_ton,
+            "amount_nanoton": amount_nanoton,
+            "link": build_ton_transfer_link(self.wallet_address, amount_nanoton, memo),
+            "expires_at": (datetime.now() + timedelta(hours=24)).isoformat()
+        }
+
+    async def get_transactions(self, address: str, limit: int = 100, lt: Optional[int] = None,
+                               tx_hash: Optional[str] = None, archival: bool = True) -> List[dict]:
+        """
+        Одна страница транзакций адреса, от новых к старым
+        """
+        params = {'address': address, 'limit': str(limit), 'archival': 'true' if archival else 'false'}
+        if lt is not None:
+            params['lt'] = str(lt)
+            params['hash'] = tx_hash
+        data = await self.request("GET", "getTransactions", params=params)
+        if not data.get('ok', True):
+            raise TONAPIError(f"Ошибка toncenter: {data.get('error')}")
+        return data.get('result', [])
+
+
+class SyncTONClient:
+    """
+    Синхронная обертка над AsyncTONClient для скриптов.
+
+    Выполняет запросы в собственном цикле событий со своим пулом соединений.
+    Не предназначена для вызова из асинхронного кода.
+    """
+
+    def __init__(self, **kwargs):
+        self._loop = asyncio.new_event_loop()
+        self._session = self._loop.run_until_complete(self._create_session())
+        self._client = AsyncTONClient(session=self._session, **kwargs)
+
+    @staticmethod
+    async def _create_session() -> aiohttp.ClientSession:
+        return create_http_session()
+
+    def _run(self, coroutine):
+        return self._loop.run_until_complete(coroutine)
+
+    def create_payment_request(self, amount_ton: float) -> Dict:
+        return self._run(self._client.create_payment_request(amount_ton))
+
+    def check_payment_status(self, payment_id: str) -> Dict:
+        return self._run(self._client.check_payment_status(payment_id))
+
+    def get_ton_price(self) -> float:
+        return self._run(self._client.get_ton_price())
+
+    def calculate_ton_amount(self, amount_rub: float) -> float:
+        return self._run(self._client.calculate_ton_amount(amount_rub))
+
+    def generate_payment_address(self, amount_ton: float) -> Dict:
+        return self._run(self._client.generate_payment_address(amount_ton))
+
+    def get_transactions(self, address: str, **kwargs) -> List[dict]:
+        return self._run(self._client.get_transactions(address, **kwargs))
+
+    def close(self):
+        """Закрывает пул соединений и цикл событий"""
+        if not self._loop.is_closed():
+            self._run(self._session.close())
+            self._loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,11 +1,15 @@
 import requests
 from typing import Dict, Optional
 from datetime import datetime, timedelta
+from config import TON_WALLET_ADDRESS
+from utils.helpers import build_ton_transfer_link, generate_payment_memo, to_nanotons
 
 class TONClient:
-    def __init__(self, api_key: str, api_url: str = "https://toncenter.com/api/v2"):
+    def __init__(self, api_key: str, api_url: str = "https://toncenter.com/api/v2",
+                 wallet_address: Optional[str] = TON_WALLET_ADDRESS):
         self.api_key = api_key
         self.api_url = api_url
+        self.wallet_address = wallet_address
         self.headers = {
             "X-API-Key": api_key,
             "Content-Type": "application/json"
@@ -13,19 +17,25 @@ class TONClient:
 
     def generate_payment_address(self, amount_ton: float) -> Dict:
         """
-        Генерирует адрес для оплаты в TON
+        Выставляет счет на оплату в TON
+
+        Все платежи идут на общий кошелек сервиса, счет определяется
+        уникальным кодом в комментарии к переводу.
         """
-        # TODO: Реализовать интеграцию с реальным TON API
-        # Это заглушка для демонстрации
+        memo = generate_payment_memo()
+        amount_nanoton = to_nanotons(amount_ton)
         return {
-            "address": "EQD...",  # Здесь будет реальный адрес
+            "address": self.wallet_address,
+            "memo": memo,
             "amount": amount_ton,
+            "amount_nanoton": amount_nanoton,
+            "link": build_ton_transfer_link(self.wallet_address, amount_nanoton, memo),
             "expires_at": (datetime.now() + timedelta(hours=24)).isoformat()
         }
 
-    def check_payment_status(self, address: str) -> Dict:
+    def check_payment_status(self, memo: str) -> Dict:
         """
-        Проверяет статус платежа по адресу
+        Проверяет статус платежа по коду счета
         """
         # TODO: Реализовать проверку статуса платежа
         return {
@@ -35,16 +45,16 @@ class TONClient:
 
     def get_ton_price(self) -> float:
         """
-        Получает текущий курс TON
+        Получает последний известный курс TON в рублях из общего кеша курса
         """
-        # TODO: Реализовать получение курса TON
-        return 2.5  # Примерный курс TON к USD
+        from services.exchange_rate import ExchangeRateUnavailable, get_exchange_rate_service
+        rate = get_exchange_rate_service().last_known_rate
+        if rate is None:
+            raise ExchangeRateUnavailable("Курс TON еще не загружен")
+        return rate
 
     def calculate_ton_amount(self, amount_rub: float) -> float:
         """
         Рассчитывает сумму в TON на основе суммы в рублях
         """
-        ton_price = self.get_ton_price()
-        # Примерный курс USD к RUB
-        usd_to_rub = 90
-        return (amount_rub / usd_to_rub) / ton_price 
\ No newline at end of file
+        return amount_rub / self.get_ton_price() 
\ No newline at end of file
@@ -46,23 +46,16 @@ class TONConnect:
 
     def get_ton_price(self) -> float:
         """
-        Получает текущий курс TON
+        Получает последний известный курс TON в рублях из общего кеша курса
         """
-        endpoint = f"{self.base_url}/price"
-        
-        try:
-            response = requests.get(endpoint, headers=self.headers)
-            response.raise_for_status()
-            data = response.json()
-            return float(data['price'])
-        except (requests.exceptions.RequestException, KeyError, ValueError) as e:
-            raise Exception(f"Ошибка при получении курса TON: {str(e)}")
+        from services.exchange_rate import get_exchange_rate_service
+        rate = get_exchange_rate_service().last_known_rate
+        if rate is None:
+            raise Exception("Ошибка при получении курса TON: курс еще не загружен")
+        return rate
 
     def calculate_ton_amount(self, amount_rub: float) -> float:
         """
         Рассчитывает сумму в TON на основе суммы в рублях
         """
-        ton_price = self.get_ton_price()
-        # Примерный курс USD к RUB
-        usd_to_rub = 90
-        return (amount_rub / usd_to_rub) / ton_price 
\ No newline at end of file
+        return amount_rub / self.get_ton_price() 
\ No newline at end of file
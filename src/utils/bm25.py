@@ -0,0 +1,107 @@
+import heapq
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Sequence, Tuple
+
+# Служебные слова, которые не помогают отличать документы
+STOP_WORDS = frozenset("""
+и в во на с со а но по к ко у о об от до за из для это как что ли же ну я мы вы ты он она они
+вас вам нам мне меня бы то мой ваш ваша ваши есть какой какая какое какие каких можно нужно чтобы
+""".split())
+
+# Окончания русских слов, отбрасываемые при приведении к основе (сначала длинные)
+ENDINGS = sorted("""
+иями ями ами ого его ому ему ыми ими иях ах ях ов ев ой ей ий ый ая яя ое ее ые ие ую юю
+ам ям ом ем ть ешь ет ут ют ит ат ят им ым ы и а я о е у ю ь
+""".split(), key=len, reverse=True)
+
+# Английские окончания множественного числа и глагольных форм: "bedrooms" и "bedroom" дают одну основу
+ENGLISH_ENDINGS = ("ing", "ies", "es", "ed", "s", "e", "y")
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def stem(word: str) -> str:
+    """Грубое приведение слова к основе: отбрасывает окончание, оставляя не меньше трех букв"""
+    # Английские слова записаны латиницей, русские окончания к ним не подходят
+    endings = ENGLISH_ENDINGS if word.isascii() else ENDINGS
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            # "glass", "access": двойная s - часть основы, а не окончание
+            if ending == "s" and word.endswith("ss"):
+                break
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Основы значимых слов текста в порядке следования"""
+    words = WORD_RE.findall(text.lower().replace('ё', 'е'))
+    stems = (stem(word) for word in words if word not in STOP_WORDS)
+    return [word for word in stems if word not in STOP_WORDS]
+
+
+class BM25Index:
+    """
+    Индекс Okapi BM25 по коллекции текстов в памяти.
+
+    Поиск проходит только по спискам документов терминов запроса, поэтому
+    его стоимость зависит от числа совпадений, а не от размера коллекции.
+    """
+
+    def __init__(self, documents: Sequence[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_terms = [Counter(tokenize(document)) for document in documents]
+        self.lengths = [sum(terms.values()) for terms in self.doc_terms]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        for doc_id, terms in enumerate(self.doc_terms):
+            for term, count in terms.items():
+                self.postings.setdefault(term, []).append((doc_id, count))
+        total = len(self.doc_terms)
+        self.idf = {
+            term: math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+        self._self_scores: Dict[int, float] = {}
+
+    def __len__(self) -> int:
+        return len(self.doc_terms)
+
+    def _score(self, terms: Sequence[str]) -> Tuple[Dict[int, float], Dict[int, int]]:
+        """Оценки документов и число совпавших терминов запроса"""
+        scores: Dict[int, float] = {}
+        matched: Dict[int, int] = {}
+        for term in set(terms):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, count in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / self.avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * count * (self.k1 + 1) / (count + norm)
+                matched[doc_id] = matched.get(doc_id, 0) + 1
+        return scores, matched
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[int, float, float]]:
+        """
+        Лучшие документы по запросу
+
+        Returns:
+            (номер документа, оценка BM25, доля слов запроса, найденных в документе)
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        scores, matched = self._score(terms)
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [(doc_id, score, matched[doc_id] / len(terms)) for doc_id, score in best]
+
+    def self_score(self, doc_id: int) -> float:
+        """Оценка документа по запросу из его собственных слов - верхняя граница для сравнения"""
+        score = self._self_scores.get(doc_id)
+        if score is None:
+            scores, _ = self._score(list(self.doc_terms[doc_id]))
+            score = self._self_scores[doc_id] = scores.get(doc_id, 0.0)
+        return score
@@ -0,0 +1,124 @@
+import heapq
+import math
+from typing import Dict, Hashable, Iterator, List, Optional, Tuple
+
+EARTH_RADIUS_KM = 6371.0088
+# Длина градуса широты
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Расстояние по поверхности Земли между двумя точками (формула гаверсинусов)"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def format_distance(km: float) -> str:
+    """Расстояние для пользователя: метры до километра, дальше километры"""
+    if km < 1:
+        return f"{max(10, round(km * 1000, -1)):.0f} м"
+    return f"{km:.1f} км"
+
+
+class GeoGrid:
+    """
+    Пространственный индекс точек в памяти: равномерная сетка по широте и долготе.
+
+    Ячейка - квадрат cell_km по широте; ее ширина по долготе в градусах та же,
+    поэтому к полюсам ячейки сужаются, но для широт Таиланда это несущественно.
+    Запрос по радиусу проверяет только ячейки, пересекающие круг, а поиск
+    k ближайших обходит кольца ячеек вокруг точки и останавливается, как
+    только следующее кольцо заведомо дальше k-й найденной точки.
+    """
+
+    def __init__(self, cell_km: float = 1.0):
+        self.cell_km = cell_km
+        self.cell_deg = cell_km / KM_PER_DEGREE
+        self._cells: Dict[Tuple[int, int], List[Tuple[Hashable, float, float]]] = {}
+        self._size = 0
+        # Границы занятых ячеек: дальше них обход колец бесполезен
+        self._min_row = self._max_row = self._min_col = self._max_col = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg)
+
+    def add(self, item: Hashable, lat: float, lon: float):
+        row, col = self._cell(lat, lon)
+        if not self._size:
+            self._min_row = self._max_row = row
+            self._min_col = self._max_col = col
+        else:
+            self._min_row, self._max_row = min(self._min_row, row), max(self._max_row, row)
+            self._min_col, self._max_col = min(self._min_col, col), max(self._max_col, col)
+        self._cells.setdefault((row, col), []).append((item, lat, lon))
+        self._size += 1
+
+    def _ring(self, row: int, col: int, r: int) -> Iterator[List[Tuple[Hashable, float, float]]]:
+        """Точки ячеек на расстоянии ровно r ячеек от (row, col)"""
+        if r == 0:
+            cells = [(row, col)]
+        else:
+            cells = [(row - r, c) for c in range(col - r, col + r + 1)]
+            cells += [(row + r, c) for c in range(col - r, col + r + 1)]
+            cells += [(rw, col - r) for rw in range(row - r + 1, row + r)]
+            cells += [(rw, col + r) for rw in range(row - r + 1, row + r)]
+        for cell in cells:
+            points = self._cells.get(cell)
+            if points:
+                yield points
+
+    def within(self, lat: float, lon: float, radius_km: float,
+               limit: Optional[int] = None) -> List[Tuple[Hashable, float]]:
+        """Точки не дальше radius_km, от ближней к дальней"""
+        lat_span = radius_km / KM_PER_DEGREE
+        # Ширина градуса долготы у края круга, ближнего к полюсу
+        cos_lat = math.cos(math.radians(min(89.9, abs(lat) + lat_span)))
+        lon_span = lat_span / max(cos_lat, 1e-6)
+        min_row, min_col = self._cell(lat - lat_span, lon - lon_span)
+        max_row, max_col = self._cell(lat + lat_span, lon + lon_span)
+        found = []
+        for row in range(max(min_row, self._min_row), min(max_row, self._max_row) + 1):
+            for col in range(max(min_col, self._min_col), min(max_col, self._max_col) + 1):
+                for item, item_lat, item_lon in self._cells.get((row, col), ()):
+                    distance = distance_km(lat, lon, item_lat, item_lon)
+                    if distance <= radius_km:
+                        found.append((item, distance))
+        found.sort(key=lambda pair: pair[1])
+        return found[:limit] if limit is not None else found
+
+    def nearest(self, lat: float, lon: float, k: int,
+                max_distance_km: Optional[float] = None) -> List[Tuple[Hashable, float]]:
+        """k ближайших точек (не дальше max_distance_km, если задано), от ближней к дальней"""
+        if not self._size or k <= 0:
+            return []
+        row, col = self._cell(lat, lon)
+        # Наибольшее число колец, после которого занятых ячеек не остается
+        max_ring = max(row - self._min_row, self._max_row - row, col - self._min_col, self._max_col - col)
+        best: List[Tuple[float, int, Hashable]] = []  # куча с обратным знаком расстояния
+        seen = 0
+        for r in range(max_ring + 1):
+            for points in self._ring(row, col, r):
+                for item, item_lat, item_lon in points:
+                    distance = distance_km(lat, lon, item_lat, item_lon)
+                    seen += 1
+                    if max_distance_km is not None and distance > max_distance_km:
+                        continue
+                    entry = (-distance, seen, item)
+                    if len(best) < k:
+                        heapq.heappush(best, entry)
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, entry)
+            # Точки за пределами r колец дальше r ширин ячейки (у края, ближнего к полюсу)
+            cos_lat = math.cos(math.radians(min(89.9, abs(lat) + (r + 1) * self.cell_deg)))
+            reach_km = r * self.cell_km * cos_lat
+            if max_distance_km is not None and reach_km > max_distance_km:
+                break
+            if len(best) == k and reach_km >= -best[0][0]:
+                break
+        return [(item, -neg_distance) for neg_distance, _, item in sorted(best, reverse=True)]
@@ -1,7 +1,24 @@
+import base64
+import binascii
 import random
+import re
+import secrets
 import string
 from datetime import datetime, timedelta
 from typing import Optional
+from urllib.parse import urlencode
+
+NANOTONS_PER_TON = 10 ** 9
+
+# Комментарий к переводу, по которому платеж сопоставляется со счетом.
+# Алфавит без похожих символов (0/O, 1/I/L), чтобы код можно было набрать вручную
+PAYMENT_MEMO_PREFIX = "OP"
+PAYMENT_MEMO_ALPHABET = "23456789ABCDEFGHJKMNPQRSTUVWXYZ"
+PAYMENT_MEMO_LENGTH = 8
+
+# Адрес TON в виде workchain:hash (raw) или в base64 с контрольной суммой (user-friendly)
+RAW_TON_ADDRESS = re.compile(r'^-?\d+:[0-9a-fA-F]{64}$')
+FRIENDLY_TON_ADDRESS = re.compile(r'^[A-Za-z0-9+/_-]{48}$')
 
 def generate_referral_code(length: int = 8) -> str:
     """Генерация уникального реферального кода"""
@@ -12,6 +29,10 @@ def calculate_next_payment_date(start_date: datetime) -> datetime:
     """Расчет даты следующего платежа"""
     return start_date + timedelta(days=30)
 
+def extend_next_payment_date(current_due: Optional[datetime], paid_at: datetime) -> datetime:
+    """Срок следующего платежа после оплаты: досрочная оплата продлевает текущий срок, а не начинает новый"""
+    return calculate_next_payment_date(max(current_due or paid_at, paid_at))
+
 def format_apartment_info(apartment: dict) -> str:
     """Форматирование информации о квартире"""
     return f"""
@@ -48,10 +69,66 @@ def validate_booking_dates(start_date: datetime, end_date: datetime, min_nights:
     nights = (end_date - start_date).days
     return nights >= min_nights
 
+def to_nanotons(amount_ton: float) -> int:
+    """Переводит сумму в TON в целое число нанотонов"""
+    return int(round(amount_ton * NANOTONS_PER_TON))
+
+def from_nanotons(amount_nanoton: int) -> float:
+    """Переводит нанотоны в TON для отображения"""
+    return amount_nanoton / NANOTONS_PER_TON
+
+def generate_payment_memo() -> str:
+    """Генерация кода счета для комментария к переводу, например OP7K3M9QX2"""
+    return PAYMENT_MEMO_PREFIX + ''.join(
+        secrets.choice(PAYMENT_MEMO_ALPHABET) for _ in range(PAYMENT_MEMO_LENGTH)
+    )
+
+def parse_payment_memo(comment: Optional[str]) -> Optional[str]:
+    """Извлекает код счета из комментария к переводу или возвращает None"""
+    if not comment:
+        return None
+    memo = comment.strip().upper()
+    if len(memo) != len(PAYMENT_MEMO_PREFIX) + PAYMENT_MEMO_LENGTH or not memo.startswith(PAYMENT_MEMO_PREFIX):
+        return None
+    if any(char not in PAYMENT_MEMO_ALPHABET for char in memo[len(PAYMENT_MEMO_PREFIX):]):
+        return None
+    return memo
+
+def _crc16_xmodem(data: bytes) -> int:
+    crc = 0
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else crc << 1
+            crc &= 0xFFFF
+    return crc
+
+def is_valid_ton_address(address: Optional[str]) -> bool:
+    """Проверяет адрес кошелька TON: raw (0:abcd...) или user-friendly (EQ.../UQ...) с верной контрольной суммой"""
+    if not address:
+        return False
+    if RAW_TON_ADDRESS.match(address):
+        return True
+    if not FRIENDLY_TON_ADDRESS.match(address):
+        return False
+    try:
+        data = base64.urlsafe_b64decode(address.replace('+', '-').replace('/', '_'))
+    except (binascii.Error, ValueError):
+        return False
+    return len(data) == 36 and _crc16_xmodem(data[:34]) == int.from_bytes(data[34:], 'big')
+
+def build_ton_transfer_link(address: str, amount_nanoton: int, memo: str) -> str:
+    """Ссылка ton:// для кошелька с уже заполненными суммой и комментарием"""
+    return f"ton://transfer/{address}?" + urlencode({'amount': amount_nanoton, 'text': memo})
+
 def format_ton_amount(amount: float) -> str:
     """Форматирование суммы в TON"""
     return f"{amount:.4f} TON"
 
-def get_nearest_available_date(current_date: datetime, min_nights: int = 7) -> datetime:
-    """Получение ближайшей доступной даты для бронирования"""
-    return current_date + timedelta(days=30 * min_nights) 
\ No newline at end of file
+def format_nanotons(amount_nanoton: int) -> str:
+    """Точная сумма в TON без округления, например 12.345 TON"""
+    whole, fraction = divmod(amount_nanoton, NANOTONS_PER_TON)
+    if not fraction:
+        return f"{whole} TON"
+    return f"{whole}.{fraction:09d}".rstrip('0') + " TON"
+ 
\ No newline at end of file
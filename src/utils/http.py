@@ -0,0 +1,36 @@
+import asyncio
+from typing import Dict, Optional
+
+import aiohttp
+
+from config import HTTP_POOL_LIMIT, HTTP_POOL_LIMIT_PER_HOST, HTTP_KEEPALIVE_TIMEOUT
+
+# aiohttp.ClientSession привязана к циклу событий, поэтому храним по одной на цикл
+_sessions: Dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+
+
+def create_http_session(**kwargs) -> aiohttp.ClientSession:
+    """Создает сессию aiohttp с пулом keep-alive соединений"""
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector, **kwargs)
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """Возвращает общую для процесса сессию aiohttp текущего цикла событий"""
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        session = create_http_session()
+        _sessions[loop] = session
+    return session
+
+
+async def close_http_session():
+    """Закрывает общую сессию текущего цикла событий"""
+    session: Optional[aiohttp.ClientSession] = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
@@ -0,0 +1,34 @@
+import asyncio
+import logging
+from typing import Callable, Dict
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Источники метрик: имя -> функция, возвращающая словарь текущих значений
+_sources: Dict[str, Callable[[], dict]] = {}
+
+def register_metrics(name: str, source: Callable[[], dict]):
+    """Регистрирует источник метрик. Повторная регистрация заменяет прежний источник"""
+    _sources[name] = source
+
+def unregister_metrics(name: str):
+    _sources.pop(name, None)
+
+def collect_metrics() -> Dict[str, dict]:
+    """Снимок всех зарегистрированных метрик"""
+    snapshot = {}
+    for name, source in list(_sources.items()):
+        try:
+            snapshot[name] = source()
+        except Exception as e:
+            logger.error(f"Ошибка при сборе метрик {name}: {str(e)}")
+    return snapshot
+
+async def log_metrics(interval: float = 60):
+    """Периодически пишет метрики в лог (для процесса бота без HTTP-сервера)"""
+    while True:
+        await asyncio.sleep(interval)
+        snapshot = collect_metrics()
+        if snapshot:
+            logger.info(f"Метрики: {snapshot}")
@@ -0,0 +1,39 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Асинхронный ограничитель частоты запросов (token bucket)
+
+    rate - сколько токенов добавляется в секунду, capacity - максимальный
+    размер пачки запросов, которые можно выполнить без ожидания.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Забирает токены без ожидания. Возвращает False, если их недостаточно"""
+        self._refill()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens: float = 1.0) -> float:
+        """Сколько секунд осталось ждать, пока накопится нужное количество токенов"""
+        self._refill()
+        return max(0.0, (tokens - self._tokens) / self.rate)
+
+    async def acquire(self, tokens: float = 1.0):
+        """Ждет, пока не накопится нужное количество токенов, и забирает их"""
+        while not self.try_acquire(tokens):
+            await asyncio.sleep(self.delay(tokens))
@@ -1,13 +1,23 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 import os
+import sys
 from dotenv import load_dotenv
 
+# Добавляем src в PYTHONPATH, чтобы веб-приложение использовало те же модули
+# (и тот же пул соединений и кеш), что и бот
+src_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if src_path not in sys.path:
+    sys.path.insert(0, src_path)
+
 # Загрузка переменных окружения
 load_dotenv()
 
+from config import BOT_MODE, WEBHOOK_PATH
+
 # Создание приложения FastAPI
 app = FastAPI(title="OtpuskPass Mini App")
 
@@ -20,14 +30,71 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Зависимость для получения сессии БД
-def get_db():
-    from src.database.migrations import init_db
-    db = init_db()
-    try:
+@app.on_event("startup")
+async def startup():
+    """Создание таблиц, прогрев кешей и запуск фоновых задач один раз при запуске
+
+    В режиме webhook здесь же запускается бот: он разбирает обновления,
+    которые Telegram присылает на WEBHOOK_PATH, в том же процессе и цикле событий.
+    """
+    from database.migrations import create_schema_async
+    from services.background import start_background_tasks
+    await create_schema_async()
+    bot = None
+    if BOT_MODE == 'webhook':
+        from bot.webhook import start_webhook_application
+        app.state.telegram_app = await start_webhook_application()
+        bot = app.state.telegram_app.bot
+    # Очередь сообщений и сверку платежей запускает процесс, в котором работает бот
+    app.state.background_tasks = await start_background_tasks(bot)
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Остановка бота и фоновых задач, закрытие соединений пула"""
+    from database.migrations import dispose_async_engine, dispose_engine
+    from services.background import stop_background_tasks
+    from utils.http import close_http_session
+    telegram_app = getattr(app.state, 'telegram_app', None)
+    if telegram_app is not None and telegram_app.running:
+        # Новые обновления не принимаются, уже принятые дообрабатываются
+        await telegram_app.stop()
+    # Очередь сообщений отправляет остаток, пока соединения бота еще открыты
+    await stop_background_tasks(getattr(app.state, 'background_tasks', []))
+    if telegram_app is not None:
+        from bot.webhook import stop_webhook_application
+        await stop_webhook_application(telegram_app)
+        app.state.telegram_app = None
+    await close_http_session()
+    dispose_engine()
+    await dispose_async_engine()
+
+# Зависимость для получения асинхронной сессии БД из общего пула соединений
+async def get_db():
+    from database.migrations import get_async_session
+    async with get_async_session() as db:
         yield db
-    finally:
-        db.close()
+
+@app.post(WEBHOOK_PATH, include_in_schema=False)
+async def telegram_webhook(request: Request):
+    """Прием обновлений от Telegram в режиме webhook
+
+    Обновление только ставится в очередь приложения PTB, поэтому ответ
+    Telegram уходит сразу, не дожидаясь обработчиков.
+    """
+    from bot.webhook import WEBHOOK_SECRET_HEADER, feed_update, is_valid_secret_token
+    telegram_app = getattr(app.state, 'telegram_app', None)
+    if telegram_app is None:
+        raise HTTPException(status_code=404, detail="Режим webhook не включен")
+    if not is_valid_secret_token(request.headers.get(WEBHOOK_SECRET_HEADER)):
+        raise HTTPException(status_code=403, detail="Неверный секрет")
+    await feed_update(telegram_app, await request.json())
+    return {"ok": True}
+
+@app.get("/metrics")
+async def metrics():
+    """Текущие метрики процесса (очередь и обработка обновлений бота и др.)"""
+    from utils.metrics import collect_metrics
+    return collect_metrics()
 
 @app.get("/")
 async def root():
@@ -35,20 +102,79 @@ async def root():
     return {"message": "Добро пожаловать в OtpuskPass Mini App!"}
 
 @app.get("/api/user/{telegram_id}")
-async def get_user(telegram_id: int, db: Session = Depends(get_db)):
+async def get_user(telegram_id: int, db: AsyncSession = Depends(get_db)):
     """Получение информации о пользователе"""
-    from src.database.models import User
-    user = db.query(User).filter(User.telegram_id == telegram_id).first()
+    from database.models import User
+    result = await db.execute(select(User).where(User.telegram_id == telegram_id))
+    user = result.scalars().first()
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     return user
 
+# Эндпоинты /api/apartments/... объявлены раньше /api/apartments/{city},
+# иначе "nearby" и "search" принимались бы за название города
+@app.get("/api/apartments/nearby")
+async def apartments_nearby(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radius_km: Optional[float] = Query(None, gt=0, le=100),
+    limit: int = Query(20, ge=1, le=100),
+):
+    """Квартиры рядом с точкой: в радиусе radius_km или limit ближайших, от ближней к дальней"""
+    from services.nearby import get_nearby_search
+    found = await get_nearby_search().apartments_near(lat, lon, radius_km, limit)
+    return [{**apartment, 'distance_km': round(distance, 3)} for apartment, distance in found]
+
+@app.get("/api/points/{point_id}/apartments")
+async def apartments_near_point(
+    point_id: int,
+    radius_km: Optional[float] = Query(None, gt=0, le=100),
+    limit: int = Query(20, ge=1, le=100),
+):
+    """Квартиры рядом с достопримечательностью"""
+    from services.nearby import get_nearby_search
+    nearby = get_nearby_search()
+    point = await nearby.get_point(point_id)
+    if not point:
+        raise HTTPException(status_code=404, detail="Место не найдено")
+    found = await nearby.apartments_near(point['latitude'], point['longitude'], radius_km, limit)
+    return {
+        'point': point,
+        'apartments': [{**apartment, 'distance_km': round(distance, 3)} for apartment, distance in found],
+    }
+
+@app.get("/api/apartments/search")
+async def search_apartments(
+    q: str = "",
+    city: Optional[str] = None,
+    min_bedrooms: Optional[int] = Query(None, ge=0),
+    max_bedrooms: Optional[int] = Query(None, ge=0),
+    min_area: Optional[float] = Query(None, ge=0),
+    max_area: Optional[float] = Query(None, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """Полнотекстовый поиск квартир по описанию, удобствам и достопримечательностям
+
+    Результаты упорядочены по релевантности. Следующая страница запрашивается
+    с тем же запросом и фильтрами и курсором next_cursor из предыдущего ответа.
+    """
+    from services.apartment_search import ApartmentSearchService, InvalidCursor
+    try:
+        return await ApartmentSearchService(db).search(
+            q, city=city, min_bedrooms=min_bedrooms, max_bedrooms=max_bedrooms,
+            min_area=min_area, max_area=max_area, limit=limit, cursor=cursor
+        )
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/api/apartments/{city}")
-async def get_apartments(city: str, db: Session = Depends(get_db)):
-    """Получение списка квартир в городе"""
-    from src.database.models import Apartment
-    apartments = db.query(Apartment).filter(Apartment.city == city).all()
-    return apartments
+async def get_apartments(city: str):
+    """Получение списка квартир в городе из кеша каталога"""
+    from services.catalog_cache import get_catalog_cache
+    city_catalog = await get_catalog_cache().get_city(city)
+    return city_catalog.apartments
 
 if __name__ == "__main__":
     import uvicorn
@@ -2,6 +2,7 @@
 """
 Скрипт запуска для Railway
 Инициализирует БД и запускает бота и веб-приложение
+(при BOT_MODE=webhook - в одном процессе)
 """
 import os
 import sys
@@ -50,6 +51,14 @@ def main():
     if not init_database():
         logger.warning("Не удалось инициализировать БД, продолжаем запуск...")
     
+    if os.getenv('BOT_MODE', 'polling') == 'webhook':
+        # Бот и веб-приложение работают в одном процессе и одном цикле событий:
+        # Telegram присылает обновления в веб-приложение
+        logger.info("Запуск веб-приложения с ботом в режиме webhook...")
+        import uvicorn
+        uvicorn.run('src.web.main:app', host='0.0.0.0', port=int(os.getenv('PORT', '8000')))
+        return
+    
     # Определяем, какой процесс запускать
     # Railway может запускать разные процессы через Procfile
     process_type = os.getenv('RAILWAY_SERVICE_NAME', 'web')
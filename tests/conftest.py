@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Тесты работают с БД SQLite в памяти через aiosqlite; файловую БД тест подключает сам
+os.environ['DATABASE_URL'] = 'sqlite://'
+
+# Добавляем пути к корневой директории проекта и к src
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+sys.path.insert(0, os.path.join(project_root, 'src'))
@@ -0,0 +1,219 @@
+import logging
+import time
+import unittest
+from unittest import IsolatedAsyncioTestCase, mock
+
+import httpx
+from sqlalchemy import create_engine, delete, insert, text, update
+
+from database.migrations import _create_schema, create_schema_async, dispose_async_engine, get_async_session
+from database.models import Apartment, Base
+from database.search import fulltext_match
+from services.apartment_search import ApartmentSearchService, InvalidCursor, decode_cursor, encode_cursor
+
+logger = logging.getLogger(__name__)
+
+APARTMENTS = [
+    dict(city="Пхукет", address="Пляж Ката, 1", description="Квартира с бассейном и видом на море",
+         features="бассейн, Wi-Fi", num_bedrooms=1, area_sqm=45),
+    dict(city="Пхукет", address="Пляж Карон, 2", description="Тихая квартира в пяти минутах от пляжа",
+         features="Wi-Fi, кондиционер", num_bedrooms=2, area_sqm=70),
+    dict(city="Бангкок", address="Сукхумвит, 10", description="Квартира в центре, на крыше открытый бассейн",
+         features="спортзал, бассейн", num_bedrooms=2, area_sqm=60),
+    dict(city="Бангкок", address="Силом, 5", description="Студия рядом с метро",
+         features="Wi-Fi", num_bedrooms=1, area_sqm=30),
+    dict(city="Паттайя", address="Пратамнак, 7", description="Квартира с террасой у пляжа",
+         features="бассейн, парковка", num_bedrooms=3, area_sqm=95),
+]
+
+
+class TestApartmentSearch(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await create_schema_async()
+        async with get_async_session() as session:
+            session.add_all([Apartment(**fields) for fields in APARTMENTS])
+            await session.commit()
+
+    async def asyncTearDown(self):
+        await dispose_async_engine()
+
+    async def _search(self, *args, **kwargs) -> dict:
+        async with get_async_session() as session:
+            return await ApartmentSearchService(session).search(*args, **kwargs)
+
+    async def _all_pages(self, *args, limit: int, **kwargs) -> list:
+        addresses, cursor = [], None
+        while True:
+            page = await self._search(*args, limit=limit, cursor=cursor, **kwargs)
+            addresses += [item['address'] for item in page['items']]
+            cursor = page['next_cursor']
+            if cursor is None:
+                return addresses
+
+    async def test_word_forms_and_ranking(self):
+        page = await self._search("бассейном")
+        addresses = [item['address'] for item in page['items']]
+        self.assertEqual(set(addresses), {"Пляж Ката, 1", "Сукхумвит, 10", "Пратамнак, 7"})
+        # Бассейн и в описании, и в удобствах - выше, чем только в удобствах
+        self.assertEqual(addresses[-1], "Пратамнак, 7")
+        scores = [item['score'] for item in page['items']]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        self.assertIsNone(page['next_cursor'])
+
+    async def test_more_matched_words_rank_higher(self):
+        page = await self._search("терраса у пляжа")
+        self.assertEqual(page['items'][0]['address'], "Пратамнак, 7")
+        self.assertEqual(len(page['items']), 3)
+
+    async def test_filters(self):
+        page = await self._search("бассейн", city="Бангкок")
+        self.assertEqual([item['address'] for item in page['items']], ["Сукхумвит, 10"])
+        page = await self._search("бассейн", min_bedrooms=2, max_area=80)
+        self.assertEqual([item['address'] for item in page['items']], ["Сукхумвит, 10"])
+        # Без текста запроса - только фильтры, по порядку id
+        page = await self._search(min_bedrooms=2)
+        self.assertEqual([item['address'] for item in page['items']], ["Пляж Карон, 2", "Сукхумвит, 10", "Пратамнак, 7"])
+        self.assertIsNone(page['items'][0]['score'])
+        self.assertEqual((await self._search("и на с"))['items'], (await self._search())['items'])
+
+    async def test_keyset_pagination(self):
+        full = [item['address'] for item in (await self._search("квартира пляж бассейн"))['items']]
+        self.assertEqual(len(full), 4)
+        for limit in (1, 2, 3):
+            self.assertEqual(await self._all_pages("квартира пляж бассейн", limit=limit), full)
+        self.assertEqual(await self._all_pages(limit=2), [fields['address'] for fields in APARTMENTS])
+
+    async def test_english_plural_matches_singular(self):
+        async with get_async_session() as session:
+            session.add(Apartment(city="Пхукет", address="Beach Road, 12", description="Two bedroom condo near the beach",
+                                  features="pool, Wi-Fi", num_bedrooms=2, area_sqm=80))
+            await session.commit()
+        page = await self._search("bedrooms")
+        self.assertEqual([item['address'] for item in page['items']], ["Beach Road, 12"])
+        page = await self._search("2 bedrooms")
+        self.assertEqual(page['items'][0]['address'], "Beach Road, 12")
+
+    async def test_equal_scores_are_paged_by_id(self):
+        async with get_async_session() as session:
+            session.add_all([
+                Apartment(city="Краби", address=f"Ао Нанг, {i}", description="Домик у джунглей", num_bedrooms=1)
+                for i in range(7)
+            ])
+            await session.commit()
+        page = await self._search("джунгли", limit=7)
+        self.assertEqual(len({item['score'] for item in page['items']}), 1)
+        full = [item['address'] for item in page['items']]
+        for limit in (1, 2, 3):
+            self.assertEqual(await self._all_pages("джунгли", limit=limit), full)
+        self.assertEqual(full, [f"Ао Нанг, {i}" for i in range(7)])
+
+    async def test_like_fallback_without_fulltext_index(self):
+        # СУБД без FULLTEXT/FTS5: слова ищутся через LIKE, оценка - число найденных слов
+        with mock.patch('services.apartment_search.fulltext_match',
+                        lambda dialect_name, terms: fulltext_match('postgresql', terms)):
+            page = await self._search("терраса у пляжа")
+            self.assertEqual(page['items'][0]['address'], "Пратамнак, 7")
+            self.assertEqual(page['items'][0]['score'], 2)
+            full = [item['address'] for item in (await self._search("квартира пляж бассейн"))['items']]
+            self.assertEqual(await self._all_pages("квартира пляж бассейн", limit=1), full)
+            page = await self._search("бассейн", city="Бангкок")
+            self.assertEqual([item['address'] for item in page['items']], ["Сукхумвит, 10"])
+
+    async def test_index_follows_catalog_changes(self):
+        async with get_async_session() as session:
+            await session.execute(update(Apartment).where(Apartment.address == "Силом, 5").values(features="бассейн"))
+            await session.execute(delete(Apartment).where(Apartment.address == "Пляж Ката, 1"))
+            # Изменение других колонок индекс не затрагивает
+            await session.execute(update(Apartment).values(booking_version=Apartment.booking_version + 1))
+            await session.commit()
+        page = await self._search("бассейн")
+        self.assertEqual({item['address'] for item in page['items']}, {"Силом, 5", "Сукхумвит, 10", "Пратамнак, 7"})
+
+    async def test_invalid_cursor(self):
+        self.assertEqual(decode_cursor(encode_cursor(1.5e-06, 7)), (1.5e-06, 7))
+        with self.assertRaises(InvalidCursor):
+            await self._search("бассейн", cursor="не курсор")
+        # Курсор запроса без текста не подходит к полнотекстовому запросу
+        with self.assertRaises(InvalidCursor):
+            await self._search("бассейн", cursor=encode_cursor(None, 1))
+
+
+class TestSearchApi(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        from web.main import app
+        await create_schema_async()
+        async with get_async_session() as session:
+            session.add_all([Apartment(**fields) for fields in APARTMENTS])
+            await session.commit()
+        self.client = httpx.AsyncClient(app=app, base_url="http://test")
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        await dispose_async_engine()
+
+    async def test_search_endpoint(self):
+        response = await self.client.get("/api/apartments/search", params={"q": "бассейн", "limit": 2})
+        self.assertEqual(response.status_code, 200)
+        first = response.json()
+        self.assertEqual(len(first['items']), 2)
+        response = await self.client.get("/api/apartments/search",
+                                         params={"q": "бассейн", "limit": 2, "cursor": first['next_cursor']})
+        self.assertEqual(len(response.json()['items']), 1)
+        self.assertIsNone(response.json()['next_cursor'])
+
+    async def test_bad_parameters(self):
+        response = await self.client.get("/api/apartments/search", params={"q": "бассейн", "cursor": "xxx"})
+        self.assertEqual(response.status_code, 400)
+        response = await self.client.get("/api/apartments/search", params={"limit": 1000})
+        self.assertEqual(response.status_code, 422)
+
+
+class TestSearchIndex(unittest.TestCase):
+    """Индекс строится для уже существующих квартир, и поиск не просматривает таблицу целиком"""
+
+    def test_existing_rows_are_indexed_and_plan_uses_fts(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        with engine.begin() as conn:
+            conn.execute(insert(Apartment), APARTMENTS)
+        with engine.begin() as conn:
+            _create_schema(conn)
+            rows = conn.execute(text("SELECT rowid FROM apartments_fts WHERE apartments_fts MATCH 'бассейн*'")).all()
+            self.assertEqual(len(rows), 3)
+            plan = " ".join(row[-1] for row in conn.execute(text(
+                "EXPLAIN QUERY PLAN SELECT apartments.id FROM apartments JOIN apartments_fts "
+                "ON apartments_fts.rowid = apartments.id WHERE apartments_fts MATCH 'бассейн*'"
+            )))
+        self.assertIn("VIRTUAL TABLE INDEX", plan)
+        self.assertNotIn("SCAN apartments ", plan + " ")
+
+
+class TestSearchScaling(IsolatedAsyncioTestCase):
+    """Время поиска редкого слова не растет с размером каталога"""
+
+    async def asyncTearDown(self):
+        await dispose_async_engine()
+
+    async def _timed_search(self, total: int) -> float:
+        await dispose_async_engine()
+        await create_schema_async()
+        async with get_async_session() as session:
+            await session.execute(insert(Apartment), [
+                {'city': f"Город {i % 20}", 'address': f"Улица {i}",
+                 'description': "Квартира с террасой" if i % 1000 == 0 else "Квартира в тихом районе",
+                 'features': "Wi-Fi, кондиционер", 'num_bedrooms': 1 + i % 3, 'area_sqm': 30 + i % 70}
+                for i in range(total)
+            ])
+            await session.commit()
+            service = ApartmentSearchService(session)
+            await service.search("терраса")
+            started = time.perf_counter()
+            for _ in range(20):
+                await service.search("терраса", limit=5)
+            return (time.perf_counter() - started) / 20
+
+    async def test_rare_word_latency_is_flat(self):
+        small = await self._timed_search(2_000)
+        large = await self._timed_search(40_000)
+        logger.debug(f"Поиск редкого слова: {small * 1000:.2f} мс при 2 000 квартир, {large * 1000:.2f} мс при 40 000")
+        self.assertLess(large, small * 5 + 0.005)
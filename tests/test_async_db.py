@@ -0,0 +1,125 @@
+from datetime import datetime
+from unittest import IsolatedAsyncioTestCase
+
+import httpx
+
+from database.migrations import create_schema_async, dispose_async_engine, get_async_session
+from database.models import Payment, PaymentStatus, User, Subscription, SubscriptionStatus
+from services.subscription_service import SubscriptionService
+
+
+class TestSubscriptionServiceAsync(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await create_schema_async()
+        async with get_async_session() as session:
+            user = User(telegram_id=1001, first_name="Иван", last_name="Иванов")
+            session.add(user)
+            await session.flush()
+            self.subscription = Subscription(
+                user_id=user.id,
+                start_date=datetime.utcnow(),
+                status=SubscriptionStatus.ACTIVE,
+                accumulated_nights=0,
+                amount_rub=3000.0,
+                amount_ton=5.0
+            )
+            session.add(self.subscription)
+            await session.commit()
+
+    async def asyncTearDown(self):
+        await dispose_async_engine()
+
+    async def test_get_user_subscription(self):
+        async with get_async_session() as session:
+            service = SubscriptionService(session)
+            subscription = await service.get_user_subscription(1001)
+            self.assertIsNotNone(subscription)
+            self.assertEqual(subscription.id, self.subscription.id)
+            self.assertIsNone(await service.get_user_subscription(999))
+
+    async def test_add_night_and_status(self):
+        async with get_async_session() as session:
+            service = SubscriptionService(session)
+            self.assertTrue(await service.add_night(self.subscription.id))
+            status = await service.get_subscription_status(self.subscription.id)
+        self.assertEqual(status['accumulated_nights'], 1)
+        self.assertEqual(status['user']['first_name'], "Иван")
+
+    async def _issue_invoice(self, telegram_id):
+        import services.exchange_rate as exchange_rate
+
+        async def fetch_rate():
+            return 300.0
+
+        exchange_rate._exchange_rate_service = exchange_rate.ExchangeRateService(fetcher=fetch_rate)
+        try:
+            async with get_async_session() as session:
+                return await SubscriptionService(session).create_subscription(telegram_id, "Петр", "Петров")
+        finally:
+            exchange_rate._exchange_rate_service = None
+
+    async def test_invoice_is_saved_as_pending_payment(self):
+        _, subscription, payment = await self._issue_invoice(2002)
+        self.assertEqual(subscription.status, SubscriptionStatus.PAUSED)
+        self.assertEqual(payment.amount_nanoton, 10_000_000_000)
+        async with get_async_session() as session:
+            service = SubscriptionService(session)
+            stored = await service.get_payment(payment.memo)
+            self.assertEqual(stored.status, PaymentStatus.PENDING)
+            self.assertEqual(stored.subscription_id, subscription.id)
+            # Неоплаченный счет не делает подписку активной
+            self.assertIsNone(await service.get_user_subscription(2002))
+        # Повторный счет до оплаты относится к той же подписке
+        _, again, second = await self._issue_invoice(2002)
+        self.assertEqual(again.id, subscription.id)
+        self.assertNotEqual(second.memo, payment.memo)
+
+    async def test_invoice_renews_active_subscription(self):
+        _, subscription, payment = await self._issue_invoice(1001)
+        self.assertEqual(subscription.id, self.subscription.id)
+        self.assertEqual(subscription.status, SubscriptionStatus.ACTIVE)
+        self.assertEqual(payment.status, PaymentStatus.PENDING)
+
+
+class TestWebApiAsync(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        from database.models import Apartment
+        from services.catalog_cache import get_catalog_cache
+        from web.main import app
+        await create_schema_async()
+        async with get_async_session() as session:
+            session.add(Apartment(city="Пхукет", address="Пляж Ката, 1", apartment_type="Base"))
+            await session.commit()
+        get_catalog_cache().invalidate()
+        self.client = httpx.AsyncClient(app=app, base_url="http://test")
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        await dispose_async_engine()
+
+    async def test_get_apartments(self):
+        response = await self.client.get("/api/apartments/Пхукет")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([a['address'] for a in response.json()], ["Пляж Ката, 1"])
+
+    async def test_catalog_version_bump_refreshes_cache(self):
+        from database.catalog import bump_catalog_version
+        from database.models import Apartment
+        from services.catalog_cache import get_catalog_cache
+        catalog_cache = get_catalog_cache()
+        await catalog_cache.warm()
+        self.assertFalse(await catalog_cache.check_version())
+
+        async with get_async_session() as session:
+            session.add(Apartment(city="Пхукет", address="Пляж Карон, 2", apartment_type="Standard"))
+            await session.run_sync(bump_catalog_version)
+            await session.commit()
+
+        self.assertTrue(await catalog_cache.check_version())
+        city_catalog = await catalog_cache.get_city("Пхукет")
+        self.assertEqual(len(city_catalog.apartments), 2)
+        self.assertIn("Пляж Ката, 1", city_catalog.offer_text)
+
+    async def test_get_unknown_user(self):
+        response = await self.client.get("/api/user/42")
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,248 @@
+import logging
+import time
+from datetime import date, datetime, timedelta
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+import numpy as np
+from sqlalchemy import insert
+
+from database.migrations import create_schema_async, dispose_async_engine, get_async_session
+from database.models import Apartment, Booking, User
+from services.availability import AvailabilityEngine, AvailabilityMatrix, OccupancyCalendar, upcoming_months
+
+logger = logging.getLogger(__name__)
+
+TODAY = date(2026, 10, 17)
+
+
+def day(offset: int) -> date:
+    return TODAY + timedelta(days=offset)
+
+
+class TestOccupancyCalendar(TestCase):
+    def setUp(self):
+        self.calendar = OccupancyCalendar()
+        # Занято: [0, 5), [10, 20), [24, 40)
+        self.calendar.add(1, day(0), day(5))
+        self.calendar.add(2, day(24), day(40))
+        self.calendar.add(3, day(10), day(20))
+
+    def test_earliest_free_skips_short_gaps(self):
+        until = day(365)
+        self.assertEqual(self.calendar.earliest_free(TODAY, 5, until), day(5))
+        # Промежутки [5, 10) и [20, 24) короче 7 ночей
+        self.assertEqual(self.calendar.earliest_free(TODAY, 7, until), day(40))
+        self.assertEqual(self.calendar.earliest_free(day(12), 4, until), day(20))
+        self.assertIsNone(self.calendar.earliest_free(TODAY, 7, day(46)))
+
+    def test_is_free(self):
+        self.assertTrue(self.calendar.is_free(day(5), day(10)))
+        self.assertTrue(self.calendar.is_free(day(20), day(24)))
+        self.assertFalse(self.calendar.is_free(day(4), day(6)))
+        self.assertFalse(self.calendar.is_free(day(19), day(21)))
+        self.assertFalse(self.calendar.is_free(day(6), day(30)))
+
+    def test_overlapping_and_removed_bookings(self):
+        self.calendar.add(4, day(3), day(12))
+        self.assertEqual(self.calendar.earliest_free(TODAY, 4, day(365)), day(20))
+        self.assertTrue(self.calendar.remove(4))
+        self.assertFalse(self.calendar.remove(4))
+        self.assertEqual(self.calendar.earliest_free(TODAY, 4, day(365)), day(5))
+
+    def test_move_and_replace(self):
+        self.assertEqual(self.calendar.add(2, day(22), day(30)), (day(24), day(40)))
+        self.assertEqual(self.calendar.get(2), (day(22), day(30)))
+        self.assertEqual(self.calendar.earliest_free(day(20), 7, day(365)), day(30))
+        self.calendar.replace([(5, day(2), day(8)), (6, day(6), day(9))])
+        self.assertEqual(len(self.calendar), 2)
+        self.assertIsNone(self.calendar.get(1))
+        self.assertEqual(self.calendar.earliest_free(TODAY, 7, day(365)), day(9))
+
+
+class FakeBooking:
+    def __init__(self, booking_id, apartment_id, start, end, status='confirmed'):
+        self.id, self.apartment_id = booking_id, apartment_id
+        self.start_date, self.end_date, self.status = start, end, status
+
+
+class TestAvailabilityEngine(TestCase):
+    def setUp(self):
+        self.engine = AvailabilityEngine(horizon_days=365)
+        self.engine.load(
+            [(1, 'Пхукет'), (2, 'Пхукет'), (3, 'Самуи')],
+            [
+                # Пхукет полностью занят до конца ноября
+                (1, 1, day(-3), date(2026, 12, 1)),
+                (2, 2, day(0), date(2026, 11, 20)),
+                (3, 2, date(2026, 11, 22), date(2026, 12, 3)),
+            ]
+        )
+
+    def test_earliest_start_by_city(self):
+        self.assertEqual(self.engine.earliest_start('Пхукет', nights=7, today=TODAY), date(2026, 12, 1))
+        self.assertEqual(self.engine.earliest_start('Самуи', nights=7, today=TODAY), TODAY)
+        self.assertEqual(self.engine.earliest_start(nights=7, today=TODAY), TODAY)
+        self.assertIsNone(self.engine.earliest_start('Краби', nights=7, today=TODAY))
+
+    def test_months_with_capacity(self):
+        months = self.engine.months_with_capacity('Пхукет', nights=7, months=4, today=TODAY)
+        self.assertEqual(months, [(2026, 12), (2027, 1)])
+
+    def test_incremental_updates_invalidate_cache(self):
+        self.assertEqual(self.engine.earliest_start('Самуи', nights=7, today=TODAY), TODAY)
+        booking = FakeBooking(10, 3, datetime(2026, 10, 17), datetime(2026, 10, 30))
+        self.engine.booking_created(booking)
+        self.assertEqual(self.engine.earliest_start('Самуи', nights=7, today=TODAY), date(2026, 10, 30))
+        self.assertFalse(self.engine.is_free(3, day(1), day(8)))
+
+        self.engine.booking_cancelled(booking)
+        self.assertEqual(self.engine.earliest_start('Самуи', nights=7, today=TODAY), TODAY)
+        # Бронирование квартиры Пхукета не сбрасывает закешированный ответ по Самуи
+        self.engine.booking_created(FakeBooking(11, 1, date(2026, 12, 1), date(2026, 12, 20)))
+        self.assertEqual(self.engine.earliest_start('Пхукет', nights=7, today=TODAY), date(2026, 12, 3))
+
+    def test_queries_take_microseconds(self):
+        apartments = [(i, f'city_{i % 6}') for i in range(1, 601)]
+        # У каждой квартиры бронирования через день длиной 6 ночей и одно окно на 7 ночей
+        bookings = []
+        for apartment_id, _ in apartments:
+            offset = apartment_id % 60
+            for week in range(0, 52):
+                start = day(offset + week * 7)
+                bookings.append((len(bookings) + 1, apartment_id, start, start + timedelta(days=6)))
+        engine = AvailabilityEngine(horizon_days=730)
+        engine.load(apartments, bookings)
+
+        started = time.perf_counter()
+        first = engine.earliest_start('city_3', nights=7, today=TODAY)
+        cold = time.perf_counter() - started
+        started = time.perf_counter()
+        for _ in range(1000):
+            engine.earliest_start('city_3', nights=7, today=TODAY)
+        warm = (time.perf_counter() - started) / 1000
+        self.assertIsNotNone(first)
+        self.assertLess(cold, 0.05)
+        self.assertLess(warm, 50e-6)
+
+
+class TestAvailabilityMatrix(TestCase):
+    def setUp(self):
+        self.engine = AvailabilityEngine(horizon_days=120)
+        self.engine.load(
+            [(1, 'Пхукет'), (2, 'Самуи'), (3, 'Пхукет')],
+            [(1, 1, date(2026, 10, 20), date(2026, 11, 3))],
+            today=TODAY
+        )
+
+    def test_free_nights_by_month_and_city(self):
+        by_month = self.engine.free_nights_by_month('Пхукет', months=3, today=TODAY)
+        # Октябрь с 17-го: 15 ночей x 2 квартиры, 12 заняты; ноябрь: 30 x 2, 2 заняты
+        self.assertEqual(by_month, {(2026, 10): 18, (2026, 11): 58, (2026, 12): 62})
+        self.assertEqual(self.engine.free_nights_by_city(2026, 10, today=TODAY), {'Пхукет': 18, 'Самуи': 15})
+        self.assertEqual(self.engine.free_nights_by_month('Краби', months=1, today=TODAY), {(2026, 10): 0})
+
+    def test_incremental_updates_match_rebuild(self):
+        overlapping = FakeBooking(2, 1, datetime(2026, 11, 1), datetime(2026, 11, 10))
+        self.engine.booking_created(overlapping)
+        self.engine.booking_created(FakeBooking(3, 2, datetime(2026, 12, 30), datetime(2027, 3, 1)))
+        self.engine.booking_cancelled(FakeBooking(1, 1, None, None))
+        # Перенос дат бронирования
+        self.engine.booking_created(FakeBooking(3, 2, datetime(2027, 1, 5), datetime(2027, 1, 12)))
+
+        rebuilt = AvailabilityMatrix([(1, 'Пхукет'), (2, 'Самуи'), (3, 'Пхукет')], TODAY, 120)
+        rebuilt.load_bookings([(1, date(2026, 11, 1), date(2026, 11, 10)), (2, date(2027, 1, 5), date(2027, 1, 12))])
+        self.assertTrue(np.array_equal(self.engine._matrix.occupancy, rebuilt.occupancy))
+        self.assertTrue(np.array_equal(self.engine._matrix.city_free, rebuilt.city_free))
+
+    def test_upcoming_months_wrap_year(self):
+        self.assertEqual(upcoming_months(date(2026, 11, 30), 3), [(2026, 11), (2026, 12), (2027, 1)])
+
+
+class TestAvailabilityMatrixBenchmark(TestCase):
+    """Тысячи квартир на два года вперед: запросы меню и изменения бронирований быстрее миллисекунды"""
+
+    APARTMENTS = 5000
+    HORIZON_DAYS = 730
+
+    @classmethod
+    def setUpClass(cls):
+        cities = ["Пхукет", "Бангкок", "Паттайя", "Самуи", "Пхи-Пхи", "Краби"]
+        apartments = [(i, cities[i % len(cities)]) for i in range(1, cls.APARTMENTS + 1)]
+        bookings = []
+        for apartment_id, _ in apartments:
+            for week in range(apartment_id % 5, cls.HORIZON_DAYS // 7, 5):
+                start = day(week * 7)
+                bookings.append((len(bookings) + 1, apartment_id, start, start + timedelta(days=7)))
+        cls.engine = AvailabilityEngine(horizon_days=cls.HORIZON_DAYS)
+        started = time.perf_counter()
+        cls.engine.load(apartments, bookings, today=TODAY)
+        cls.load_seconds = time.perf_counter() - started
+
+    @staticmethod
+    def median_seconds(fn, runs: int = 200) -> float:
+        timings = []
+        for i in range(runs):
+            started = time.perf_counter()
+            fn(i)
+            timings.append(time.perf_counter() - started)
+        return sorted(timings)[runs // 2]
+
+    def test_benchmark(self):
+        by_month = self.median_seconds(lambda i: self.engine.free_nights_by_month('Самуи', today=TODAY))
+        by_city = self.median_seconds(lambda i: self.engine.free_nights_by_city(2027, 2, today=TODAY))
+        booking = self.median_seconds(lambda i: self.engine.booking_created(
+            FakeBooking(10 ** 6 + i, i % self.APARTMENTS + 1, day(400 + i % 30), day(407 + i % 30))
+        ))
+        cancel = self.median_seconds(lambda i: self.engine.booking_cancelled(
+            FakeBooking(10 ** 6 + i, i % self.APARTMENTS + 1, None, None)
+        ))
+        logger.debug(
+            f"{self.APARTMENTS} квартир x {self.HORIZON_DAYS} дней: загрузка {self.load_seconds * 1000:.0f} мс, "
+            f"месяцы города {by_month * 1e6:.0f} мкс, города месяца {by_city * 1e6:.0f} мкс, "
+            f"бронирование {booking * 1e6:.0f} мкс, отмена {cancel * 1e6:.0f} мкс"
+        )
+        for seconds in (by_month, by_city, booking, cancel):
+            self.assertLess(seconds, 0.001)
+
+
+class TestAvailabilityReload(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await create_schema_async()
+        async with get_async_session() as session:
+            session.add(User(id=1, telegram_id=1, first_name='Иван', last_name='Иванов'))
+            await session.execute(insert(Apartment), [
+                {'id': 1, 'city': 'Пхукет', 'address': 'Адрес 1'},
+                {'id': 2, 'city': 'Пхукет', 'address': 'Адрес 2', 'status': 'maintenance'},
+            ])
+            await session.execute(insert(Booking), [
+                {'id': 1, 'user_id': 1, 'apartment_id': 1, 'start_date': datetime(2026, 10, 10),
+                 'end_date': datetime(2026, 10, 25), 'nights_used': 15, 'status': 'confirmed'},
+                {'id': 2, 'user_id': 1, 'apartment_id': 1, 'start_date': datetime(2026, 10, 25),
+                 'end_date': datetime(2026, 11, 5), 'nights_used': 11, 'status': 'cancelled'},
+                {'id': 3, 'user_id': 1, 'apartment_id': 1, 'start_date': datetime(2026, 9, 1),
+                 'end_date': datetime(2026, 9, 10), 'nights_used': 9, 'status': 'confirmed'},
+            ])
+            await session.commit()
+
+    async def asyncTearDown(self):
+        await dispose_async_engine()
+
+    async def test_reload_reads_future_bookings_of_available_apartments(self):
+        engine = AvailabilityEngine()
+        await engine.reload(today=TODAY)
+        self.assertEqual(engine.earliest_start('Пхукет', nights=7, today=TODAY), date(2026, 10, 25))
+        self.assertFalse(engine.is_free(2, day(30), day(40)))
+
+    async def test_bookings_during_reload_are_kept(self):
+        engine = AvailabilityEngine()
+        fetch = engine._fetch
+
+        async def fetch_then_book(today):
+            result = await fetch(today)
+            # Бронирование сохранено после чтения календарей из БД
+            engine.booking_created(FakeBooking(4, 1, datetime(2026, 10, 25), datetime(2026, 11, 10)))
+            return result
+
+        engine._fetch = fetch_then_book
+        await engine.reload(today=TODAY)
+        self.assertEqual(engine.earliest_start('Пхукет', nights=7, today=TODAY), date(2026, 11, 10))
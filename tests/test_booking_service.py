@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+from unittest import IsolatedAsyncioTestCase
+
+from sqlalchemy import insert, select
+
+from database.migrations import create_schema_async, dispose_async_engine, get_async_engine, get_async_session
+from database.models import Apartment, Booking, Subscription, SubscriptionStatus, User
+from services.availability import AvailabilityEngine
+from services.booking_service import (
+    BookingError, BookingService, DatesUnavailable, InvalidBookingDates, NotEnoughNights
+)
+
+logger = logging.getLogger(__name__)
+
+START = datetime(2027, 2, 1)
+
+
+class TestBookingService(IsolatedAsyncioTestCase):
+    """Бронирования через файловую БД: у каждого бронирующего свое соединение и своя транзакция"""
+
+    USERS = 80
+    APARTMENTS = 10
+    NIGHTS = 21
+
+    async def asyncSetUp(self):
+        await dispose_async_engine()
+        self.tmpdir = tempfile.mkdtemp()
+        get_async_engine(f"sqlite:///{os.path.join(self.tmpdir, 'bookings.db')}")
+        await create_schema_async()
+        async with get_async_session() as session:
+            await session.execute(insert(User), [
+                {'id': i, 'telegram_id': 1000 + i, 'first_name': 'Иван', 'last_name': f'Тестов{i}',
+                 'current_nights': self.NIGHTS}
+                for i in range(1, self.USERS + 1)
+            ])
+            await session.execute(insert(Subscription), [
+                {'id': i, 'user_id': i, 'start_date': START - timedelta(days=300), 'status': SubscriptionStatus.ACTIVE,
+                 'accumulated_nights': self.NIGHTS, 'amount_rub': 3000.0, 'amount_ton': 10.0}
+                for i in range(1, self.USERS + 1)
+            ])
+            await session.execute(insert(Apartment), [
+                {'id': i, 'city': 'Пхукет', 'address': f'Адрес {i}', 'apartment_type': 'Base' if i == 1 else 'Standard'}
+                for i in range(1, self.APARTMENTS + 1)
+            ])
+            await session.commit()
+        self.availability = AvailabilityEngine(horizon_days=730)
+        await self.availability.reload(today=START.date() - timedelta(days=10))
+
+    async def asyncTearDown(self):
+        await dispose_async_engine()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    async def book(self, user_id: int, apartment_id: int, start: datetime, nights: int = 7):
+        """Бронирование в отдельной сессии, как в обработчике бота. Возвращает бронирование или ошибку"""
+        async with get_async_session() as session:
+            service = BookingService(session, availability=self.availability, max_attempts=20)
+            try:
+                return await service.create_booking(user_id, apartment_id, start, start + timedelta(days=nights))
+            except BookingError as e:
+                return e
+
+    async def assert_consistent(self):
+        """Нет пересекающихся бронирований, ночи списаны ровно за подтвержденные бронирования"""
+        async with get_async_session() as session:
+            bookings = (await session.execute(
+                select(Booking.apartment_id, Booking.user_id, Booking.start_date, Booking.end_date, Booking.nights_used)
+                .where(Booking.status == 'confirmed')
+                .order_by(Booking.apartment_id, Booking.start_date)
+            )).all()
+            nights = dict((await session.execute(select(Subscription.user_id, Subscription.accumulated_nights))).all())
+            current_nights = dict((await session.execute(select(User.id, User.current_nights))).all())
+        for previous, current in zip(bookings, bookings[1:]):
+            if previous.apartment_id == current.apartment_id:
+                self.assertLessEqual(previous.end_date, current.start_date, f"двойное бронирование {previous} {current}")
+        used = {}
+        for booking in bookings:
+            used[booking.user_id] = used.get(booking.user_id, 0) + booking.nights_used
+        for user_id, remaining in nights.items():
+            self.assertEqual(remaining, self.NIGHTS - used.get(user_id, 0), user_id)
+            self.assertEqual(current_nights[user_id], remaining, user_id)
+        return bookings
+
+    async def test_peak_month_race_for_base_apartment(self):
+        results = await asyncio.gather(*(self.book(user_id, 1, START) for user_id in range(1, self.USERS + 1)))
+
+        winners = [r for r in results if isinstance(r, Booking)]
+        self.assertEqual(len(winners), 1)
+        self.assertTrue(all(isinstance(r, DatesUnavailable) for r in results if not isinstance(r, Booking)))
+        bookings = await self.assert_consistent()
+        self.assertEqual(len(bookings), 1)
+        self.assertFalse(self.availability.is_free(1, START, START + timedelta(days=7)))
+
+    async def test_stress_many_bookers(self):
+        rng = random.Random(17)
+        attempts = [
+            (user_id, rng.randint(1, self.APARTMENTS), START + timedelta(days=rng.randint(0, 60)), rng.choice([7, 7, 10, 14]))
+            for user_id in range(1, self.USERS + 1) for _ in range(2)
+        ]
+        started = time.perf_counter()
+        results = await asyncio.gather(*(self.book(*attempt) for attempt in attempts))
+        elapsed = time.perf_counter() - started
+
+        confirmed = sum(isinstance(r, Booking) for r in results)
+        rejected = {type(r).__name__: 0 for r in results if not isinstance(r, Booking)}
+        for r in results:
+            if not isinstance(r, Booking):
+                rejected[type(r).__name__] += 1
+        logger.debug(
+            f"{len(attempts)} попыток бронирования за {elapsed:.2f} с ({len(attempts) / elapsed:.0f} в секунду): "
+            f"подтверждено {confirmed}, отклонено {rejected}"
+        )
+        self.assertGreater(confirmed, self.APARTMENTS)
+        self.assertNotIn('BookingConflict', rejected)
+        bookings = await self.assert_consistent()
+        self.assertEqual(len(bookings), confirmed)
+
+        # Календари в памяти совпадают с перечитанными из БД
+        reloaded = AvailabilityEngine(horizon_days=730)
+        await reloaded.reload(today=START.date() - timedelta(days=10))
+        for apartment_id in range(1, self.APARTMENTS + 1):
+            for offset in range(0, 70, 3):
+                day = START + timedelta(days=offset)
+                self.assertEqual(
+                    self.availability.is_free(apartment_id, day, day + timedelta(days=1)),
+                    reloaded.is_free(apartment_id, day, day + timedelta(days=1))
+                )
+
+    async def test_rejects_invalid_requests(self):
+        self.assertIsInstance(await self.book(1, 1, START, nights=3), InvalidBookingDates)
+        self.assertIsInstance(await self.book(1, 1, START, nights=self.NIGHTS + 1), NotEnoughNights)
+        self.assertIsInstance(await self.book(1, 999, START), DatesUnavailable)
+        await self.assert_consistent()
+
+    async def test_cancel_returns_nights_and_frees_dates(self):
+        booking = await self.book(1, 2, START, nights=14)
+        self.assertIsInstance(await self.book(2, 2, START + timedelta(days=7)), DatesUnavailable)
+
+        async with get_async_session() as session:
+            service = BookingService(session, availability=self.availability)
+            self.assertTrue(await service.cancel_booking(booking.id))
+            self.assertFalse(await service.cancel_booking(booking.id))
+        self.assertTrue(self.availability.is_free(2, START, START + timedelta(days=14)))
+        self.assertIsInstance(await self.book(2, 2, START + timedelta(days=7)), Booking)
+        await self.assert_consistent()
+
+    async def test_cancel_refunds_the_charged_subscription(self):
+        booking = await self.book(3, 2, START, nights=7)
+        self.assertEqual(booking.subscription_id, 3)
+        # Подписка, с которой списаны ночи, отменена, и пользователь оформил новую
+        async with get_async_session() as session:
+            (await session.get(Subscription, 3)).status = SubscriptionStatus.CANCELLED
+            session.add(Subscription(id=500, user_id=3, start_date=START, status=SubscriptionStatus.ACTIVE,
+                                     accumulated_nights=0, amount_rub=3000.0, amount_ton=10.0))
+            await session.commit()
+
+        async with get_async_session() as session:
+            self.assertTrue(await BookingService(session, availability=self.availability).cancel_booking(booking.id))
+        async with get_async_session() as session:
+            nights = dict((await session.execute(
+                select(Subscription.id, Subscription.accumulated_nights).where(Subscription.user_id == 3)
+            )).all())
+        self.assertEqual(nights, {3: self.NIGHTS, 500: 0})
@@ -0,0 +1,138 @@
+from datetime import datetime
+from unittest import IsolatedAsyncioTestCase
+
+from sqlalchemy import func, insert, select
+from telegram.error import Forbidden
+
+from database.migrations import create_schema_async, dispose_async_engine, get_async_session
+from database.models import BroadcastCampaign, BroadcastDelivery, Subscription, SubscriptionStatus, User
+from services.broadcast import CANCELLED, COMPLETED, RUNNING, BroadcastRunner, create_campaign
+from services.message_queue import OutboundMessageQueue
+from test_message_queue import FakeBot
+
+
+class TestBroadcastRunner(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await create_schema_async()
+        self.bot = FakeBot()
+        self.queue = OutboundMessageQueue(bot=self.bot, global_rate=10000, per_chat_interval=0)
+        self.queue.start()
+        # 50 пользователей: у четных активная подписка, у каждого пятого - 10 ночей
+        async with get_async_session() as session:
+            await session.execute(insert(User), [
+                {'id': i, 'telegram_id': 1000 + i, 'first_name': 'Иван', 'last_name': f'Тестов{i}',
+                 'referrer_id': 1 if i % 10 == 3 else None}
+                for i in range(1, 51)
+            ])
+            await session.execute(insert(Subscription), [
+                {'user_id': i, 'start_date': datetime.utcnow(), 'status': SubscriptionStatus.ACTIVE,
+                 'accumulated_nights': 10 if i % 5 == 0 else 1, 'amount_rub': 3000.0, 'amount_ton': 10.0}
+                for i in range(2, 51, 2)
+            ])
+            await session.commit()
+
+    async def asyncTearDown(self):
+        self.queue._runner.cancel()
+        await dispose_async_engine()
+
+    async def new_campaign(self, segment='all', param=None) -> BroadcastCampaign:
+        async with get_async_session() as session:
+            return await create_campaign(session, 'Новые туры!', segment, param)
+
+    async def deliveries(self, campaign_id: int) -> list:
+        async with get_async_session() as session:
+            result = await session.execute(
+                select(BroadcastDelivery.user_id, BroadcastDelivery.status)
+                .where(BroadcastDelivery.campaign_id == campaign_id)
+                .order_by(BroadcastDelivery.user_id)
+            )
+            return result.all()
+
+    async def test_segments(self):
+        expected = {
+            ('all', None): 50,
+            ('active_subscribers', None): 25,
+            ('vacation_ready', None): 5,  # по умолчанию MIN_NIGHTS_FOR_VACATION = 7
+            ('vacation_ready', 1): 25,
+            ('referrals', 1): 5,
+        }
+        runner = BroadcastRunner(queue=self.queue, page_size=7)
+        for (segment, param), count in expected.items():
+            campaign = await self.new_campaign(segment, param)
+            recipients = [row async for page in runner.stream_recipients(campaign) for row in page]
+            self.assertEqual(len(recipients), count, segment)
+            self.assertEqual(recipients, sorted(recipients))
+
+    async def test_unknown_segment(self):
+        with self.assertRaises(ValueError):
+            await self.new_campaign('vip')
+        with self.assertRaises(ValueError):
+            await self.new_campaign('referrals')
+
+    async def test_run_sends_each_recipient_once(self):
+        self.bot.errors[1000 + 4] = [Forbidden('bot was blocked by the user')]
+        campaign = await self.new_campaign('active_subscribers')
+        runner = BroadcastRunner(queue=self.queue, page_size=10)
+        result = await runner.run_campaign(campaign.id)
+
+        self.assertEqual(result.status, COMPLETED)
+        chat_ids = [chat_id for chat_id, _, _ in self.bot.sent]
+        self.assertEqual(sorted(chat_ids), [1000 + i for i in range(2, 51, 2) if i != 4])
+        deliveries = await self.deliveries(campaign.id)
+        self.assertEqual(len(deliveries), 25)
+        self.assertIn((4, 'failed'), deliveries)
+        async with get_async_session() as session:
+            stored = await session.get(BroadcastCampaign, campaign.id)
+            self.assertEqual((stored.status, stored.sent_count, stored.failed_count), (COMPLETED, 24, 1))
+            self.assertEqual(stored.last_user_id, 50)
+            self.assertIsNotNone(stored.finished_at)
+
+        # Повторный запуск завершенной рассылки ничего не отправляет
+        await runner.run_pending()
+        self.assertEqual(len(self.bot.sent), 24)
+
+    async def test_resume_after_crash(self):
+        campaign = await self.new_campaign('all')
+        # Процесс упал посреди третьей страницы: контрольная точка после второй,
+        # часть третьей страницы уже отправлена и записана
+        async with get_async_session() as session:
+            stored = await session.get(BroadcastCampaign, campaign.id)
+            stored.status = RUNNING
+            stored.last_user_id = 20
+            stored.sent_count = 20
+            await session.execute(insert(BroadcastDelivery), [
+                {'campaign_id': campaign.id, 'user_id': i, 'status': 'sent'} for i in range(1, 26)
+            ])
+            await session.commit()
+
+        runner = BroadcastRunner(queue=self.queue, page_size=10)
+        self.assertEqual(await runner.run_pending(), 1)
+
+        self.assertEqual(sorted(chat_id for chat_id, _, _ in self.bot.sent), [1000 + i for i in range(26, 51)])
+        self.assertEqual(len(await self.deliveries(campaign.id)), 50)
+        async with get_async_session() as session:
+            stored = await session.get(BroadcastCampaign, campaign.id)
+            self.assertEqual((stored.status, stored.sent_count), (COMPLETED, 45))
+
+    async def test_cancelled_campaign_stops_at_page_boundary(self):
+        campaign = await self.new_campaign('all')
+        runner = BroadcastRunner(queue=self.queue, page_size=10)
+        pages = runner.stream_recipients
+
+        async def cancel_after_first_page(campaign, after_user_id=0):
+            async for page in pages(campaign, after_user_id):
+                yield page
+                async with get_async_session() as session:
+                    stored = await session.get(BroadcastCampaign, campaign.id)
+                    stored.status = CANCELLED
+                    await session.commit()
+
+        runner.stream_recipients = cancel_after_first_page
+        result = await runner.run_campaign(campaign.id)
+
+        self.assertEqual(result.status, CANCELLED)
+        self.assertEqual(len(self.bot.sent), 10)
+        async with get_async_session() as session:
+            count = await session.scalar(select(func.count()).select_from(BroadcastDelivery))
+            self.assertEqual(count, 10)
+            self.assertEqual((await session.get(BroadcastCampaign, campaign.id)).status, CANCELLED)
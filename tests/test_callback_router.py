@@ -0,0 +1,135 @@
+import logging
+import re
+import timeit
+from types import SimpleNamespace
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from bot.callback_router import STALE_BUTTON_TEXT, CallbackRouter, InvalidCallbackData
+from bot.handlers import parse_city, parse_month
+
+logger = logging.getLogger(__name__)
+
+
+async def noop(update, context, **params):
+    pass
+
+
+class FakeQuery:
+    def __init__(self, data: str):
+        self.data = data
+        self.from_user = SimpleNamespace(id=42)
+        self.answers = []
+
+    async def answer(self, text=None, show_alert=False):
+        self.answers.append((text, show_alert))
+
+
+def make_router(calls=None) -> CallbackRouter:
+    async def record(update, context, **params):
+        calls.append(params)
+
+    router = CallbackRouter(legacy={"plan_date_choice": "pd", "check_payment": "cp"})
+    router.add("pd", record if calls is not None else noop)
+    router.add("cp", record if calls is not None else noop, answer=False)
+    router.add("m", record if calls is not None else noop, year=int, month=parse_month)
+    router.add("c", record if calls is not None else noop, city=parse_city)
+    return router
+
+
+class TestCallbackRouter(TestCase):
+    def setUp(self):
+        self.router = make_router()
+
+    def test_round_trip(self):
+        route, params = self.router.parse(self.router.encode("m", 2027, 3))
+        self.assertEqual(route.code, "m")
+        self.assertEqual(params, {'year': 2027, 'month': 3})
+
+    def test_last_param_keeps_separators_and_underscores(self):
+        router = CallbackRouter()
+        router.add("q", noop, topic=str, text=str)
+        _, params = router.parse(router.encode("q", "visa", "Пхи_Пхи: остров"))
+        self.assertEqual(params, {'topic': 'visa', 'text': 'Пхи_Пхи: остров'})
+        with self.assertRaises(ValueError):
+            router.encode("q", "a:b", "c")
+
+    def test_invalid_params_rejected(self):
+        for data in ("1:m:2027:13", "1:m:2027", "1:m:x:3", "1:c:Москва", "1:pd:extra", "1:zz", "2:pd", "", None):
+            with self.subTest(data=data), self.assertRaises(InvalidCallbackData):
+                self.router.parse(data)
+
+    def test_legacy_payload(self):
+        route, params = self.router.parse("check_payment")
+        self.assertEqual((route.code, params), ("cp", {}))
+        with self.assertRaises(InvalidCallbackData):
+            self.router.parse("select_month_3")
+
+    def test_encode_respects_telegram_limit(self):
+        with self.assertRaises(ValueError):
+            self.router.encode("c", "Пхукет" * 6)
+
+    def test_duplicate_code_rejected(self):
+        with self.assertRaises(ValueError):
+            self.router.add("pd", noop)
+
+    def test_dispatch_benchmark(self):
+        """Разбор callback_data и поиск обработчика против прежней цепочки regex-обработчиков и if/elif"""
+        legacy_patterns = [re.compile(p) for p in (
+            "^subscribe$", "^check_payment$", "^cancel_subscription$", "^book$", "^month_", "^city_"
+        )]
+        legacy_equal = [
+            "plan_date_choice", "plan_later", None, None,
+            "subscribe_now", "ask_question", "start_over", "back_to_main_menu", "back_to_month_selection"
+        ]
+
+        def legacy_resolve(data):
+            # PTB проверяет обработчики по порядку, затем button_callback_handler идет по цепочке
+            for pattern in legacy_patterns:
+                if pattern.match(data):
+                    return pattern
+            for action in legacy_equal:
+                if action is None:
+                    if data.startswith("select_month_"):
+                        return int(data.split('_')[2])
+                    if data.startswith("select_city_"):
+                        return data.split('_')[2]
+                elif data == action:
+                    return action
+            return None
+
+        router = make_router()
+        for name, legacy, new in (
+            ("последняя ветка", "back_to_month_selection", router.encode("pd")),
+            ("месяц", "select_month_3", router.encode("m", 2027, 3)),
+            ("город", "select_city_Пхукет", router.encode("c", "Пхукет")),
+        ):
+            legacy_time = min(timeit.repeat(lambda: legacy_resolve(legacy), number=20000, repeat=5)) / 20000
+            router_time = min(timeit.repeat(lambda: router.parse(new), number=20000, repeat=5)) / 20000
+            logger.debug(f"{name}: цепочка {legacy_time * 1e6:.2f} мкс, маршрутизатор {router_time * 1e6:.2f} мкс")
+            self.assertLess(router_time, 50e-6)
+
+
+class TestCallbackDispatch(IsolatedAsyncioTestCase):
+    async def test_dispatch_answers_and_passes_params(self):
+        calls = []
+        router = make_router(calls)
+        query = FakeQuery(router.encode("m", 2027, 3))
+        await router.dispatch(SimpleNamespace(callback_query=query), None)
+        self.assertEqual(calls, [{'year': 2027, 'month': 3}])
+        self.assertEqual(query.answers, [(None, False)])
+
+    async def test_handler_answers_itself(self):
+        calls = []
+        router = make_router(calls)
+        query = FakeQuery("check_payment")
+        await router.dispatch(SimpleNamespace(callback_query=query), None)
+        self.assertEqual(calls, [{}])
+        self.assertEqual(query.answers, [])
+
+    async def test_stale_button_gets_alert(self):
+        calls = []
+        router = make_router(calls)
+        query = FakeQuery("1:m:2027:13")
+        await router.dispatch(SimpleNamespace(callback_query=query), None)
+        self.assertEqual(calls, [])
+        self.assertEqual(query.answers, [(STALE_BUTTON_TEXT, True)])
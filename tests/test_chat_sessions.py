@@ -0,0 +1,130 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from services.chat_sessions import ChatSessionManager
+from services.gemini_service import GeminiService
+from test_gemini_streaming import FakeStreamingModel
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestChatSessionManager(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.clock = FakeClock()
+        self.summaries = []
+
+        async def summarizer(summary, turns):
+            self.summaries.append(turns)
+            return summary + "|" + ",".join(question for question, _ in turns)
+
+        self.sessions = ChatSessionManager(max_turns=4, ttl=60, max_bytes=10_000, summarizer=summarizer, clock=self.clock)
+
+    async def test_history_window_and_summary(self):
+        for i in range(1, 8):
+            await self.sessions.record(1, f"q{i}", f"a{i}")
+        history = self.sessions.get(1)
+        # При переполнении окна свернуты сразу две реплики (половина окна)
+        self.assertEqual([[q for q, _ in turns] for turns in self.summaries], [["q1", "q2"], ["q3", "q4"]])
+        self.assertEqual([q for q, _ in history.turns], ["q5", "q6", "q7"])
+        contents = history.contents("q8")
+        self.assertIn("q1,q2|q3,q4", contents[0]['parts'][0])
+        self.assertEqual(len(contents), 2 + 2 * 3 + 1)
+        self.assertEqual(contents[-1], {'role': 'user', 'parts': ["q8"]})
+
+    async def test_users_do_not_share_context(self):
+        await self.sessions.record(1, "секрет первого", "a")
+        contents = self.sessions.get(2).contents("вопрос второго")
+        self.assertEqual(contents, [{'role': 'user', 'parts': ["вопрос второго"]}])
+
+    async def test_ttl_eviction(self):
+        await self.sessions.record(1, "q", "a")
+        self.clock.now = 30
+        await self.sessions.record(2, "q", "a")
+        self.clock.now = 61
+        self.sessions.get(3)
+        # Разговор 1 не использовался дольше ttl, разговор 2 - еще нет
+        self.assertEqual(len(self.sessions), 2)
+        self.assertEqual(len(self.sessions.get(1).turns), 0)
+        self.assertEqual(self.sessions.stats()['evicted'], 1)
+
+    async def test_memory_budget_evicts_least_recently_used(self):
+        self.sessions.max_bytes = 650
+        for user_id in range(1, 4):
+            await self.sessions.record(user_id, "в" * 50, "о" * 50)
+        # Пользователь 1 снова активен, поэтому вытесняется пользователь 2
+        self.sessions.get(1)
+        await self.sessions.record(4, "в" * 50, "о" * 50)
+        self.assertEqual(set(self.sessions._sessions), {3, 1, 4})
+        self.assertLessEqual(self.sessions.total_bytes, 650)
+        self.assertEqual(self.sessions.total_bytes, sum(h.size for h in self.sessions._sessions.values()))
+
+    async def test_summarizer_failure_falls_back_to_truncation(self):
+        async def broken(summary, turns):
+            raise RuntimeError("нет связи")
+
+        sessions = ChatSessionManager(max_turns=2, summary_max_chars=40, summarizer=broken, clock=self.clock)
+        for i in range(4):
+            await sessions.record(1, f"вопрос {i}", f"ответ {i}")
+        summary = sessions.get(1).summary
+        self.assertLessEqual(len(summary), 40)
+        self.assertIn("ответ 1", summary)
+
+    async def test_concurrent_folds_keep_every_summary(self):
+        async def slow(summary, turns):
+            await asyncio.sleep(0.01)
+            return summary + "|" + ",".join(question for question, _ in turns)
+
+        sessions = ChatSessionManager(max_turns=2, summarizer=slow, clock=self.clock)
+        await sessions.record(1, "q1", "a1")
+        await sessions.record(1, "q2", "a2")
+        # Обе записи переполняют окно, пока первая свертка еще ждет модель
+        await asyncio.gather(sessions.record(1, "q3", "a3"), sessions.record(1, "q4", "a4"))
+        history = sessions.get(1)
+        self.assertEqual(history.summary, "|q1|q2")
+        self.assertEqual([q for q, _ in history.turns], ["q3", "q4"])
+        self.assertEqual(sessions.total_bytes, history.size)
+
+
+    async def test_turns_stay_visible_while_folding(self):
+        folding = asyncio.Event()
+        release = asyncio.Event()
+
+        async def waiting(summary, turns):
+            folding.set()
+            await release.wait()
+            return summary + "|" + ",".join(question for question, _ in turns)
+
+        sessions = ChatSessionManager(max_turns=2, summarizer=waiting, clock=self.clock)
+        await sessions.record(1, "q1", "a1")
+        await sessions.record(1, "q2", "a2")
+        record = asyncio.create_task(sessions.record(1, "q3", "a3"))
+        await folding.wait()
+        # Пока свертка не готова, вопрос к модели видит все реплики, которые она заменит
+        contents = sessions.get(1).contents("q4")
+        self.assertEqual([c['parts'][0] for c in contents if c['role'] == 'user'], ["q1", "q2", "q3", "q4"])
+        release.set()
+        await record
+        history = sessions.get(1)
+        self.assertEqual(history.summary, "|q1")
+        self.assertEqual([q for q, _ in history.turns], ["q2", "q3"])
+
+
+class TestGeminiService(IsolatedAsyncioTestCase):
+    async def test_each_user_gets_own_bounded_context(self):
+        model = FakeStreamingModel(reply="ответ")
+        service = GeminiService(model=model, sessions=ChatSessionManager(max_turns=2))
+        self.assertEqual(await service.process_user_query(1, "Сколько стоит подписка?"), "ответ")
+        await service.process_user_query(2, "Где квартиры?")
+        await service.process_user_query(1, "А сколько ночей нужно?")
+        # Второй вопрос первого пользователя идет с его первой репликой, без вопроса второго пользователя
+        contents = model.requests[2]
+        self.assertEqual([c['role'] for c in contents], ['user', 'model', 'user'])
+        self.assertEqual(contents[0]['parts'], ["Сколько стоит подписка?"])
+        self.assertNotIn("Где квартиры?", str(contents))
+        self.assertIn("А сколько ночей нужно?", contents[-1]['parts'][0])
@@ -0,0 +1,57 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from sqlalchemy import select
+
+from database.migrations import create_schema_async, dispose_async_engine, get_async_session
+from database.models import ExchangeRate
+from services.exchange_rate import ExchangeRateService, ExchangeRateUnavailable
+
+
+class FakeProvider:
+    def __init__(self, rate: float = 250.0):
+        self.rate = rate
+        self.calls = 0
+        self.fail = False
+
+    async def __call__(self) -> float:
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        if self.fail:
+            raise ConnectionError("провайдер недоступен")
+        return self.rate
+
+
+class TestExchangeRateService(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await create_schema_async()
+        self.provider = FakeProvider()
+
+    async def asyncTearDown(self):
+        await dispose_async_engine()
+
+    async def test_burst_triggers_single_upstream_fetch(self):
+        service = ExchangeRateService(fetcher=self.provider, ttl=60)
+        amounts = await asyncio.gather(*(service.rub_to_ton(3000) for _ in range(50)))
+        self.assertEqual(self.provider.calls, 1)
+        self.assertEqual(set(amounts), {12.0})
+
+        async with get_async_session() as session:
+            history = (await session.execute(select(ExchangeRate))).scalars().all()
+        self.assertEqual([(r.pair, r.rate) for r in history], [("TON/RUB", 250.0)])
+
+    async def test_falls_back_to_last_known_good(self):
+        service = ExchangeRateService(fetcher=self.provider, ttl=0)
+        self.assertEqual(await service.get_rate(), 250.0)
+        self.provider.fail = True
+        self.assertEqual(await service.get_rate(), 250.0)
+
+        # После перезапуска последний курс берется из истории
+        restarted = ExchangeRateService(fetcher=self.provider, ttl=0)
+        self.assertEqual(await restarted.get_rate(), 250.0)
+
+    async def test_unavailable_without_any_rate(self):
+        self.provider.fail = True
+        service = ExchangeRateService(fetcher=self.provider)
+        with self.assertRaises(ExchangeRateUnavailable):
+            await service.get_rate()
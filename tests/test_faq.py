@@ -0,0 +1,149 @@
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from database.migrations import create_schema_async, dispose_async_engine, get_async_session
+from database.models import Apartment
+from services.catalog_cache import CatalogCache
+from services.chat_sessions import ChatSessionManager
+from services.faq import AnswerCache, KnowledgeBase, normalize_question
+from services.gemini_service import GeminiService
+from utils.bm25 import BM25Index, tokenize
+
+from test_gemini_streaming import FakeClock, FakeStreamingModel
+
+
+class TestBM25(TestCase):
+    def test_tokenize_drops_stop_words_and_endings(self):
+        self.assertEqual(tokenize("Какая квартира на Пхукете?"), ["квартир", "пхукет"])
+        self.assertEqual(tokenize("квартиры"), tokenize("квартира"))
+
+    def test_tokenize_stems_english_plurals(self):
+        self.assertEqual(tokenize("2 bedrooms"), tokenize("2 bedroom"))
+        self.assertEqual(tokenize("beaches houses cities"), tokenize("beach house city"))
+        self.assertEqual(tokenize("glass access"), ["glass", "access"])
+
+    def test_rare_terms_rank_higher(self):
+        index = BM25Index([
+            "квартира с бассейном на Пхукете",
+            "квартира в центре Бангкока",
+            "квартира у моря в Паттайе",
+        ])
+        (best, _, coverage), *_ = index.search("квартира с бассейном")
+        self.assertEqual(best, 0)
+        self.assertEqual(coverage, 1.0)
+        # Слово, которое есть во всех документах, почти не влияет на порядок
+        self.assertEqual([doc_id for doc_id, _, _ in index.search("Бангкок квартира")][0], 1)
+        self.assertEqual(index.search("собака"), [])
+        self.assertEqual(index.search("и в на"), [])
+
+
+class TestAnswerCache(TestCase):
+    def test_ttl_and_lru(self):
+        clock = FakeClock()
+        cache = AnswerCache(max_size=2, ttl=10, clock=clock)
+        cache.put("а", "1")
+        cache.put("б", "2")
+        self.assertEqual(cache.get("а"), "1")
+        cache.put("в", "3")
+        # Вытеснена запись, к которой дольше всего не обращались
+        self.assertIsNone(cache.get("б"))
+        clock.now = 10
+        self.assertIsNone(cache.get("а"))
+        self.assertEqual(len(cache), 1)
+
+    def test_normalized_key(self):
+        self.assertEqual(normalize_question("Сколько стоит подписка?"), normalize_question("сколько  стоит ПОДПИСКА"))
+
+
+class KnowledgeBaseTestCase(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await create_schema_async()
+        async with get_async_session() as session:
+            session.add_all([
+                Apartment(city="Пхукет", address="Пляж Ката, 1", apartment_type="Base",
+                          description="Просторная квартира с видом на море", features="бассейн, Wi-Fi"),
+                Apartment(city="Бангкок", address="Сукхумвит, 10", apartment_type="Base",
+                          description="Квартира в центре города", features="спортзал, Wi-Fi"),
+            ])
+            await session.commit()
+        self.catalog = CatalogCache()
+        self.knowledge = KnowledgeBase(catalog=self.catalog)
+
+    async def asyncTearDown(self):
+        await dispose_async_engine()
+
+
+class TestKnowledgeBase(KnowledgeBaseTestCase):
+    async def test_confident_faq_answer(self):
+        answer, source = await self.knowledge.answer("Сколько стоит подписка?", first_turn=True)
+        self.assertEqual(source, 'faq')
+        self.assertIn("руб. в месяц", answer)
+        answer, source = await self.knowledge.answer("Как оплатить?", first_turn=False)
+        self.assertIn("TON", answer)
+
+    async def test_unrelated_question_goes_to_model(self):
+        self.assertEqual(await self.knowledge.answer("Сколько стоит перелет до Бангкока?", first_turn=True), (None, None))
+        self.assertEqual(self.knowledge.snippets("можно ли с собакой"), [])
+
+    async def test_apartment_snippets(self):
+        await self.knowledge.refresh()
+        snippets = self.knowledge.snippets("есть ли квартира с бассейном на Пхукете")
+        self.assertTrue(snippets[0].startswith("Пхукет, Пляж Ката, 1."))
+
+    async def test_index_rebuilt_when_catalog_changes(self):
+        await self.knowledge.refresh()
+        index = self.knowledge._index
+        await self.knowledge.refresh()
+        self.assertIs(self.knowledge._index, index)
+
+        async with get_async_session() as session:
+            session.add(Apartment(city="Паттайя", address="Пратамнак, 5", apartment_type="Base",
+                                  description="Квартира с террасой у залива"))
+            await session.commit()
+        self.catalog.invalidate()
+        await self.knowledge.refresh()
+        self.assertIsNot(self.knowledge._index, index)
+        self.assertTrue(self.knowledge.snippets("квартира с террасой")[0].startswith("Паттайя"))
+
+    async def test_cached_answer_only_for_first_turn(self):
+        self.knowledge.remember("Где лучше отдыхать в мае?", "На Пхукете.")
+        self.assertEqual(await self.knowledge.answer("где лучше отдыхать в мае", first_turn=True), ("На Пхукете.", 'cache'))
+        self.assertEqual(await self.knowledge.answer("где лучше отдыхать в мае", first_turn=False), (None, None))
+
+
+class TestGeminiWithKnowledge(KnowledgeBaseTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.model = FakeStreamingModel(reply="В мае на Пхукете сезон дождей.")
+        self.service = GeminiService(model=self.model, sessions=ChatSessionManager(), knowledge=self.knowledge)
+
+    async def test_faq_answered_without_model(self):
+        answer = await self.service.get_response(1, "Сколько стоит подписка?")
+        self.assertIn("руб. в месяц", answer)
+        self.assertEqual(self.model.requests, [])
+        self.assertEqual([q for q, _ in self.service.sessions.get(1).turns], ["Сколько стоит подписка?"])
+
+    async def test_repeated_first_question_is_cached(self):
+        for user_id in range(1, 5):
+            self.assertEqual(await self.service.get_response(user_id, "Где лучше отдыхать в мае?"), self.model.reply)
+        self.assertEqual(len(self.model.requests), 1)
+        stats = self.service.stats()
+        self.assertEqual(stats['questions'], 4)
+        self.assertEqual(stats['model_calls'], 1)
+        self.assertEqual(stats['cache_hits'], 3)
+        self.assertEqual(stats['cache_hit_rate'], 0.75)
+        self.assertEqual(stats['model_calls_saved_rate'], 0.75)
+
+    async def test_follow_up_question_is_not_served_from_cache(self):
+        await self.service.get_response(1, "Где лучше отдыхать в мае?")
+        await self.service.get_response(2, "Что посмотреть рядом?")
+        await self.service.get_response(1, "Что посмотреть рядом?")
+        self.assertEqual(len(self.model.requests), 3)
+
+    async def test_relevant_snippets_are_added_to_prompt(self):
+        await self.service.get_response(1, "Есть квартира с бассейном на Пхукете?")
+        prompt = self.model.requests[0][-1]['parts'][0]
+        self.assertIn("Справочная информация", prompt)
+        self.assertIn("Пляж Ката, 1", prompt)
+
+        await self.service.get_response(2, "Где лучше отдыхать в мае?")
+        self.assertNotIn("Справочная информация", self.model.requests[1][-1]['parts'][0])
@@ -0,0 +1,263 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from unittest import IsolatedAsyncioTestCase
+
+from telegram.error import BadRequest, RetryAfter
+
+import services.gemini_service as gemini_service
+from bot.assistant_handlers import WAITING_QUESTION, answer_question
+from bot.handlers import ask_question, handle_text, start_over
+from bot.streaming_reply import MESSAGE_MAX_LENGTH, StreamingReply
+from services.chat_sessions import ChatSessionManager
+from services.gemini_service import ERROR_REPLY, GeminiService, GeminiUnavailable
+
+
+class FakeStreamingModel:
+    """
+    Модель с асинхронным API Gemini: ответ делится на фрагменты, между которыми проходит chunk_delay.
+
+    Запоминает переданный контекст и наибольшее число одновременных запросов.
+    """
+
+    def __init__(self, reply: str = "Подписка стоит 3 000 руб. в месяц.", chunk_size: int = 8,
+                 chunk_delay: float = 0.0, first_delay: float = 0.0, fail_after: int = None):
+        self.reply = reply
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.first_delay = first_delay
+        self.fail_after = fail_after
+        self.requests = []
+        self.active = 0
+        self.peak = 0
+
+    def chunks(self):
+        return [self.reply[i:i + self.chunk_size] for i in range(0, len(self.reply), self.chunk_size)]
+
+    async def _stream(self):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.first_delay)
+            for n, chunk in enumerate(self.chunks()):
+                if self.fail_after is not None and n >= self.fail_after:
+                    raise RuntimeError("обрыв соединения")
+                if n:
+                    await asyncio.sleep(self.chunk_delay)
+                yield SimpleNamespace(text=chunk)
+        finally:
+            self.active -= 1
+
+    async def generate_content_async(self, contents, stream: bool = False):
+        self.requests.append(contents)
+        if stream:
+            return self._stream()
+        return SimpleNamespace(text="".join([chunk.text async for chunk in self._stream()]))
+
+
+class FakeMessage:
+    """Сообщение Telegram: reply_text создает новое сообщение, edit_text меняет текст"""
+
+    def __init__(self, text: str = "", log: list = None):
+        self.text = text
+        self.log = log if log is not None else []
+        self.fail_with = None
+
+    async def reply_text(self, text):
+        message = FakeMessage(text, self.log)
+        self.log.append(('send', text, time.monotonic()))
+        return message
+
+    async def edit_text(self, text):
+        if self.fail_with:
+            error, self.fail_with = self.fail_with, None
+            if isinstance(error, BadRequest):
+                # "message is not modified": в сообщении уже этот текст
+                self.text = text
+            raise error
+        self.text = text
+        self.log.append(('edit', text, time.monotonic()))
+
+
+class TestGeminiStreaming(IsolatedAsyncioTestCase):
+    async def test_chunks_arrive_before_full_answer_without_blocking_loop(self):
+        model = FakeStreamingModel(reply="x" * 80, chunk_size=8, chunk_delay=0.05)
+        service = GeminiService(model=model, sessions=ChatSessionManager())
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker_task = asyncio.create_task(ticker())
+        started = time.monotonic()
+        arrivals = [time.monotonic() - started async for _ in service.stream_response(1, "вопрос")]
+        ticker_task.cancel()
+        self.assertEqual(len(arrivals), 10)
+        self.assertLess(arrivals[0], 0.03)
+        self.assertGreater(arrivals[-1], 0.4)
+        # Цикл событий продолжал работать, пока модель генерировала ответ
+        self.assertGreater(ticks, 20)
+        self.assertEqual([q for q, _ in service.sessions.get(1).turns], ["вопрос"])
+
+    async def test_concurrency_cap(self):
+        model = FakeStreamingModel(chunk_delay=0.01)
+        service = GeminiService(model=model, sessions=ChatSessionManager(), max_concurrent=3)
+        answers = await asyncio.gather(*(service.get_response(user_id, "вопрос") for user_id in range(10)))
+        self.assertEqual(answers, [model.reply] * 10)
+        self.assertEqual(model.peak, 3)
+        self.assertEqual(service.in_flight, 0)
+
+    async def test_first_chunk_timeout(self):
+        model = FakeStreamingModel(first_delay=1)
+        service = GeminiService(model=model, sessions=ChatSessionManager(), first_chunk_timeout=0.05)
+        started = time.monotonic()
+        with self.assertRaises(GeminiUnavailable):
+            async for _ in service.stream_response(1, "вопрос"):
+                pass
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(service.stats()['timeouts'], 1)
+        self.assertEqual(len(service.sessions.get(1).turns), 0)
+        self.assertEqual(service.in_flight, 0)
+
+    async def test_response_timeout_after_first_chunk(self):
+        model = FakeStreamingModel(reply="x" * 80, chunk_delay=0.1)
+        service = GeminiService(model=model, sessions=ChatSessionManager(), first_chunk_timeout=0.05, response_timeout=0.25)
+        received = []
+        with self.assertRaises(GeminiUnavailable):
+            async for chunk in service.stream_response(1, "вопрос"):
+                received.append(chunk)
+        self.assertTrue(1 <= len(received) < 10)
+
+    async def test_stream_error_is_not_recorded(self):
+        model = FakeStreamingModel(fail_after=2)
+        service = GeminiService(model=model, sessions=ChatSessionManager())
+        self.assertIsNone(await service.get_response(1, "вопрос"))
+        self.assertEqual(service.stats()['errors'], 1)
+        self.assertEqual(len(service.sessions.get(1).turns), 0)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestStreamingReply(IsolatedAsyncioTestCase):
+    async def test_edits_are_coalesced(self):
+        clock = FakeClock()
+        origin = FakeMessage()
+        reply = StreamingReply(origin, edit_interval=1.0, clock=clock)
+        for i in range(30):
+            clock.now = i * 0.1
+            await reply.append(f"{i} ")
+        await reply.finish()
+        kinds = [kind for kind, _, _ in origin.log]
+        # Первый фрагмент отправлен сразу, дальше не больше правки в секунду, последняя - с полным текстом
+        self.assertEqual(kinds[0], 'send')
+        self.assertEqual(origin.log[0][1], "0 ")
+        self.assertEqual(kinds.count('send'), 1)
+        self.assertLessEqual(kinds.count('edit'), 4)
+        self.assertEqual(reply.messages[0].text, "".join(f"{i} " for i in range(30)))
+
+    async def test_finish_waits_for_interval(self):
+        origin = FakeMessage()
+        reply = StreamingReply(origin, edit_interval=0.1)
+        await reply.append("Привет")
+        await reply.append(", мир")
+        await reply.finish()
+        (_, _, sent_at), (_, text, edited_at) = origin.log
+        self.assertEqual(text, "Привет, мир")
+        self.assertGreaterEqual(edited_at - sent_at, 0.09)
+
+    async def test_long_answer_continues_in_next_message(self):
+        origin = FakeMessage()
+        reply = StreamingReply(origin, edit_interval=0)
+        await reply.append("а" * (MESSAGE_MAX_LENGTH - 10))
+        await reply.append("б" * 20)
+        await reply.finish()
+        self.assertEqual(len(reply.messages), 2)
+        self.assertEqual(len(reply.messages[0].text), MESSAGE_MAX_LENGTH)
+        self.assertEqual(reply.messages[1].text, "б" * 10)
+
+    async def test_flood_wait_and_not_modified_are_tolerated(self):
+        clock = FakeClock()
+        origin = FakeMessage()
+        reply = StreamingReply(origin, edit_interval=1.0, clock=clock)
+        await reply.append("раз")
+        reply.messages[0].fail_with = RetryAfter(5)
+        clock.now = 1.0
+        await reply.append(" два")
+        # Пока действует ожидание, правки не отправляются
+        clock.now = 3.0
+        await reply.append(" три")
+        self.assertEqual(reply.edits, 0)
+        clock.now = 6.0
+        reply.messages[0].fail_with = BadRequest("Message is not modified")
+        await reply.append(" четыре")
+        await reply.finish()
+        self.assertEqual(reply.messages[0].text, "раз два три четыре")
+
+    async def test_final_edit_is_retried_after_flood_wait(self):
+        origin = FakeMessage()
+        reply = StreamingReply(origin, edit_interval=0)
+        await reply.append("раз")
+        reply.messages[0].fail_with = RetryAfter(0.05)
+        started = time.monotonic()
+        await reply.finish(" два")
+        self.assertEqual(reply.messages[0].text, "раз два")
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+        self.assertEqual(reply.edits, 1)
+
+    async def test_full_message_is_retried_after_flood_wait(self):
+        origin = FakeMessage()
+        reply = StreamingReply(origin, edit_interval=0)
+        await reply.append("а" * (MESSAGE_MAX_LENGTH - 10))
+        reply.messages[0].fail_with = RetryAfter(0.01)
+        await reply.append("б" * 20)
+        await reply.finish()
+        self.assertEqual(reply.messages[0].text, "а" * (MESSAGE_MAX_LENGTH - 10) + "б" * 10)
+        self.assertEqual(reply.messages[1].text, "б" * 10)
+
+
+class TestAnswerQuestion(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.origin = FakeMessage("Сколько стоит подписка?")
+        self.update = SimpleNamespace(effective_user=SimpleNamespace(id=42), message=self.origin)
+        self.context = SimpleNamespace(user_data={'state': WAITING_QUESTION})
+
+    async def asyncTearDown(self):
+        gemini_service._gemini_service = None
+
+    async def test_answer_is_streamed_into_chat(self):
+        model = FakeStreamingModel(reply="Подписка стоит 3 000 руб. в месяц.", chunk_size=4)
+        gemini_service._gemini_service = GeminiService(model=model, sessions=ChatSessionManager())
+        await answer_question(self.update, self.context)
+        self.assertEqual(self.origin.log[0][0], 'send')
+        self.assertEqual(self.origin.log[-1][1], model.reply)
+
+    async def test_error_is_appended_to_partial_answer(self):
+        model = FakeStreamingModel(reply="Подписка стоит 3 000 руб. в месяц.", chunk_size=4, fail_after=2)
+        gemini_service._gemini_service = GeminiService(model=model, sessions=ChatSessionManager())
+        await answer_question(self.update, self.context)
+        self.assertEqual(self.origin.log[-1][1], f"Подписка\n\n{ERROR_REPLY}")
+        self.assertNotIn('state', self.context.user_data)
+
+    async def test_question_state_lasts_for_one_answer(self):
+        gemini_service._gemini_service = GeminiService(model=FakeStreamingModel(), sessions=ChatSessionManager())
+        button = SimpleNamespace(callback_query=SimpleNamespace(message=None))
+        context = SimpleNamespace(user_data={})
+        await ask_question(button, context)
+        self.assertEqual(context.user_data['state'], WAITING_QUESTION)
+        await handle_text(self.update, context)
+        self.assertEqual(self.origin.log[-1][1], "Подписка стоит 3 000 руб. в месяц.")
+        # Следующее сообщение уже не вопрос помощнику
+        self.assertNotIn('state', context.user_data)
+
+        await ask_question(button, context)
+        await start_over(button, context)
+        self.assertNotIn('state', context.user_data)
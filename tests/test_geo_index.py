@@ -0,0 +1,173 @@
+import logging
+import random
+import time
+import unittest
+from unittest import IsolatedAsyncioTestCase
+
+import httpx
+
+from database.catalog import bump_catalog_version
+from database.migrations import create_schema_async, dispose_async_engine, get_async_session
+from database.models import Apartment, PointOfInterest
+from services.catalog_cache import CatalogCache
+from services.nearby import NearbySearch, format_nearby_points
+from utils.geo import GeoGrid, distance_km, format_distance
+
+logger = logging.getLogger(__name__)
+
+# Прямоугольник, примерно покрывающий Таиланд
+LAT_RANGE = (5.6, 20.5)
+LON_RANGE = (97.3, 105.7)
+
+APARTMENTS = 50_000
+
+
+def random_points(rng: random.Random, count: int):
+    return [(i, rng.uniform(*LAT_RANGE), rng.uniform(*LON_RANGE)) for i in range(count)]
+
+
+def brute_force(points, lat, lon):
+    return sorted((distance_km(lat, lon, p_lat, p_lon), item) for item, p_lat, p_lon in points)
+
+
+class TestGeoGrid(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rng = random.Random(7)
+        # Половина квартир - в нескольких курортных скоплениях, как в реальном каталоге
+        centers = [(7.88, 98.39), (13.75, 100.5), (12.93, 100.88), (9.51, 100.01)]
+        cls.points = random_points(rng, APARTMENTS // 2)
+        cls.points += [
+            (APARTMENTS // 2 + i, lat + rng.gauss(0, 0.05), lon + rng.gauss(0, 0.05))
+            for i, (lat, lon) in enumerate(rng.choice(centers) for _ in range(APARTMENTS // 2))
+        ]
+        cls.grid = GeoGrid(cell_km=1.0)
+        for item, lat, lon in cls.points:
+            cls.grid.add(item, lat, lon)
+        cls.queries = [(lat, lon) for lat, lon in centers] + [
+            (rng.uniform(*LAT_RANGE), rng.uniform(*LON_RANGE)) for _ in range(20)
+        ]
+
+    def test_distance(self):
+        # Бангкок - Пхукет, около 690 км по прямой
+        self.assertAlmostEqual(distance_km(13.7563, 100.5018, 7.8804, 98.3923), 689, delta=5)
+        self.assertEqual(format_distance(0.347), "350 м")
+        self.assertEqual(format_distance(2.26), "2.3 км")
+
+    def test_within_matches_brute_force(self):
+        for lat, lon in self.queries:
+            expected = [item for distance, item in brute_force(self.points, lat, lon) if distance <= 2.0]
+            found = self.grid.within(lat, lon, 2.0)
+            self.assertEqual([item for item, _ in found], expected)
+
+    def test_nearest_matches_brute_force(self):
+        for lat, lon in self.queries:
+            expected = brute_force(self.points, lat, lon)[:10]
+            found = self.grid.nearest(lat, lon, 10)
+            self.assertEqual([item for item, _ in found], [item for _, item in expected])
+            self.assertAlmostEqual(found[-1][1], expected[-1][0])
+
+    def test_nearest_with_max_distance(self):
+        grid = GeoGrid(cell_km=1.0)
+        grid.add('рядом', 7.8206, 98.2984)
+        grid.add('далеко', 7.9, 98.3)
+        self.assertEqual([item for item, _ in grid.nearest(7.8210, 98.2990, 5, max_distance_km=3)], ['рядом'])
+        self.assertEqual(GeoGrid().nearest(7.82, 98.29, 5), [])
+
+    def test_benchmark_50k(self):
+        rounds = 200
+        started = time.perf_counter()
+        for i in range(rounds):
+            self.grid.within(*self.queries[i % len(self.queries)], 2.0)
+        within_ms = (time.perf_counter() - started) / rounds * 1000
+        started = time.perf_counter()
+        for i in range(rounds):
+            self.grid.nearest(*self.queries[i % len(self.queries)], 10)
+        nearest_ms = (time.perf_counter() - started) / rounds * 1000
+        started = time.perf_counter()
+        for lat, lon in self.queries[:5]:
+            brute_force(self.points, lat, lon)
+        brute_ms = (time.perf_counter() - started) / 5 * 1000
+        logger.debug(f"{APARTMENTS} квартир: радиус 2 км {within_ms:.2f} мс, 10 ближайших {nearest_ms:.2f} мс, "
+                     f"полный перебор {brute_ms:.1f} мс")
+        self.assertLess(within_ms * 10, brute_ms)
+        self.assertLess(nearest_ms * 10, brute_ms)
+
+
+class NearbyTestCase(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await create_schema_async()
+        async with get_async_session() as session:
+            session.add_all([
+                Apartment(city="Пхукет", address="Пляж Ката, 1", apartment_type="Base", latitude=7.8200, longitude=98.3000),
+                Apartment(city="Пхукет", address="Пляж Карон, 2", apartment_type="Standard", latitude=7.8470, longitude=98.2950),
+                Apartment(city="Пхукет", address="Без координат", apartment_type="Standard"),
+                PointOfInterest(city="Пхукет", name="Пляж Ката", latitude=7.8206, longitude=98.2984),
+                PointOfInterest(city="Пхукет", name="Смотровая площадка Карон", latitude=7.8000, longitude=98.3050),
+                PointOfInterest(city="Пхукет", name="Старый город", latitude=7.8850, longitude=98.3880),
+            ])
+            await session.commit()
+        self.catalog = CatalogCache()
+        self.nearby = NearbySearch(catalog=self.catalog)
+
+    async def asyncTearDown(self):
+        await dispose_async_engine()
+
+
+class TestNearbySearch(NearbyTestCase):
+    async def test_apartments_near_point(self):
+        found = await self.nearby.apartments_near(7.8206, 98.2984, radius_km=1)
+        self.assertEqual([apartment['address'] for apartment, _ in found], ["Пляж Ката, 1"])
+        found = await self.nearby.apartments_near(7.8206, 98.2984, limit=5)
+        self.assertEqual([apartment['address'] for apartment, _ in found], ["Пляж Ката, 1", "Пляж Карон, 2"])
+
+    async def test_points_near_apartment(self):
+        base = (await self.catalog.get_city("Пхукет")).base
+        points = await self.nearby.points_near(base)
+        # Старый город дальше радиуса поиска мест
+        self.assertEqual([point['name'] for point, _ in points], ["Пляж Ката", "Смотровая площадка Карон"])
+        self.assertEqual(format_nearby_points(points[:1]), "📍 Пляж Ката - 190 м")
+        self.assertEqual(await self.nearby.points_near({'id': 99, 'latitude': None, 'longitude': None}), [])
+
+    async def test_index_rebuilt_on_catalog_version(self):
+        self.assertEqual(len(await self.nearby.apartments_near(7.80, 98.31, radius_km=1)), 0)
+        async with get_async_session() as session:
+            session.add(Apartment(city="Пхукет", address="Ката Ной, 3", latitude=7.8010, longitude=98.3060))
+            await session.run_sync(bump_catalog_version)
+            await session.commit()
+        await self.catalog.check_version()
+        found = await self.nearby.apartments_near(7.80, 98.31, radius_km=1)
+        self.assertEqual([apartment['address'] for apartment, _ in found], ["Ката Ной, 3"])
+
+
+class TestNearbyApi(NearbyTestCase):
+    async def asyncSetUp(self):
+        import services.nearby as nearby
+        from web.main import app
+        await super().asyncSetUp()
+        nearby._nearby_search = self.nearby
+        self.client = httpx.AsyncClient(app=app, base_url="http://test")
+
+    async def asyncTearDown(self):
+        import services.nearby as nearby
+        nearby._nearby_search = None
+        await self.client.aclose()
+        await super().asyncTearDown()
+
+    async def test_nearby_endpoint(self):
+        response = await self.client.get("/api/apartments/nearby", params={"lat": 7.8206, "lon": 98.2984, "limit": 1})
+        self.assertEqual(response.status_code, 200)
+        (apartment,) = response.json()
+        self.assertEqual(apartment['address'], "Пляж Ката, 1")
+        self.assertAlmostEqual(apartment['distance_km'], 0.19, delta=0.01)
+        response = await self.client.get("/api/apartments/nearby", params={"lat": 120, "lon": 98.3})
+        self.assertEqual(response.status_code, 422)
+
+    async def test_apartments_near_point_endpoint(self):
+        point = await self.nearby.get_point(1)
+        response = await self.client.get(f"/api/points/{point['id']}/apartments", params={"radius_km": 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['point']['name'], "Пляж Ката")
+        self.assertEqual([a['address'] for a in response.json()['apartments']], ["Пляж Ката, 1", "Пляж Карон, 2"])
+        response = await self.client.get("/api/points/999/apartments")
+        self.assertEqual(response.status_code, 404)
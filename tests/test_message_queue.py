@@ -0,0 +1,91 @@
+import asyncio
+import time
+from unittest import IsolatedAsyncioTestCase
+
+from telegram.error import Forbidden, RetryAfter, TimedOut
+
+from services.message_queue import OutboundMessageQueue, Priority
+
+
+class FakeBot:
+    """Бот, который записывает отправленные сообщения и может возвращать ошибки Bot API"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sent = []
+        self.errors = {}  # chat_id -> список исключений для следующих попыток
+
+    async def initialize(self):
+        pass
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        await asyncio.sleep(self.latency)
+        errors = self.errors.get(chat_id)
+        if errors:
+            raise errors.pop(0)
+        self.sent.append((chat_id, text, time.monotonic()))
+        return f'message:{chat_id}:{text}'
+
+
+class TestOutboundMessageQueue(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.bot = FakeBot()
+
+    async def asyncTearDown(self):
+        self.queue._runner.cancel()
+
+    def make_queue(self, **kwargs) -> OutboundMessageQueue:
+        kwargs.setdefault('global_rate', 1000)
+        kwargs.setdefault('per_chat_interval', 0)
+        self.queue = OutboundMessageQueue(bot=self.bot, **kwargs)
+        self.queue.start()
+        return self.queue
+
+    async def test_transactional_overtakes_broadcast(self):
+        queue = self.make_queue(global_rate=100, max_in_flight=1)
+        broadcast = [queue.enqueue(1000 + i, 'рассылка', Priority.BROADCAST) for i in range(30)]
+        await asyncio.sleep(0.05)
+        receipt = await queue.send(1, 'оплата подтверждена')
+        self.assertEqual(receipt, 'message:1:оплата подтверждена')
+        position = [chat_id for chat_id, _, _ in self.bot.sent].index(1)
+        # Транзакционное сообщение ушло раньше большей части рассылки
+        self.assertLess(position, 10)
+        await asyncio.gather(*broadcast)
+
+    async def test_global_rate_is_respected(self):
+        queue = self.make_queue(global_rate=50)
+        started = time.monotonic()
+        await asyncio.gather(*(queue.enqueue(i, 'уведомление', Priority.NOTIFICATION) for i in range(21)))
+        # Первое сообщение уходит сразу, остальные 20 - не чаще 50 в секунду
+        self.assertGreaterEqual(time.monotonic() - started, 20 / 50 * 0.9)
+
+    async def test_per_chat_interval_and_order(self):
+        queue = self.make_queue(per_chat_interval=0.1)
+        futures = [queue.enqueue(7, f'сообщение {i}') for i in range(3)]
+        futures.append(queue.enqueue(8, 'другой чат'))
+        await asyncio.gather(*futures)
+        chat_7 = [(text, at) for chat_id, text, at in self.bot.sent if chat_id == 7]
+        self.assertEqual([text for text, _ in chat_7], ['сообщение 0', 'сообщение 1', 'сообщение 2'])
+        self.assertGreaterEqual(chat_7[2][1] - chat_7[0][1], 0.2 * 0.9)
+        # Сообщение в другой чат не ждет пауз первого
+        self.assertEqual(self.bot.sent[1][0], 8)
+
+    async def test_retry_after_pauses_sending(self):
+        queue = self.make_queue()
+        self.bot.errors[5] = [RetryAfter(1)]
+        started = time.monotonic()
+        await asyncio.gather(queue.enqueue(5, 'первое'), queue.enqueue(6, 'второе'))
+        self.assertGreaterEqual(time.monotonic() - started, 0.9)
+        self.assertEqual(queue.stats()['flood_waits'], 1)
+        self.assertEqual(queue.stats()['sent'], 2)
+
+    async def test_transient_errors_are_retried_and_permanent_fail(self):
+        queue = self.make_queue(max_retries=2, retry_backoff=0.001)
+        self.bot.errors[1] = [TimedOut(), TimedOut()]
+        self.bot.errors[2] = [Forbidden('bot was blocked by the user')]
+        self.assertEqual(await queue.send(1, 'после повторов'), 'message:1:после повторов')
+        with self.assertRaises(Forbidden):
+            await queue.send(2, 'заблокировал')
+        stats = queue.stats()
+        self.assertEqual((stats['sent'], stats['failed'], stats['retried']), (1, 1, 2))
+        self.assertTrue(await queue.join(timeout=1))
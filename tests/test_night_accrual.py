@@ -0,0 +1,125 @@
+from datetime import datetime, timedelta
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from sqlalchemy import insert, select
+
+from database.migrations import create_schema_async, dispose_async_engine, get_async_session
+from database.models import NightAccrualRun, Subscription, SubscriptionStatus, User
+from services.message_queue import OutboundMessageQueue
+from services.night_accrual import ACCRUING, COMPLETED, NightAccrualEngine, billing_period
+from services.notifications import NotificationService
+from test_message_queue import FakeBot
+
+PERIOD = '2026-09'
+CUTOFF = datetime(2026, 10, 1)
+
+
+class TestBillingPeriod(TestCase):
+    def test_previous_month(self):
+        self.assertEqual(billing_period(datetime(2026, 10, 17, 12)), ('2026-09', datetime(2026, 10, 1)))
+        self.assertEqual(billing_period(datetime(2027, 1, 1)), ('2026-12', datetime(2027, 1, 1)))
+
+
+class TestNightAccrualEngine(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await create_schema_async()
+        self.bot = FakeBot()
+        self.queue = OutboundMessageQueue(bot=self.bot, global_rate=10000, per_chat_interval=0)
+        self.queue.start()
+        # id подписок с пропусками, чтобы диапазоны порций были неравномерными
+        self.ids = [i * 3 for i in range(1, 41)]
+        async with get_async_session() as session:
+            await session.execute(insert(User), [
+                {'id': i, 'telegram_id': 1000 + i, 'first_name': 'Иван', 'last_name': f'Тестов{i}'}
+                for i in self.ids
+            ])
+            await session.execute(insert(Subscription), [
+                {'id': i, 'user_id': i,
+                 # каждая десятая оформлена уже после окончания периода
+                 'start_date': CUTOFF + timedelta(days=1) if i % 10 == 0 else CUTOFF - timedelta(days=40),
+                 'status': SubscriptionStatus.CANCELLED if i % 4 == 0 else SubscriptionStatus.ACTIVE,
+                 # каждая девятая не продлена и просрочена до конца периода, каждая одиннадцатая не оплачена
+                 'next_payment_due': None if i % 11 == 0 else CUTOFF - timedelta(days=5) if i % 9 == 0
+                 else CUTOFF + timedelta(days=12),
+                 'accumulated_nights': 6 if i % 7 == 0 else 0, 'amount_rub': 3000.0, 'amount_ton': 10.0}
+                for i in self.ids
+            ])
+            await session.commit()
+        self.eligible = {i for i in self.ids if i % 10 and i % 4 and i % 9 and i % 11}
+
+    async def asyncTearDown(self):
+        self.queue._runner.cancel()
+        await dispose_async_engine()
+
+    def make_engine(self) -> NightAccrualEngine:
+        return NightAccrualEngine(notifications=NotificationService(self.queue), chunk_size=10, nights=1)
+
+    async def nights(self) -> dict:
+        async with get_async_session() as session:
+            result = await session.execute(select(Subscription.id, Subscription.accumulated_nights))
+            return dict(result.all())
+
+    async def test_accrues_once_per_period(self):
+        before = await self.nights()
+        run = await self.make_engine().run_period(PERIOD, CUTOFF)
+
+        self.assertEqual(run.status, COMPLETED)
+        self.assertEqual(run.credited_count, len(self.eligible))
+        after = await self.nights()
+        for subscription_id in self.ids:
+            expected = before[subscription_id] + (1 if subscription_id in self.eligible else 0)
+            self.assertEqual(after[subscription_id], expected, subscription_id)
+
+        # Повторный запуск за тот же период ничего не начисляет и не отправляет
+        sent = len(self.bot.sent)
+        await self.make_engine().run_period(PERIOD, CUTOFF)
+        self.assertEqual(await self.nights(), after)
+        self.assertEqual(len(self.bot.sent), sent)
+
+    async def test_notifications_after_accrual(self):
+        await self.make_engine().run_period(PERIOD, CUTOFF)
+
+        self.assertEqual(sorted(chat_id for chat_id, _, _ in self.bot.sent), sorted(1000 + i for i in self.eligible))
+        ready = {chat_id - 1000 for chat_id, text, _ in self.bot.sent if 'достаточно ночей' in text}
+        # Накопили 7 ночей в этом периоде
+        self.assertEqual(ready, {i for i in self.eligible if i % 7 == 0})
+        async with get_async_session() as session:
+            run = await session.scalar(select(NightAccrualRun).where(NightAccrualRun.period == PERIOD))
+            self.assertEqual(run.notified_count, len(self.eligible))
+            self.assertIsNotNone(run.finished_at)
+
+    async def test_resumes_interrupted_run(self):
+        # Процесс упал после начисления подпискам с id <= 60
+        async with get_async_session() as session:
+            session.add(NightAccrualRun(period=PERIOD, cutoff=CUTOFF, nights=1, status=ACCRUING,
+                                        max_subscription_id=max(self.ids), last_subscription_id=60))
+            await session.commit()
+
+        run = await self.make_engine().run_period(PERIOD, CUTOFF)
+
+        self.assertEqual(run.status, COMPLETED)
+        self.assertEqual(run.credited_count, len({i for i in self.eligible if i > 60}))
+        nights = await self.nights()
+        self.assertTrue(all(nights[i] in (0, 6) for i in self.ids if i <= 60))
+        self.assertTrue(all(nights[i] in (1, 7) for i in self.eligible if i > 60))
+
+    async def test_subscriptions_created_during_run_wait_for_next_period(self):
+        await self.make_engine().run_due(datetime(2026, 10, 2))
+        async with get_async_session() as session:
+            session.add(User(id=500, telegram_id=1500, first_name='Петр', last_name='Новый'))
+            session.add(Subscription(id=500, user_id=500, start_date=CUTOFF - timedelta(days=3),
+                                     next_payment_due=CUTOFF + timedelta(days=27),
+                                     status=SubscriptionStatus.ACTIVE, accumulated_nights=0,
+                                     amount_rub=3000.0, amount_ton=10.0))
+            await session.commit()
+        await self.make_engine().run_due(datetime(2026, 10, 20))
+        self.assertEqual((await self.nights())[500], 0)
+
+    async def test_unpaid_and_lapsed_subscriptions_get_no_night(self):
+        await self.make_engine().run_period(PERIOD, CUTOFF)
+        nights = await self.nights()
+        lapsed = [i for i in self.ids if i % 10 and i % 4 and not (i % 9 and i % 11)]
+        self.assertTrue(lapsed)
+        for subscription_id in lapsed:
+            self.assertEqual(nights[subscription_id], 6 if subscription_id % 7 == 0 else 0, subscription_id)
+        self.assertFalse({chat_id - 1000 for chat_id, _, _ in self.bot.sent} & set(lapsed))
@@ -0,0 +1,259 @@
+import asyncio
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from sqlalchemy import create_engine, inspect, select, text
+
+from database.migrations import (
+    _create_schema, create_schema_async, dispose_async_engine, get_async_engine, get_async_session
+)
+from database.models import (
+    User, Subscription, SubscriptionStatus, Payment, PaymentStatus, WalletCursor
+)
+from services.message_queue import OutboundMessageQueue
+from services.notifications import NotificationService
+from services.payment_reconciler import PaymentReconciler
+from services.subscription_service import SubscriptionService
+from ton.async_client import AsyncTONClient
+from utils.helpers import generate_payment_memo, is_valid_ton_address, parse_payment_memo
+from utils.http import close_http_session
+from utils.rate_limit import TokenBucket
+from test_message_queue import FakeBot
+
+WALLET = "EQ_service_wallet"
+
+
+class FakeToncenter:
+    """Локальный сервер с методом getTransactions, повторяющим пагинацию toncenter"""
+
+    def __init__(self):
+        self.transactions = []  # от новых к старым
+        self.requests = 0
+
+    def add_transfer(self, lt: int, value: int, utime: datetime, comment: str = ''):
+        self.transactions.insert(0, {
+            'utime': int((utime - datetime(1970, 1, 1)).total_seconds()),
+            'transaction_id': {'lt': str(lt), 'hash': f'hash{lt}'},
+            'in_msg': {'source': 'EQ_payer', 'destination': WALLET, 'value': str(value), 'message': comment},
+            'out_msgs': []
+        })
+
+    async def get_transactions(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        assert request.query['address'] == WALLET
+        limit = int(request.query['limit'])
+        items = self.transactions
+        if 'lt' in request.query:
+            lt = int(request.query['lt'])
+            items = [tx for tx in items if int(tx['transaction_id']['lt']) <= lt]
+        return web.json_response({'ok': True, 'result': items[:limit]})
+
+
+class TestPaymentReconciler(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await create_schema_async()
+        self.toncenter = FakeToncenter()
+        app = web.Application()
+        app.router.add_get('/getTransactions', self.toncenter.get_transactions)
+        self.server = TestServer(app)
+        await self.server.start_server()
+        ton_client = AsyncTONClient(
+            api_key=None, api_url=str(self.server.make_url('')), rate_limiter=TokenBucket(rate=1000)
+        )
+        self.bot = FakeBot()
+        self.queue = OutboundMessageQueue(bot=self.bot, global_rate=10000, per_chat_interval=0)
+        self.queue.start()
+        self.reconciler = PaymentReconciler(wallet_address=WALLET, ton_client=ton_client, page_size=5,
+                                            notifications=NotificationService(self.queue))
+        self.now = datetime.utcnow()
+
+        async with get_async_session() as session:
+            user = User(telegram_id=1, first_name="Иван", last_name="Иванов")
+            session.add(user)
+            await session.flush()
+            subscription = Subscription(
+                user_id=user.id, start_date=self.now, status=SubscriptionStatus.PAUSED,
+                amount_rub=3000.0, amount_ton=5.0
+            )
+            session.add(subscription)
+            await session.flush()
+            self.memos = ['OPAAAA2222', 'OPBBBB3333', 'OPCCCC4444']
+            self.payments = [
+                Payment(subscription_id=subscription.id, memo=memo, amount_nanoton=amount, ton_address=WALLET,
+                        status=PaymentStatus.PENDING, created_at=self.now - timedelta(hours=1, minutes=i))
+                for i, (memo, amount) in enumerate(zip(self.memos, [5_000_000_000, 5_000_000_000, 7_250_000_000]))
+            ]
+            session.add_all(self.payments)
+            await session.commit()
+
+    async def asyncTearDown(self):
+        self.queue._runner.cancel()
+        await close_http_session()
+        await self.server.close()
+        await dispose_async_engine()
+
+    async def _statuses(self):
+        async with get_async_session() as session:
+            result = await session.execute(select(Payment.id, Payment.status).order_by(Payment.id))
+            return dict(result.all())
+
+    async def test_matches_transfers_across_pages_in_one_scan(self):
+        # Шум: переводы без кода счета, чтобы понадобилась пагинация
+        for lt in range(1, 13):
+            self.toncenter.add_transfer(lt=lt, value=5_000_000_000, utime=self.now - timedelta(minutes=30))
+        # Код указан в нижнем регистре и с пробелами - так его может набрать пользователь
+        self.toncenter.add_transfer(lt=20, value=5_000_000_000, utime=self.now - timedelta(minutes=20),
+                                    comment=' opbbbb3333 ')
+        self.toncenter.add_transfer(lt=21, value=7_250_000_000, utime=self.now - timedelta(minutes=10),
+                                    comment='OPCCCC4444')
+
+        self.assertEqual(await self.reconciler.run_once(), 2)
+        statuses = await self._statuses()
+        # Счет с той же суммой, но другим кодом остается ожидающим
+        self.assertEqual(statuses[self.payments[0].id], PaymentStatus.PENDING)
+        self.assertEqual(statuses[self.payments[1].id], PaymentStatus.COMPLETED)
+        self.assertEqual(statuses[self.payments[2].id], PaymentStatus.COMPLETED)
+
+        async with get_async_session() as session:
+            cursor = (await session.execute(select(WalletCursor))).scalars().one()
+            subscription = (await session.execute(select(Subscription))).scalars().one()
+        self.assertEqual(cursor.last_lt, 21)
+        self.assertEqual(subscription.status, SubscriptionStatus.ACTIVE)
+        # Два платежа за одну подписку продлевают срок дважды
+        self.assertGreater(subscription.next_payment_due, self.now + timedelta(days=59))
+
+    async def test_next_cycle_reads_only_new_transactions(self):
+        self.toncenter.add_transfer(lt=20, value=5_000_000_000, utime=self.now - timedelta(minutes=20),
+                                    comment='OPAAAA2222')
+        self.assertEqual(await self.reconciler.run_once(), 1)
+
+        # Повторный цикл без новых транзакций ничего не подтверждает
+        requests_before = self.toncenter.requests
+        self.assertEqual(await self.reconciler.run_once(), 0)
+        self.assertEqual(self.toncenter.requests - requests_before, 1)
+
+        self.toncenter.add_transfer(lt=30, value=5_000_000_000, utime=self.now, comment='OPBBBB3333')
+        self.assertEqual(await self.reconciler.run_once(), 1)
+        statuses = await self._statuses()
+        self.assertEqual(statuses[self.payments[1].id], PaymentStatus.COMPLETED)
+
+    async def test_underpayment_is_not_matched(self):
+        self.toncenter.add_transfer(lt=5, value=7_249_999_999, utime=self.now - timedelta(minutes=5),
+                                    comment='OPCCCC4444')
+        self.assertEqual(await self.reconciler.run_once(), 0)
+        statuses = await self._statuses()
+        self.assertEqual(statuses[self.payments[2].id], PaymentStatus.PENDING)
+
+    async def test_transfer_before_invoice_is_ignored(self):
+        self.toncenter.add_transfer(lt=5, value=7_250_000_000, utime=self.now - timedelta(hours=3),
+                                    comment='OPCCCC4444')
+        self.assertEqual(await self.reconciler.run_once(), 0)
+        statuses = await self._statuses()
+        self.assertEqual(statuses[self.payments[2].id], PaymentStatus.PENDING)
+
+    async def test_issued_invoice_is_activated_by_matching_transfer(self):
+        import services.exchange_rate as exchange_rate
+
+        async def fetch_rate():
+            return 250.0
+
+        exchange_rate._exchange_rate_service = exchange_rate.ExchangeRateService(fetcher=fetch_rate)
+        try:
+            async with get_async_session() as session:
+                service = SubscriptionService(session)
+                service.ton_client.wallet_address = WALLET
+                _, subscription, invoice = await service.create_subscription(2, "Петр", "Петров")
+        finally:
+            exchange_rate._exchange_rate_service = None
+        self.assertEqual(subscription.status, SubscriptionStatus.PAUSED)
+
+        self.toncenter.add_transfer(200, invoice.amount_nanoton, invoice.created_at + timedelta(minutes=1), invoice.memo)
+        self.assertEqual(await self.reconciler.run_once(), 1)
+
+        async with get_async_session() as session:
+            service = SubscriptionService(session)
+            self.assertEqual((await service.get_payment(invoice.memo)).status, PaymentStatus.COMPLETED)
+            active = await service.get_user_subscription(2)
+        self.assertEqual(active.id, subscription.id)
+        self.assertIsNotNone(active.next_payment_due)
+        # Подтверждение пользователю уходит через очередь исходящих сообщений
+        self.assertEqual([chat_id for chat_id, _, _ in self.bot.sent], [2])
+        self.assertIn("Подписка активирована", self.bot.sent[0][1])
+
+
+
+class TestConcurrentReconciliation(TestPaymentReconciler):
+    """Две сверки одновременно через файловую БД: у каждой сессии свое соединение"""
+
+    async def asyncSetUp(self):
+        await dispose_async_engine()
+        self.tmpdir = tempfile.mkdtemp()
+        get_async_engine(f"sqlite:///{os.path.join(self.tmpdir, 'reconciler.db')}")
+        await super().asyncSetUp()
+
+    async def asyncTearDown(self):
+        await super().asyncTearDown()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    async def test_concurrent_runs_complete_each_invoice_once(self):
+        self.toncenter.add_transfer(lt=20, value=5_000_000_000, utime=self.now - timedelta(minutes=20),
+                                    comment='OPAAAA2222')
+        self.toncenter.add_transfer(lt=21, value=5_000_000_000, utime=self.now - timedelta(minutes=10),
+                                    comment='OPBBBB3333')
+        twin = PaymentReconciler(wallet_address=WALLET, ton_client=self.reconciler.ton_client, page_size=5,
+                                 notifications=self.reconciler.notifications)
+
+        confirmed = await asyncio.gather(self.reconciler.run_once(), twin.run_once())
+        self.assertEqual(sum(confirmed), 2)
+        async with get_async_session() as session:
+            subscription = (await session.execute(select(Subscription))).scalars().one()
+        # Каждый счет продлевает подписку ровно один раз
+        self.assertLess(subscription.next_payment_due, self.now + timedelta(days=61))
+        self.assertGreater(subscription.next_payment_due, self.now + timedelta(days=59))
+
+class TestPaymentMemo(TestCase):
+    def test_generated_memo_round_trips_through_comment(self):
+        memos = {generate_payment_memo() for _ in range(1000)}
+        self.assertEqual(len(memos), 1000)
+        for memo in memos:
+            self.assertEqual(parse_payment_memo(f" {memo.lower()}\n"), memo)
+
+    def test_foreign_comments_are_ignored(self):
+        for comment in ['', 'спасибо!', 'OP123', 'OPAAAA0000', 'XXAAAA2222']:
+            self.assertIsNone(parse_payment_memo(comment))
+
+    def test_wallet_address_validation(self):
+        for address in ['EQDtFpEwcFAEcRe5mLVh2N6C0x-_hJEM7W61_JLnSF74p4q2',
+                        'EQCD39VS5jcptHL8vMjEXrzGaRcCVYto7HUn4bpAOg8xqB2N',
+                        '0:83dfd552e63729b472fcbcc8c45ebcc6691702558b68ec7527e1ba403a0f31a8']:
+            self.assertTrue(is_valid_ton_address(address), address)
+        # Пустой адрес, чужая строка и адрес с испорченной контрольной суммой
+        for address in [None, '', 'None', WALLET, 'EQDtFpEwcFAEcRe5mLVh2N6C0x-_hJEM7W61_JLnSF74p4q3']:
+            self.assertFalse(is_valid_ton_address(address), address)
+
+    def test_existing_payments_table_is_upgraded(self):
+        engine = create_engine('sqlite://')
+        with engine.begin() as connection:
+            connection.execute(text(
+                "CREATE TABLE payments (id INTEGER PRIMARY KEY, subscription_id INTEGER NOT NULL, "
+                "amount_ton FLOAT NOT NULL, status VARCHAR(9), created_at DATETIME, "
+                "completed_at DATETIME, ton_address VARCHAR(255) NOT NULL)"
+            ))
+            connection.execute(text(
+                "INSERT INTO payments (id, subscription_id, amount_ton, ton_address) VALUES (1, 1, 12.345, 'EQD...')"
+            ))
+            _create_schema(connection)
+
+            columns = {column['name'] for column in inspect(connection).get_columns('payments')}
+            indexes = {index['name'] for index in inspect(connection).get_indexes('payments')}
+            amount = connection.execute(text("SELECT amount_nanoton FROM payments")).scalar()
+        engine.dispose()
+        self.assertIn('memo', columns)
+        self.assertNotIn('amount_ton', columns)
+        self.assertIn('ux_payments_memo', indexes)
+        self.assertEqual(amount, 12_345_000_000)
@@ -0,0 +1,152 @@
+import unittest
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, event, insert, select
+from sqlalchemy.orm import Session
+
+from database.models import (
+    Base, User, Subscription, SubscriptionStatus, Apartment, Booking,
+    Payment, PaymentStatus, ReferralBonus
+)
+
+# Объем данных, при котором полный просмотр таблицы заметно дороже поиска по индексу
+USERS = 50_000
+ROWS = 200_000
+
+
+class TestHotQueryPlans(unittest.TestCase):
+    """Проверяет через EXPLAIN QUERY PLAN, что горячие запросы используют индексы"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = create_engine('sqlite://')
+        Base.metadata.create_all(cls.engine)
+        now = datetime.utcnow()
+        statuses = list(PaymentStatus)
+        with cls.engine.begin() as conn:
+            conn.execute(insert(User), [
+                {'id': i, 'telegram_id': i, 'first_name': 'Имя', 'last_name': 'Фамилия',
+                 'referrer_id': i // 100 + 1 if i > 100 else None}
+                for i in range(1, USERS + 1)
+            ])
+            conn.execute(insert(Apartment), [
+                {'id': i, 'city': f'city_{i % 50}', 'address': f'Адрес {i}',
+                 'apartment_type': 'Base' if i % 10 == 0 else 'Standard'}
+                for i in range(1, USERS + 1)
+            ])
+            conn.execute(insert(Subscription), [
+                {'id': i, 'user_id': i % USERS + 1, 'start_date': now,
+                 'status': SubscriptionStatus.ACTIVE if i % 3 else SubscriptionStatus.CANCELLED,
+                 'amount_rub': 3000.0, 'amount_ton': 5.0, 'next_payment_due': now + timedelta(minutes=i)}
+                for i in range(1, ROWS + 1)
+            ])
+            conn.execute(insert(Payment), [
+                {'id': i, 'subscription_id': i, 'memo': f'OP{i:08d}', 'amount_nanoton': 5_000_000_000,
+                 'ton_address': 'EQD...',
+                 'status': statuses[i % len(statuses)], 'created_at': now - timedelta(minutes=i)}
+                for i in range(1, ROWS + 1)
+            ])
+            conn.execute(insert(Booking), [
+                {'id': i, 'user_id': i % USERS + 1, 'apartment_id': i % USERS + 1,
+                 'start_date': now + timedelta(days=i % 365),
+                 'end_date': now + timedelta(days=i % 365 + 7), 'nights_used': 7}
+                for i in range(1, ROWS + 1)
+            ])
+            conn.execute(insert(ReferralBonus), [
+                {'id': i, 'user_id': i % USERS + 1, 'invited_user_id': (i + 1) % USERS + 1,
+                 'bonus_month_given_date': now}
+                for i in range(1, USERS + 1)
+            ])
+            conn.exec_driver_sql('ANALYZE')
+
+        cls.plans = []
+
+        @event.listens_for(cls.engine, 'before_cursor_execute')
+        def capture_plan(conn, cursor, statement, parameters, context, executemany):
+            if not executemany and statement.lstrip().upper().startswith('SELECT'):
+                plan = cursor.connection.execute('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+                cls.plans.append(' | '.join(row[-1] for row in plan))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.dispose()
+
+    def assertUsesIndex(self, query, index_name):
+        self.plans.clear()
+        with Session(self.engine) as session:
+            session.execute(query).all()
+        self.assertEqual(len(self.plans), 1)
+        self.assertIn(f'INDEX {index_name}', self.plans[0])
+
+    def test_base_apartment_by_city(self):
+        self.assertUsesIndex(
+            select(Apartment).where(Apartment.city == 'city_7', Apartment.apartment_type == 'Base').limit(1),
+            'ix_apartments_city_type'
+        )
+
+    def test_pending_payments_for_last_day(self):
+        self.assertUsesIndex(
+            select(Payment)
+            .filter_by(status=PaymentStatus.PENDING)
+            .filter(Payment.created_at > datetime.utcnow() - timedelta(hours=24)),
+            'ix_payments_status_created_at'
+        )
+
+    def test_payments_by_transfer_memos(self):
+        self.assertUsesIndex(
+            select(Payment).where(
+                Payment.memo.in_(['OP00000042', 'OP00000043']),
+                Payment.status == PaymentStatus.PENDING
+            ),
+            'ux_payments_memo'
+        )
+
+    def test_active_subscription_of_user(self):
+        self.assertUsesIndex(
+            select(Subscription).filter_by(user_id=42, status=SubscriptionStatus.ACTIVE),
+            'ix_subscriptions_user_id_status'
+        )
+
+    def test_subscriptions_due_for_renewal_reminder(self):
+        self.assertUsesIndex(
+            select(Subscription, User)
+            .join(User, Subscription.user_id == User.id)
+            .where(
+                Subscription.status == SubscriptionStatus.ACTIVE,
+                Subscription.next_payment_due <= datetime.utcnow() + timedelta(days=3),
+                Subscription.renewal_reminder_sent_at.is_(None)
+            )
+            .order_by(Subscription.next_payment_due, Subscription.id)
+            .limit(1000),
+            'ix_subscriptions_status_next_payment_due'
+        )
+
+    def test_booking_overlap(self):
+        start = datetime.utcnow() + timedelta(days=30)
+        self.assertUsesIndex(
+            select(Booking).where(
+                Booking.apartment_id == 42,
+                Booking.start_date < start + timedelta(days=7),
+                Booking.end_date > start
+            ),
+            'ix_bookings_apartment_dates'
+        )
+
+    def test_referral_bonuses_of_user(self):
+        self.assertUsesIndex(
+            select(ReferralBonus).where(ReferralBonus.user_id == 42),
+            'ix_referral_bonuses_user_id'
+        )
+
+    def test_referrals_broadcast_page(self):
+        self.assertUsesIndex(
+            select(User.id, User.telegram_id)
+            .where(User.id > 0, User.referrer_id == 42)
+            .order_by(User.id)
+            .limit(1000),
+            'ix_users_referrer_id'
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from sqlalchemy import create_engine, insert, inspect, text
+
+from database.migrations import _create_schema, create_schema_async, dispose_async_engine, get_async_session
+from database.models import Subscription, SubscriptionStatus, User
+from services.message_queue import OutboundMessageQueue
+from services.notifications import NotificationService
+from services.renewal_reminders import RenewalReminderScanner
+from utils.helpers import extend_next_payment_date
+from test_message_queue import FakeBot
+
+NOW = datetime(2026, 10, 17, 12)
+
+
+class TestRenewalReminderScanner(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await create_schema_async()
+        self.bot = FakeBot()
+        self.queue = OutboundMessageQueue(bot=self.bot, global_rate=10000, per_chat_interval=0)
+        self.queue.start()
+        # Срок оплаты подписки i наступает через i - 10 дней
+        async with get_async_session() as session:
+            await session.execute(insert(User), [
+                {'id': i, 'telegram_id': 1000 + i, 'first_name': 'Иван', 'last_name': f'Тестов{i}'}
+                for i in range(1, 31)
+            ])
+            await session.execute(insert(Subscription), [
+                {'id': i, 'user_id': i, 'start_date': NOW - timedelta(days=30),
+                 'status': SubscriptionStatus.CANCELLED if i == 11 else SubscriptionStatus.ACTIVE,
+                 'next_payment_due': NOW + timedelta(days=i - 10) if i != 12 else None,
+                 'amount_rub': 3000.0, 'amount_ton': 10.0}
+                for i in range(1, 31)
+            ])
+            await session.commit()
+
+    async def asyncTearDown(self):
+        self.queue._runner.cancel()
+        await dispose_async_engine()
+
+    def make_scanner(self) -> RenewalReminderScanner:
+        return RenewalReminderScanner(notifications=NotificationService(self.queue), days_before=3, batch_size=4)
+
+    async def test_reminds_each_due_subscription_once(self):
+        self.assertEqual(await self.make_scanner().run_once(NOW), 11)
+        # Просроченные и истекающие в ближайшие 3 дня, кроме отмененной и без срока
+        expected = [1000 + i for i in range(1, 13) if i not in (11, 12)] + [1013]
+        self.assertEqual(sorted(chat_id for chat_id, _, _ in self.bot.sent), expected)
+        self.assertIn('истекает 20.10.2026', [text for chat_id, text, _ in self.bot.sent if chat_id == 1013][0])
+
+        self.assertEqual(await self.make_scanner().run_once(NOW), 0)
+        self.assertEqual(await self.make_scanner().run_once(NOW + timedelta(days=1)), 1)
+
+    async def test_payment_resets_reminder(self):
+        await self.make_scanner().run_once(NOW)
+        async with get_async_session() as session:
+            subscription = await session.get(Subscription, 13)
+            subscription.next_payment_due = extend_next_payment_date(subscription.next_payment_due, NOW)
+            subscription.renewal_reminder_sent_at = None
+            await session.commit()
+        self.assertEqual(subscription.next_payment_due, NOW + timedelta(days=33))
+
+        self.assertEqual(await self.make_scanner().run_once(NOW), 0)
+        # О новом сроке напоминание приходит снова
+        await self.make_scanner().run_once(NOW + timedelta(days=30))
+        self.assertEqual([chat_id for chat_id, _, _ in self.bot.sent].count(1013), 2)
+
+
+class TestNextPaymentDue(TestCase):
+    def test_early_payment_extends_current_term(self):
+        due = datetime(2026, 10, 20)
+        self.assertEqual(extend_next_payment_date(due, datetime(2026, 10, 17)), datetime(2026, 11, 19))
+        self.assertEqual(extend_next_payment_date(due, datetime(2026, 10, 25)), datetime(2026, 11, 24))
+        self.assertEqual(extend_next_payment_date(None, datetime(2026, 10, 25)), datetime(2026, 11, 24))
+
+    def test_existing_subscriptions_table_is_upgraded(self):
+        engine = create_engine('sqlite://')
+        with engine.begin() as connection:
+            connection.execute(text(
+                "CREATE TABLE subscriptions (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, "
+                "start_date DATETIME NOT NULL, status VARCHAR(9), accumulated_nights INTEGER, "
+                "payment_token VARCHAR(255), amount_rub FLOAT NOT NULL, amount_ton FLOAT NOT NULL)"
+            ))
+            connection.execute(text(
+                "CREATE TABLE payments (id INTEGER PRIMARY KEY, subscription_id INTEGER NOT NULL, "
+                "amount_ton FLOAT NOT NULL, status VARCHAR(9), created_at DATETIME, "
+                "completed_at DATETIME, ton_address VARCHAR(255) NOT NULL)"
+            ))
+            connection.execute(text(
+                "INSERT INTO subscriptions (id, user_id, start_date, status, amount_rub, amount_ton) VALUES "
+                "(1, 1, '2026-08-01 00:00:00', 'ACTIVE', 3000, 10), (2, 1, '2026-08-01 00:00:00', 'ACTIVE', 3000, 10)"
+            ))
+            connection.execute(text(
+                "INSERT INTO payments (subscription_id, amount_ton, status, completed_at, ton_address) VALUES "
+                "(1, 10, 'COMPLETED', '2026-09-01 10:00:00', 'EQD...'), "
+                "(1, 10, 'COMPLETED', '2026-10-01 10:00:00', 'EQD...'), "
+                "(1, 10, 'PENDING', NULL, 'EQD...')"
+            ))
+            _create_schema(connection)
+
+            indexes = {index['name'] for index in inspect(connection).get_indexes('subscriptions')}
+            due = dict(connection.execute(text("SELECT id, next_payment_due FROM subscriptions")).all())
+        engine.dispose()
+        self.assertIn('ix_subscriptions_status_next_payment_due', indexes)
+        # Срок считается от последнего подтвержденного платежа
+        self.assertTrue(due[1].startswith('2026-10-31 10:00:00'))
+        self.assertIsNone(due[2])
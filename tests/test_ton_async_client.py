@@ -0,0 +1,87 @@
+import asyncio
+import time
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from ton.async_client import AsyncTONClient, TONAPIError, _rate_limiters, get_rate_limiter
+from utils.http import close_http_session
+from utils.rate_limit import TokenBucket
+
+
+def make_app(state: dict) -> web.Application:
+    async def payment_status(request):
+        state['calls'] += 1
+        if state['calls'] <= state.get('fail_first', 0):
+            return web.json_response({'error': 'busy'}, status=503)
+        if state.get('delay'):
+            await asyncio.sleep(state['delay'])
+        return web.json_response({'status': 'completed'})
+
+    app = web.Application()
+    app.router.add_get('/payment/{payment_id}', payment_status)
+    return app
+
+
+class TestAsyncTONClient(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.state = {'calls': 0}
+        self.server = TestServer(make_app(self.state))
+        await self.server.start_server()
+
+    async def asyncTearDown(self):
+        await close_http_session()
+        await self.server.close()
+
+    def make_client(self, **kwargs) -> AsyncTONClient:
+        kwargs.setdefault('rate_limiter', TokenBucket(rate=1000))
+        return AsyncTONClient(api_key='key', api_url=str(self.server.make_url('')),
+                              backoff_base=0.01, **kwargs)
+
+    async def test_retries_transient_errors(self):
+        self.state['fail_first'] = 2
+        client = self.make_client(max_retries=3)
+        self.assertEqual(await client.check_payment_status('42'), {'status': 'completed'})
+        self.assertEqual(self.state['calls'], 3)
+
+    async def test_gives_up_after_max_retries(self):
+        self.state['fail_first'] = 10
+        client = self.make_client(max_retries=1)
+        with self.assertRaises(TONAPIError):
+            await client.check_payment_status('42')
+        self.assertEqual(self.state['calls'], 2)
+
+    async def test_per_call_timeout(self):
+        self.state['delay'] = 1
+        client = self.make_client(timeout=0.05, max_retries=0)
+        with self.assertRaises(TONAPIError):
+            await client.check_payment_status('42')
+
+    async def test_rate_limit_is_respected(self):
+        client = self.make_client(rate_limiter=TokenBucket(rate=20, capacity=1))
+        started = time.monotonic()
+        await asyncio.gather(*(client.check_payment_status('42') for _ in range(5)))
+        # Первый запрос проходит сразу, остальные четыре - не чаще 20 в секунду
+        self.assertGreaterEqual(time.monotonic() - started, 4 / 20 * 0.9)
+
+
+class TestTokenBucket(TestCase):
+    def test_try_acquire_refills_over_time(self):
+        bucket = TokenBucket(rate=100, capacity=2)
+        self.assertTrue(bucket.try_acquire())
+        self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire())
+        time.sleep(0.02)
+        self.assertTrue(bucket.try_acquire())
+
+    def test_shared_limiter_fits_one_request_below_one_rps(self):
+        try:
+            limiter = get_rate_limiter('slow-key', rps=0.5)
+            self.assertEqual(limiter.capacity, 1)
+            self.assertTrue(limiter.try_acquire())
+            self.assertIs(get_rate_limiter('slow-key'), limiter)
+            with self.assertRaises(ValueError):
+                get_rate_limiter('zero-key', rps=0)
+        finally:
+            _rate_limiters.pop('slow-key', None)
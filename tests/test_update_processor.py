@@ -0,0 +1,90 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from telegram import Update
+
+from bot.update_processor import ChatOrderedUpdateProcessor
+
+
+def make_update(update_id: int, chat_id: int) -> Update:
+    return Update.de_json({
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'chat_instance': str(chat_id),
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Иван'},
+            'data': f'select_month_{update_id}',
+            'message': {
+                'message_id': 1, 'date': 1700000000,
+                'chat': {'id': chat_id, 'type': 'private'},
+            },
+        },
+    }, None)
+
+
+class TestChatOrderedUpdateProcessor(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.events = []
+        self.peak = 0
+
+    async def handler(self, processor, name: str, delay: float):
+        self.peak = max(self.peak, processor.in_flight)
+        self.events.append(('start', name))
+        await asyncio.sleep(delay)
+        self.events.append(('end', name))
+
+    async def run_updates(self, processor, updates):
+        """updates: (update_id, chat_id, delay); порядок списка - порядок поступления"""
+        tasks = []
+        for update_id, chat_id, delay in updates:
+            coroutine = self.handler(processor, f'{chat_id}:{update_id}', delay)
+            tasks.append(asyncio.create_task(processor.process_update(make_update(update_id, chat_id), coroutine)))
+            # Между нажатиями пользователя проходит время, как в реальном чате
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+
+    async def test_same_chat_is_sequential_in_arrival_order(self):
+        processor = ChatOrderedUpdateProcessor(max_concurrent_updates=8)
+        # Первое нажатие медленное, второе быстрое: второе все равно ждет первого
+        await self.run_updates(processor, [(1, 42, 0.05), (2, 42, 0), (3, 42, 0)])
+        self.assertEqual(self.events, [
+            ('start', '42:1'), ('end', '42:1'),
+            ('start', '42:2'), ('end', '42:2'),
+            ('start', '42:3'), ('end', '42:3'),
+        ])
+
+    async def test_different_chats_run_concurrently_within_limit(self):
+        processor = ChatOrderedUpdateProcessor(max_concurrent_updates=3)
+        started = asyncio.get_running_loop().time()
+        await self.run_updates(processor, [(i, 100 + i, 0.05) for i in range(9)])
+        elapsed = asyncio.get_running_loop().time() - started
+        self.assertEqual(self.peak, 3)
+        # 9 обновлений по 50 мс при 3 параллельных - около 150 мс, а не 450
+        self.assertLess(elapsed, 0.35)
+
+    async def test_busy_chat_does_not_block_others(self):
+        processor = ChatOrderedUpdateProcessor(max_concurrent_updates=2)
+        finished = {}
+
+        async def tracked(update_id, chat_id, delay):
+            coroutine = self.handler(processor, f'{chat_id}:{update_id}', delay)
+            await processor.process_update(make_update(update_id, chat_id), coroutine)
+            finished[update_id] = asyncio.get_running_loop().time()
+
+        loop_start = asyncio.get_running_loop().time()
+        # Пять медленных нажатий одного пользователя и одно нажатие другого
+        tasks = [asyncio.create_task(tracked(i, 1, 0.05)) for i in range(5)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(tracked(99, 2, 0)))
+        await asyncio.sleep(0.01)
+        self.assertEqual(processor.stats()['waiting'], 4)
+        self.assertEqual(processor.stats()['in_flight'], 1)
+        await asyncio.gather(*tasks)
+        self.assertLess(finished[99] - loop_start, 0.05)
+
+    async def test_stats_return_to_idle(self):
+        processor = ChatOrderedUpdateProcessor(max_concurrent_updates=4)
+        await self.run_updates(processor, [(i, i % 3, 0) for i in range(12)])
+        stats = processor.stats()
+        self.assertEqual((stats['waiting'], stats['in_flight'], stats['active_chats']), (0, 0, 0))
+        self.assertEqual(stats['processed'], 12)
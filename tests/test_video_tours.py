@@ -0,0 +1,129 @@
+import asyncio
+from types import SimpleNamespace
+from unittest import IsolatedAsyncioTestCase
+
+from sqlalchemy import select, update
+from telegram.error import BadRequest, NetworkError
+
+from bot.video_tours import VideoTourSender
+from database.migrations import create_schema_async, dispose_async_engine, get_async_session
+from database.models import Apartment
+from services.catalog_cache import CatalogCache
+
+VIDEO_URL = "https://example.com/tour.mp4"
+
+
+class FakeTelegramChat:
+    """
+    Чат Telegram: видео по ссылке "загружается" с задержкой и получает новый file_id,
+    по file_id отправляется сразу; file_id из revoked Telegram не принимает.
+    """
+
+    def __init__(self, upload_delay: float = 0.0):
+        self.upload_delay = upload_delay
+        self.sent = []
+        self.revoked = set()
+        self.uploads = 0
+
+    async def reply_video(self, video, caption=None):
+        self.sent.append(video)
+        if video in self.revoked:
+            raise BadRequest("Wrong file identifier/http url specified")
+        if video.startswith("http"):
+            await asyncio.sleep(self.upload_delay)
+            self.uploads += 1
+            file_id = f"BAADfile{self.uploads}"
+        else:
+            file_id = video
+        return SimpleNamespace(video=SimpleNamespace(
+            file_id=file_id, thumbnail=SimpleNamespace(file_id=f"{file_id}-thumb")
+        ))
+
+
+class TestVideoTours(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await create_schema_async()
+        async with get_async_session() as session:
+            session.add(Apartment(city="Пхукет", address="Пляж Ката, 1", apartment_type="Base", video_url=VIDEO_URL))
+            await session.commit()
+        self.catalog = CatalogCache()
+        self.apartment = (await self.catalog.get_city("Пхукет")).base
+        self.tours = VideoTourSender()
+        self.chat = FakeTelegramChat()
+
+    async def asyncTearDown(self):
+        await dispose_async_engine()
+
+    async def _stored_ids(self):
+        async with get_async_session() as session:
+            result = await session.execute(select(Apartment.video_file_id, Apartment.video_thumbnail_file_id))
+            return tuple(result.one())
+
+    async def test_file_id_saved_and_reused(self):
+        await self.tours.send(self.chat, self.apartment, "Видео-тур")
+        self.assertEqual(await self._stored_ids(), ("BAADfile1", "BAADfile1-thumb"))
+        for _ in range(3):
+            await self.tours.send(self.chat, self.apartment, "Видео-тур")
+        self.assertEqual(self.chat.sent, [VIDEO_URL] + ["BAADfile1"] * 3)
+        self.assertEqual(self.tours.stats(), {'sent_by_file_id': 3, 'uploads': 1, 'stale_file_ids': 0, 'failures': 0})
+        # После перезагрузки каталога file_id берется из БД
+        await self.catalog.warm()
+        self.assertEqual((await self.catalog.get_city("Пхукет")).base['video_file_id'], "BAADfile1")
+
+    async def test_stale_file_id_is_refreshed(self):
+        await self.tours.send(self.chat, self.apartment, "Видео-тур")
+        self.chat.revoked.add("BAADfile1")
+        self.assertIsNotNone(await self.tours.send(self.chat, self.apartment, "Видео-тур"))
+        self.assertEqual(self.chat.sent, [VIDEO_URL, "BAADfile1", VIDEO_URL])
+        self.assertEqual(await self._stored_ids(), ("BAADfile2", "BAADfile2-thumb"))
+        await self.tours.send(self.chat, self.apartment, "Видео-тур")
+        self.assertEqual(self.chat.sent[-1], "BAADfile2")
+        self.assertEqual(self.tours.stale_file_ids, 1)
+
+    async def test_concurrent_first_sends_upload_once(self):
+        self.chat.upload_delay = 0.05
+        messages = await asyncio.gather(*(self.tours.send(self.chat, self.apartment, "Видео-тур") for _ in range(5)))
+        self.assertTrue(all(messages))
+        self.assertEqual(self.chat.uploads, 1)
+        self.assertEqual(self.chat.sent.count("BAADfile1"), 4)
+
+    async def test_importer_file_id_gets_thumbnail(self):
+        self.apartment['video_file_id'] = "BAADimported"
+        await self.tours.send(self.chat, self.apartment, "Видео-тур")
+        self.assertEqual(self.chat.sent, ["BAADimported"])
+        self.assertEqual(await self._stored_ids(), ("BAADimported", "BAADimported-thumb"))
+
+    async def test_rejected_importer_file_id_is_not_resent(self):
+        # Импортер записывает один и тот же file_id и в video_url, и в video_file_id
+        async with get_async_session() as session:
+            await session.execute(update(Apartment).values(video_url="BAADimported", video_file_id="BAADimported"))
+            await session.commit()
+        self.apartment.update(video_url="BAADimported", video_file_id="BAADimported")
+        self.chat.revoked.add("BAADimported")
+
+        self.assertIsNone(await self.tours.send(self.chat, self.apartment, "Видео-тур"))
+        self.assertEqual(self.chat.sent, ["BAADimported"])
+        self.assertEqual(self.tours.stats(), {'sent_by_file_id': 0, 'uploads': 0, 'stale_file_ids': 1, 'failures': 0})
+        # file_id стерт: импортер загрузит видео заново, а бот больше не отправляет отклоненный file_id
+        self.assertEqual(await self._stored_ids(), (None, None))
+        self.assertIsNone(await self.tours.send(self.chat, self.apartment, "Видео-тур"))
+        self.assertEqual(self.chat.sent, ["BAADimported"])
+
+    async def test_other_bad_requests_keep_file_id(self):
+        await self.tours.send(self.chat, self.apartment, "Видео-тур")
+
+        async def long_caption(video, caption=None):
+            raise BadRequest("Message caption is too long")
+        self.assertIsNone(await self.tours.send(SimpleNamespace(reply_video=long_caption), self.apartment, "Видео-тур"))
+        self.assertEqual(self.tours.stats()['stale_file_ids'], 0)
+        self.assertEqual(self.tours.failures, 1)
+        self.assertEqual(await self._stored_ids(), ("BAADfile1", "BAADfile1-thumb"))
+        self.assertEqual(self.chat.uploads, 1)
+
+    async def test_failures_do_not_raise(self):
+        async def broken(video, caption=None):
+            raise NetworkError("нет соединения")
+        self.assertIsNone(await self.tours.send(SimpleNamespace(reply_video=broken), self.apartment, "Видео-тур"))
+        self.assertEqual(self.tours.failures, 1)
+        self.assertIsNone(await self.tours.send(self.chat, {'id': 2, 'video_url': None}, "Видео-тур"))
+        self.assertIsNone(await self.tours.send(self.chat, None, "Видео-тур"))
@@ -0,0 +1,59 @@
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+import httpx
+from telegram.ext import Application
+
+from bot.webhook import WEBHOOK_SECRET_HEADER, get_webhook_url
+from config import WEBHOOK_PATH
+from web.main import app
+
+UPDATE = {
+    'update_id': 1001,
+    'message': {
+        'message_id': 1,
+        'date': 1700000000,
+        'chat': {'id': 42, 'type': 'private'},
+        'from': {'id': 42, 'is_bot': False, 'first_name': 'Иван'},
+        'text': '/start',
+    },
+}
+
+
+class TestTelegramWebhook(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        # Приложение PTB не запускается: проверяется только передача обновления в очередь
+        self.telegram_app = Application.builder().token('123456:TEST').updater(None).build()
+        app.state.telegram_app = self.telegram_app
+        secret = patch('bot.webhook.WEBHOOK_SECRET_TOKEN', 'test-secret')
+        secret.start()
+        self.addCleanup(secret.stop)
+        self.client = httpx.AsyncClient(app=app, base_url="http://test")
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        app.state.telegram_app = None
+
+    async def test_update_is_queued(self):
+        response = await self.client.post(WEBHOOK_PATH, json=UPDATE,
+                                          headers={WEBHOOK_SECRET_HEADER: 'test-secret'})
+        self.assertEqual(response.status_code, 200)
+        update = self.telegram_app.update_queue.get_nowait()
+        self.assertEqual(update.update_id, 1001)
+        self.assertEqual(update.effective_chat.id, 42)
+
+    async def test_wrong_secret_is_rejected(self):
+        for headers in ({}, {WEBHOOK_SECRET_HEADER: 'wrong'}):
+            response = await self.client.post(WEBHOOK_PATH, json=UPDATE, headers=headers)
+            self.assertEqual(response.status_code, 403)
+        self.assertTrue(self.telegram_app.update_queue.empty())
+
+    async def test_disabled_without_telegram_app(self):
+        app.state.telegram_app = None
+        response = await self.client.post(WEBHOOK_PATH, json=UPDATE,
+                                          headers={WEBHOOK_SECRET_HEADER: 'test-secret'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_webhook_url(self):
+        self.assertEqual(get_webhook_url('https://example.com/', '/telegram/webhook'),
+                         'https://example.com/telegram/webhook')